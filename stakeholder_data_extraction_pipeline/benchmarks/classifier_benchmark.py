@@ -0,0 +1,119 @@
+"""
+Benchmark file classification (type and paywall detection) over a corpus of downloads: the single-pass prefix classifier
+(ddg_file_detection.classify_file) against the previous detection (full read, one lowercase copy per paywall word).
+Reports files/s and MB/s of both and where their answers differ (paywall phrases beyond the scanned prefix, new types).
+
+run from the repo root:  python -m stakeholder_data_extraction_pipeline.benchmarks.classifier_benchmark --corpus path/to/blobs
+without downloads at hand:  python -m stakeholder_data_extraction_pipeline.benchmarks.classifier_benchmark --synthetic 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.ddg_urls.ddg_file_detection import classify_file
+
+def legacy_classify(filepath):
+    """ the detection before the single-pass classifier: 1kb header for the type, whole file lowered per paywall word """
+    with open(filepath, "rb") as file:
+        header = file.read(1024)
+    if header.startswith(b"%PDF-"):
+        return "pdf", None
+    if not (b"<html" in header.lower() or b"<!doctype html" in header.lower()):
+        return "unknown", None
+
+    with open(filepath, "r", encoding="utf-8", errors="ignore") as file:
+        content = file.read()
+    if len(content) < 200:
+        return "html", "possible paywall"
+    for word in config.PAYWALL_WORDS:
+        if word in content.lower():
+            return "html", "paywall detected"
+    return "html", None
+
+def load_corpus(path):
+    """ every downloaded file under path (temp files of unfinished downloads left out) """
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if not name.endswith(".part"))
+
+def synthetic_corpus(directory, count, seed=0):
+    """ write count html pages (2kb - 1mb, some with a paywall phrase anywhere) and pdf stubs, returns their paths """
+    rng = random.Random(seed)
+    paragraph = "<p>The carbon border adjustment mechanism (CBAM) applies to imports of steel and cement.</p>\n"
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"doc{i}")
+        if i % 5 == 0:
+            body = b"%PDF-1.7\n" + os.urandom(rng.randint(2_000, 500_000))
+        else:
+            paragraphs = [paragraph] * (rng.randint(20, 40_000) // 4 + 1)
+            if rng.random() < 0.3:
+                paragraphs.insert(rng.randrange(len(paragraphs)), f"<div>{rng.choice(config.PAYWALL_WORDS).title()}</div>")
+            body = ("<!doctype html><html><body>\n" + "".join(paragraphs) + "</body></html>").encode()
+        with open(path, "wb") as f:
+            f.write(body)
+        paths.append(path)
+    return paths
+
+def time_classifier(classify, paths, repeat):
+    """ best wall time of repeat passes over all paths and the answers of the last pass """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        answers = [classify(path) for path in paths]
+        best = min(best, time.perf_counter() - start)
+    return best, answers
+
+def run_benchmark(paths, repeat):
+    """ time both classifiers over the corpus, returns one result row per classifier and the differing answers """
+    megabytes = sum(os.path.getsize(path) for path in paths) / 1e6
+    legacy_s, legacy = time_classifier(legacy_classify, paths, repeat)
+    single_s, single = time_classifier(classify_file, paths, repeat)
+
+    # the new classifier knows more types, compare on what the old one could tell (pdf, html, unknown)
+    differences = [(path, old, (new.file_type if new.file_type in ("pdf", "html") else "unknown", new.paywall_status))
+                   for path, old, new in zip(paths, legacy, single)
+                   if old != (new.file_type if new.file_type in ("pdf", "html") else "unknown", new.paywall_status)]
+    rows = [{"classifier": name, "files": len(paths), "MB": megabytes, "seconds": seconds,
+             "files/s": len(paths) / seconds if seconds else 0.0, "MB/s": megabytes / seconds if seconds else 0.0}
+            for name, seconds in (("legacy", legacy_s), ("single-pass", single_s))]
+    return rows, differences
+
+def print_results(rows, differences, show=10):
+    """ print one row per classifier, the speedup and a few differing answers """
+    columns = list(rows[0].keys())
+    print("\n" + "".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        print("".join(f"{value:>14.2f}" if isinstance(value, float) else f"{value:>14}" for value in row.values()))
+    if rows[1]["seconds"]:
+        print(f"\nspeedup: {rows[0]['seconds'] / rows[1]['seconds']:.1f}x")
+    print(f"{len(differences)} files classified differently (legacy -> single-pass)")
+    for path, old, new in differences[:show]:
+        print(f"  {os.path.basename(path)}: {old} -> {new}")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark file type and paywall classification over downloaded files")
+    parser.add_argument("--corpus", default=config.BLOB_DIR, help="directory of downloaded files (default: the blob store)")
+    parser.add_argument("--synthetic", type=int, default=0, help="generate this many files instead of reading a corpus")
+    parser.add_argument("--limit", type=int, default=None, help="classify at most this many files of the corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="passes per classifier, the best is reported")
+    parser.add_argument("--scan-bytes", type=int, default=config.CLASSIFY_SCAN_BYTES, help="prefix scanned by the classifier")
+    parser.add_argument("--extra-phrases", type=int, default=0,
+                        help="add this many random paywall phrases (long lists use the aho-corasick automaton if installed)")
+    args = parser.parse_args()
+    config.CLASSIFY_SCAN_BYTES = args.scan_bytes
+    rng = random.Random(1)
+    config.PAYWALL_WORDS = config.PAYWALL_WORDS + [
+        " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8))) for _ in range(2))
+        for _ in range(args.extra_phrases)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = synthetic_corpus(tmp, args.synthetic) if args.synthetic else load_corpus(args.corpus)[:args.limit]
+        if not paths:
+            print(f"no files in {args.corpus}, run the downloader first or use --synthetic N")
+            return
+        print_results(*run_benchmark(paths, args.repeat))
+
+if __name__ == "__main__":
+    main()
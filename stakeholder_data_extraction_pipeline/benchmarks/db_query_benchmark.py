@@ -0,0 +1,106 @@
+"""
+Benchmark the pipeline's hot queries on a synthetic cbam_data.db, before and after the index migrations.
+
+run from the repo root:  python -m stakeholder_data_extraction_pipeline.benchmarks.db_query_benchmark --urls 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, close_connection, transaction
+from stakeholder_data_extraction_pipeline.database.migrations import run_migrations, MIGRATIONS
+
+LOOKUPS = 1000  # point lookups per lookup query
+
+# legacy duplicate removal (group the whole table) vs indexed correlated lookup (database_clean.remove_duplicate_urls)
+LEGACY_DEDUP = "DELETE FROM urls WHERE id NOT IN (SELECT MIN(id) FROM urls GROUP BY organization_id, url)"
+INDEXED_DEDUP = '''DELETE FROM urls WHERE EXISTS (SELECT 1 FROM urls AS earlier
+                   WHERE earlier.organization_id = urls.organization_id AND earlier.url = urls.url AND earlier.id < urls.id)'''
+
+def populate(n_urls, n_orgs):
+    """ fill the current db with synthetic organizations, urls and extraction rows """
+    rng = random.Random(42)  # same data for both schemas
+    statuses = ["success"] * 80 + ["failure"] * 10 + ["failure_404"] * 5 + ["pending"] * 5
+
+    with transaction() as conn:
+        conn.executemany("INSERT INTO organizations (registered_organisation_title, search_title, category) VALUES (?, ?, ?)",
+                         ((f"Organisation {i}", f"Org {i}", "Companies & groups") for i in range(n_orgs)))
+        conn.executemany('''INSERT INTO urls (organization_id, url, file_path, download_status, file_type)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         ((i % n_orgs + 1, f"https://example{i % 997}.eu/doc/{i}", f"{i % n_orgs + 1}_{i + 1}",
+                           rng.choice(statuses), rng.choice(["html", "pdf"])) for i in range(n_urls)))
+        for table, file_col in (("html_text", "html_file"), ("pdf_text", "pdf_file")):
+            conn.execute(f'''INSERT INTO {table} (id, organization_id, {file_col}, extract_status)
+                             SELECT id, organization_id, file_path,
+                                    CASE WHEN id % 50 = 0 THEN 'pending' ELSE 'success' END
+                             FROM urls WHERE file_type = ?''', (table.split("_")[0],))
+
+def time_query(conn, sql, params_list):
+    """ run sql once per params tuple, return total seconds """
+    start = time.perf_counter()
+    for params in params_list:
+        conn.execute(sql, params).fetchall()
+    return time.perf_counter() - start
+
+def run_benchmark(n_urls, n_orgs, dedup):
+    """ time each query against a db at schema version 1 (no indexes) and at the latest version """
+    rng = random.Random(7)
+    url_lookups = [(i % n_orgs + 1, f"https://example{i % 997}.eu/doc/{i}") for i in rng.sample(range(n_urls), LOOKUPS)]
+    org_lookups = [(f"Org {rng.randrange(n_orgs)}",) for _ in range(LOOKUPS)]
+
+    queries = [
+        ("pending downloads", "SELECT id, organization_id, url, file_path FROM urls WHERE download_status = 'pending'", [()]),
+        ("pending html", "SELECT id, organization_id, html_file FROM html_text WHERE extract_status = 'pending'", [()]),
+        ("pending pdf", "SELECT id FROM pdf_text WHERE extract_status = 'pending' OR extract_status = 'failure'", [()]),
+        (f"url exists x{LOOKUPS}", "SELECT 1 FROM urls WHERE organization_id = ? AND url = ?", url_lookups),
+        (f"org id x{LOOKUPS}", "SELECT id FROM organizations WHERE search_title = ?", org_lookups),
+    ]
+
+    original_path = config.DB_PATH
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, target in (("v1 (no indexes)", 1), (f"v{MIGRATIONS[-1][0]} (indexed)", None)):
+            config.DB_PATH = os.path.join(tmp, f"bench_{target}.db")
+            try:
+                run_migrations(target)
+                populate(n_urls, n_orgs)
+                conn = get_connection()
+                conn.execute("ANALYZE")  # give the planner statistics, as a long lived db would have
+
+                for name, sql, params in queries:
+                    results.setdefault(name, {})[label] = time_query(conn, sql, params)
+
+                if dedup:
+                    sql = LEGACY_DEDUP if target == 1 else INDEXED_DEDUP
+                    results.setdefault("remove duplicates", {})[label] = time_query(conn, sql, [()])
+            finally:
+                close_connection()
+                config.DB_PATH = original_path
+
+    return results
+
+def print_results(results, n_urls):
+    """ print one row per query with timings in milliseconds and the speedup """
+    labels = list(next(iter(results.values())).keys())
+    print(f"\nquery timings at {n_urls:,} url rows (ms)")
+    print(f"{'query':<22}" + "".join(f"{label:>20}" for label in labels) + f"{'speedup':>10}")
+    for name, timings in results.items():
+        before, after = timings[labels[0]], timings[labels[-1]]
+        speedup = before / after if after else float("inf")
+        print(f"{name:<22}" + "".join(f"{timings[label] * 1000:>20.1f}" for label in labels) + f"{speedup:>9.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark cbam_data.db queries before and after index migrations")
+    parser.add_argument("--urls", type=int, default=100000, help="number of url rows")
+    parser.add_argument("--orgs", type=int, default=5000, help="number of organizations")
+    parser.add_argument("--skip-dedup", action="store_true", help="skip the duplicate removal query")
+    args = parser.parse_args()
+
+    print_results(run_benchmark(args.urls, args.orgs, not args.skip_dedup), args.urls)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark the search stage (scheduler, rate limiter, retry state) against the local fixture provider, no network.
+Each scenario injects a failure rate (half rate limits, half timeouts by default) and reports orgs/minute and how long
+failed orgs take to recover. Backoff and retry delays are scaled down so a scenario takes seconds instead of hours.
+
+run from the repo root:  python -m stakeholder_data_extraction_pipeline.benchmarks.search_benchmark --orgs 300 --failure-rates 0 0.05 0.2
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import close_connection
+from stakeholder_data_extraction_pipeline.database.migrations import run_migrations
+from stakeholder_data_extraction_pipeline.ddg_urls import ddg_search
+from stakeholder_data_extraction_pipeline.ddg_urls.search_providers import LocalFixtureProvider
+
+def scaled_config(args, tmp):
+    """ config overrides for one scenario: temp db/logs, local provider and shortened delays """
+    return {
+        "DB_PATH": os.path.join(tmp, "bench.db"),
+        "LOGS_DIR": tmp,
+        "SEARCH_LIMITER_STATE": os.path.join(tmp, "search_rate_limiter.json"),
+        "SEARCH_PROVIDER": "local",
+        "SEARCH_REPLAY": False,
+        "SEARCH_WORKERS": args.workers,
+        "SEARCH_RATE_PER_MIN": args.rate,
+        "SEARCH_MIN_RATE_PER_MIN": args.rate / 10,
+        "SEARCH_MAX_RATE_PER_MIN": args.rate * 5,
+        "SEARCH_RATE_INCREASE": args.rate / 20,
+        "SEARCH_BACKOFF_SECONDS": args.backoff,
+        "SEARCH_MAX_BACKOFF_SECONDS": args.backoff * 16,
+        "SEARCH_RETRY_BASE_SECONDS": args.retry_base,
+        "SEARCH_RETRY_MAX_SECONDS": args.retry_base * 32,
+        "SEARCH_RETRY_WINDOW_SECONDS": args.retry_base * 64,
+    }
+
+def recovery_times(calls):
+    """ seconds from the first failed request of each query to its next successful one, and queries never recovered """
+    first_failure, recovered = {}, {}
+    for ts, query, outcome in sorted(calls):
+        if outcome == "ok":
+            if query in first_failure and query not in recovered:
+                recovered[query] = ts - first_failure[query]
+        else:
+            first_failure.setdefault(query, ts)
+    return list(recovered.values()), len(first_failure) - len(recovered)
+
+def run_scenario(args, failure_rate):
+    """ search args.orgs synthetic orgs once with the given failure rate, returns the scenario metrics """
+    provider = LocalFixtureProvider(latency=args.latency,
+                                    rate_limit_rate=failure_rate * args.rate_limit_share,
+                                    timeout_rate=failure_rate * (1 - args.rate_limit_share),
+                                    partial_rate=args.partial, max_rate_per_min=args.provider_limit, seed=args.seed)
+    orgs = [f"Benchmark Org {i}" for i in range(args.orgs)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        overrides = scaled_config(args, tmp)
+        original = {name: getattr(config, name) for name in overrides}
+        try:
+            for name, value in overrides.items():
+                setattr(config, name, value)
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with quiet:
+                run_migrations()
+                start = time.perf_counter()
+                ddg_search.perform_search(orgs, provider=provider)
+                wall = time.perf_counter() - start
+
+            done = len(ddg_search.get_journal().done_orgs() & set(orgs))
+        finally:
+            close_connection()
+            for name, value in original.items():
+                setattr(config, name, value)
+
+    recovered, unrecovered = recovery_times(provider.calls)
+    return {"failure rate": failure_rate,
+            "requests": len(provider.calls),
+            "failed requests": sum(outcome != "ok" for _, _, outcome in provider.calls),
+            "orgs done": done,
+            "wall s": wall,
+            "orgs/min": done / wall * 60 if wall else 0.0,
+            "recovery mean s": statistics.mean(recovered) if recovered else 0.0,
+            "recovery max s": max(recovered, default=0.0),
+            "unrecovered": unrecovered}
+
+def print_results(results):
+    """ print one row per scenario """
+    columns = list(results[0].keys())
+    print("\n" + "".join(f"{column:>17}" for column in columns))
+    for row in results:
+        print("".join(f"{value:>17.2f}" if isinstance(value, float) else f"{value:>17}" for value in row.values()))
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the search stage against the local fixture provider")
+    parser.add_argument("--orgs", type=int, default=200, help="organizations searched per scenario")
+    parser.add_argument("--failure-rates", type=float, nargs="+", default=[0.0, 0.05, 0.2], help="injected failure rates")
+    parser.add_argument("--rate-limit-share", type=float, default=0.5, help="share of failures that are rate limits (rest time out)")
+    parser.add_argument("--partial", type=float, default=0.0, help="rate of partial result lists")
+    parser.add_argument("--provider-limit", type=float, default=None, help="provider rate limits above this many requests/min")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean seconds per request")
+    parser.add_argument("--workers", type=int, default=config.SEARCH_WORKERS, help="search workers")
+    parser.add_argument("--rate", type=float, default=600, help="starting limiter rate (requests/min)")
+    parser.add_argument("--backoff", type=float, default=0.2, help="limiter pause after a rate limit (seconds)")
+    parser.add_argument("--retry-base", type=float, default=0.5, help="first retry delay of a failed org (seconds)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the injected failures")
+    parser.add_argument("--verbose", action="store_true", help="show the search log")
+    args = parser.parse_args()
+
+    print_results([run_scenario(args, rate) for rate in args.failure_rates])
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,55 @@ DATA_DIR = os.path.join(BASE_DIR, "data")                          # folder to s
 RAW_DATA_DIR = os.path.join(DATA_DIR, "raw_data")                  # folder to store raw data
 PROCESSED_DATA_DIR = os.path.join(DATA_DIR, "processed_data")      # folder to store processed data
 URL_DOWNLOADS_DIR = os.path.join(RAW_DATA_DIR, "url_downloads")    # folder to store url downloaded 
+BLOB_DIR = os.path.join(URL_DOWNLOADS_DIR, "blobs")                # downloads stored once per sha-256 (see ddg_urls/blob_store.py)
 LOGS_DIR = os.path.join(RAW_DATA_DIR, "logs")                      # folder to store records/error logs
 EXTRACTED_HTML_DIR = os.path.join(PROCESSED_DATA_DIR, "html_text") # folder to store extracted html json
 EXTRACTED_PDF_DIR = os.path.join(PROCESSED_DATA_DIR, "pdf_text")   # folder to store extracted pdf json
 DB_PATH = os.path.join(DATA_DIR, "cbam_data.db")                   # sqlite database file
 
+# database settings  # shared connection pragmas (see database/connection.py)
+DB_BUSY_TIMEOUT_MS = 30000       # how long to wait on a locked db before raising
+DB_LOCK_RETRIES = 5              # extra attempts to begin a transaction after the busy timeout
+DB_SYNCHRONOUS = "NORMAL"        # fsync level, NORMAL is durable enough in wal mode
+DB_CACHE_SIZE_KB = 64000         # page cache per connection (~64mb)
+DB_MMAP_SIZE = 268435456         # memory mapped i/o (256mb)
+DB_WRITE_BATCH_SIZE = 100        # downloader status rows per write transaction
+DB_WRITE_FLUSH_MS = 500          # max time a status row waits before its batch is written
+DB_WRITE_QUEUE_SIZE = 1000       # pending status rows before download workers wait on the writer
+
+# download settings  # bodies are streamed to a temp file in chunks, memory stays flat whatever the server sends
+DOWNLOAD_CHUNK_SIZE = 65536                 # bytes read from the response per write
+DOWNLOAD_MAX_BYTES = 100 * 1024 * 1024      # larger responses are dropped with download_status 'too_large'
+DOWNLOAD_WORKERS = 50                       # download tasks pulling claimed urls from the queue (urls of busy hosts wait in the queue)
+DOWNLOAD_QUEUE_SIZE = 200                   # claimed urls waiting for a download task, the claimer pauses when full
+CLASSIFY_WORKERS = 2                        # threads scanning stored html for paywalls, off the download event loop
+CLASSIFY_SCAN_BYTES = 262144                # prefix of a stored file scanned for its type and paywall phrases (ddg_file_detection.py)
+CLASSIFY_QUEUE_SIZE = 100                   # stored bodies waiting for classification, downloads pause when full
+DOWNLOAD_PROGRESS_SECONDS = 10              # interval of the downloader's progress line
+DOWNLOAD_MAX_CONNECTIONS = 20               # requests in flight across all hosts (ddg_urls/host_scheduler.py)
+DOWNLOAD_PER_HOST_CONNECTIONS = 2           # requests in flight to one host
+DOWNLOAD_HOST_DELAY_SECONDS = 1.0           # minimum time between request starts to the same host
+DOWNLOAD_HOST_JITTER_SECONDS = 2.0          # random extra delay per request (0 - this), on top of the minimum
+DOWNLOAD_DNS_CACHE_SECONDS = 300            # resolved host names are reused this long
+DOWNLOAD_KEEPALIVE_SECONDS = 30             # idle connections are kept open this long for the next request to the host
+DOWNLOAD_MAX_ATTEMPTS = 4                   # attempts of a url failing transiently (timeouts, 5xx, 429) before it is given up
+DOWNLOAD_RETRY_BASE_SECONDS = 15            # wait before the first retry, doubled per attempt and jittered (0.5x - 1.5x)
+DOWNLOAD_RETRY_MAX_SECONDS = 600            # longest wait between two attempts
+DOWNLOAD_RETRY_WINDOW_SECONDS = 300         # the downloader waits for retries due within this window, later ones go to the next run
+DOWNLOAD_RETRY_AFTER_SECONDS = 30           # host pause after a 429/503 without Retry-After
+DOWNLOAD_MAX_RETRY_AFTER_SECONDS = 300      # longer Retry-After values are capped to this
+DOWNLOAD_SNIFF_BYTES = 4096                 # first bytes of a body checked for its file type before the rest is read
+DOWNLOAD_SKIPPED_CONTENT_TYPES = ("video/", "audio/", "image/", "font/", "application/zip", "application/gzip",
+                                  "application/x-tar", "application/x-7z-compressed", "application/vnd.rar",
+                                  "application/x-rar-compressed", "application/x-msdownload")  # aborted as 'skipped_type'
+DOWNLOAD_SKIPPED_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".mp3", ".wav", ".jpg", ".jpeg", ".png", ".gif",
+                               ".webp", ".svg", ".zip", ".gz", ".tar", ".7z", ".rar", ".exe", ".iso")  # same, by file name
+DOWNLOAD_REFRESH = False                    # re-check earlier downloads (conditional GET), only changed ones are re-extracted (main.py --refresh)
+
+# worker settings  # several downloader/extraction processes can share the db queues (see database/work_queue.py)
+WORKER_LEASE_SECONDS = 600       # a claimed row is given to another worker if not finished or renewed in time
+CLAIM_BATCH_SIZE = 50            # rows claimed per round trip
+
 # stakeholder settings
 STAKEHOLDER_FILE = "master_thesis_2025/stakeholder_data_extraction_pipeline/data/input_data/organisation_titles.xlsx" # excel with stakeholder info
 STAKEHOLDER_SHEET = "clean"  # sheet name in excel
@@ -21,10 +65,49 @@ STAKEHOLDER_SHEET = "clean"  # sheet name in excel
 SEARCH_QUERY = "+CBAM future" # FIRST TRY "CBAM (future OR issue OR concern OR strategy OR feedback)"  # keyword for ddg search
 MAX_RESULTS = 20    # max ddg results per organization
 
+# search scheduler settings  # parallel searches behind an adaptive rate limiter (see ddg_urls/search_scheduler.py)
+SEARCH_WORKERS = 3                  # searches in flight at once, each worker has its own DDGS session
+SEARCH_RATE_PER_MIN = 12            # starting request rate (the last saved rate is used if there is one)
+SEARCH_MIN_RATE_PER_MIN = 2         # rate never drops below this
+SEARCH_MAX_RATE_PER_MIN = 60        # rate never grows above this
+SEARCH_RATE_INCREASE = 1            # requests/min added after each successful search
+SEARCH_RATE_DECREASE = 0.5          # rate multiplied by this on a rate limit or timeout
+SEARCH_BACKOFF_SECONDS = 10         # pause after the first rate limit, doubled on each one in a row
+SEARCH_MAX_BACKOFF_SECONDS = 600    # longest pause
+SEARCH_LIMITER_STATE = os.path.join(LOGS_DIR, "search_rate_limiter.json")  # limiter state kept between runs
+SEARCH_MAX_ATTEMPTS = 5             # failed searches in a row before an org is left for manual inspection
+SEARCH_RETRY_BASE_SECONDS = 30      # wait before retrying a failed org, doubled on each failure in a row
+SEARCH_RETRY_MAX_SECONDS = 1800     # longest wait between retries of one org
+SEARCH_RETRY_WINDOW_SECONDS = 600   # a search pass waits for retries due within this window, later ones go to the next run
+SEARCH_BACKEND = "auto"             # ddgs backend, part of the cache key
+SEARCH_CACHE_TTL_DAYS = 30          # cached search results older than this are fetched again
+SEARCH_REPLAY = False               # serve searches only from the cache, no network (main.py --replay)
+SEARCH_PROVIDER = "ddg"             # 'ddg' (live duckduckgo) or 'local' (fixture corpus for load tests, ddg_urls/search_providers.py)
+SEARCH_FIXTURE = None               # json corpus {query: [results]} for the local provider, None = synthetic results
+
 # filtering settings  
 PLATFORMS = ['linkedin', 'facebook', 'instagram', 'twitter', 'tiktok', 'tandfonline', 'wikipedia', 'sciencedirect', 'springer', 'researchgate', 'glassdoor']  # platforms to filter
 GOOGLE_SEARCH_PATTERN = r"https?://(www\.)?google\.com/search\?.*"         # pattern to remove google search urls
 
+# relevance settings  # cheap cbam score of each search result, only the best urls per organization are downloaded (ddg_urls/relevance.py)
+RELEVANCE_KEYWORDS = {                      # keyword or phrase -> weight (case-insensitive, whole words)
+    "carbon border adjustment mechanism": 4.0, "carbon border adjustment": 3.0, "cbam": 3.0, "carbon border": 2.0,
+    "carbon leakage": 2.0, "embedded emissions": 2.0, "embodied emissions": 1.5, "emissions trading": 1.0,
+    "eu ets": 1.0, "free allocation": 1.0, "position paper": 2.0, "consultation": 1.5, "feedback": 1.0,
+    "statement": 0.5, "response": 0.5, "importers": 0.5, "steel": 0.5, "aluminium": 0.5, "cement": 0.5,
+    "fertilisers": 0.5, "fertilizers": 0.5, "hydrogen": 0.5, "electricity": 0.25,
+}
+RELEVANCE_TITLE_WEIGHT = 2.0                # keyword weights are multiplied by this when found in the result title
+RELEVANCE_URL_WEIGHT = 0.5                  # ... and by this when only found in the url
+RELEVANCE_DOMAIN_PRIORS = {                 # domain (and its subdomains) -> score added, most specific domain wins
+    "europa.eu": 2.0, "eur-lex.europa.eu": 2.5, "consilium.europa.eu": 2.0, "europarl.europa.eu": 2.0,
+    "youtube.com": -3.0, "amazon.com": -3.0, "indeed.com": -3.0, "pinterest.com": -3.0, "reddit.com": -1.0,
+}
+RELEVANCE_OWN_DOMAIN_BOOST = 3.0            # added for urls on the organization's own website
+RELEVANCE_PDF_BOOST = 1.0                   # added for direct pdf links (position papers, consultation responses)
+RELEVANCE_TOP_K = 10                        # best urls per organization kept for download, None = keep all
+RELEVANCE_MIN_SCORE = 1.0                   # urls scoring below this are not downloaded, None = no threshold
+
 # extraction settings  # paywall keywords and pdf extraction batch size
 PAYWALL_WORDS = ["log in to read", "paywall", "membership required", "register to continue"]  # paywall indicators
 PDF_BATCH_SIZE = 8  # batch size for pdf extraction tasks
\ No newline at end of file
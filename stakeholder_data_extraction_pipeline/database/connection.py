@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from stakeholder_data_extraction_pipeline import config
+
+# one connection per thread and db path  # sqlite connections should not be shared across threads
+_local = threading.local()
+
+def connect(db_path=None):
+    """ open a new sqlite connection with wal journaling and tuned pragmas """
+    db_path = db_path or config.DB_PATH
+
+    # isolation_level=None so transactions are only opened explicitly (see transaction())
+    conn = sqlite3.connect(db_path,
+                           timeout=config.DB_BUSY_TIMEOUT_MS / 1000, # wait on locks instead of failing
+                           isolation_level=None,                     # autocommit unless in transaction()
+                           check_same_thread=False)                  # allow use from executor threads
+
+    conn.execute("PRAGMA journal_mode = WAL")                            # readers and one writer at the same time
+    conn.execute(f"PRAGMA synchronous = {config.DB_SYNCHRONOUS}")        # NORMAL is safe with wal
+    conn.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}")      # negative value = size in kb
+    conn.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}")            # memory map the db file
+    conn.execute(f"PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT_MS}")   # wait for locks held by other processes
+    conn.execute("PRAGMA temp_store = MEMORY")                           # temp tables and indexes in memory
+    conn.execute("PRAGMA foreign_keys = ON")                             # enforce organization references
+    return conn
+
+def get_connection():
+    """ return the shared connection for the current thread, opening it on first use """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}  # db path -> connection
+
+    # key on the path so tests that point config.DB_PATH elsewhere get their own connection
+    conn = connections.get(config.DB_PATH)
+    if conn is None:
+        conn = connections[config.DB_PATH] = connect()
+    return conn
+
+def close_connection():
+    """ close all shared connections opened by the current thread """
+    connections = getattr(_local, "connections", {})
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+@contextmanager
+def transaction(immediate=True):
+    """
+    Context managed transaction on the shared connection, commits on success and rolls back on error.
+    immediate=True takes the write lock up front so two writers never deadlock upgrading a read lock.
+    Nested calls join the outer transaction.
+    """
+    conn = get_connection()
+
+    # already inside a transaction, let the outer block commit
+    if conn.in_transaction:
+        yield conn
+        return
+
+    begin_transaction(conn, immediate)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()  # undo partial writes
+        raise
+    else:
+        conn.commit()
+
+def begin_transaction(conn, immediate=True):
+    """ begin a transaction, retrying briefly if the busy timeout expires on a locked db """
+    statement = "BEGIN IMMEDIATE" if immediate else "BEGIN"
+
+    for attempt in range(config.DB_LOCK_RETRIES):
+        try:
+            conn.execute(statement)
+            return
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e).lower() or attempt == config.DB_LOCK_RETRIES - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))  # short backoff on top of the busy timeout
@@ -1,82 +1,74 @@
 import sqlite3
-from stakeholder_data_extraction_pipeline import config
-import re
+from .connection import transaction
+from .url_domains import backfill_url_domains, remove_blocked_urls, blocklist_stats
 
 def remove_noresults_urls():
-    """Removes URLs that are labeled as 'no_results'."""
-    conn = None # ensure conn exists
+    """Removes URLs that are labeled as 'no_results', returns the number of rows removed."""
+    removed = 0
     
     try:
-        # connect to db and remove orgs without any urls saved
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        c.execute("DELETE FROM urls WHERE url = 'no_results'")
-        c.execute("DELETE FROM urls WHERE url = 'error'")
-        c.execute("DELETE FROM urls WHERE url = 'timed_out'")
-        conn.commit()
+        # remove orgs without any urls saved
+        with transaction() as conn:
+            c = conn.cursor()
+            c.execute("DELETE FROM urls WHERE url = 'no_results'")
+            removed += c.rowcount
+            c.execute("DELETE FROM urls WHERE url = 'error'")
+            removed += c.rowcount
+            c.execute("DELETE FROM urls WHERE url = 'timed_out'")
+            removed += c.rowcount
+            c.execute("DELETE FROM urls WHERE url = 'rate_limited'")
+            removed += c.rowcount
     
     except sqlite3.Error as e:
         print(f"Error removing 'no_results' URLs: {e}")
     
-    finally:
-        if conn:
-            conn.close() # close db connection
+    return removed
 
 def remove_duplicate_urls():
-    """Removes duplicate URLs, keeping the first instance."""
-    conn = None # ensure conn exists
+    """Removes duplicate URLs, keeping the first instance, returns the number of rows removed."""
+    removed = 0
     
     try:
-        # connect to db and remove duplicate urls
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        c.execute('''
-            DELETE FROM urls
-            WHERE id NOT IN (
-                SELECT MIN(id)
-                FROM urls
-                GROUP BY organization_id, url
-            )
-        ''')
-        conn.commit()
+        # remove duplicate urls
+        with transaction() as conn:
+            c = conn.cursor()
+            # correlated lookup on the (organization_id, url) index instead of grouping the whole table
+            # (new dbs already reject duplicates at insert time via the unique index)
+            c.execute('''
+                DELETE FROM urls
+                WHERE EXISTS (
+                    SELECT 1 FROM urls AS earlier
+                    WHERE earlier.organization_id = urls.organization_id
+                    AND earlier.url = urls.url
+                    AND earlier.id < urls.id
+                )
+            ''')
+            removed = c.rowcount
     
     except sqlite3.Error as e:
         print(f"Error removing duplicate URLs: {e}")
     
-    finally:
-        if conn:
-            conn.close() # close db connection
-
-def regexp(pattern, string): 
-    """ Custom REGEXP function for SQLite queries"""
-    
-    if string is None: 
-        return False
-    return re.search(pattern, string) is not None
+    return removed
 
 def filter_unwanted_urls():
-    """Removes social media URLs and Google search results."""
+    """Removes social media URLs and Google search results, returns the number of rows removed.
     
-    conn = None # ensure conn exists
+    New urls are already rejected at ingestion, this catches rows stored before the blocklist existed
+    (or before a rule was added) with indexed lookups on the parsed site column.
+    """
+    removed = 0
     
     try:
-        # connect to db 
-        conn = sqlite3.connect(config.DB_PATH)
-        conn.create_function("REGEXP", 2, regexp) # create user regexp user function
-        c = conn.cursor()
-        
-        # remove social media URLs (out of scope )
-        platform_pattern = '|'.join(config.PLATFORMS)  
-        c.execute("DELETE FROM urls WHERE url REGEXP ?", (platform_pattern,))
-        
-        # remove Google search results (found during manual exploration)
-        c.execute("DELETE FROM urls WHERE url REGEXP ?", (config.GOOGLE_SEARCH_PATTERN,))
+        backfill_url_domains()           # parse host columns for older rows
+        dropped = remove_blocked_urls()  # rule -> rows removed
+        removed = sum(dropped.values())
         
-        conn.commit()
+        # per-rule counters include urls rejected at ingestion
+        for rule, site, total in blocklist_stats():
+            if total:
+                print(f"{rule}: {dropped.get(rule, 0)} removed now, {total} dropped in total")
     
     except sqlite3.Error as e:
         print(f"Error filtering unwanted URLs: {e}")
     
-    finally:
-        if conn:
-            conn.close() # close db connection
+    return removed
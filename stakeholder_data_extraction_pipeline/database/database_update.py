@@ -1,38 +1,28 @@
 import sqlite3
 import pandas as pd
 from stakeholder_data_extraction_pipeline import config
+from .connection import get_connection, transaction
+from .url_domains import parse_url_domain, load_blocklist, match_blocklist, record_drops
+from collections import Counter
 
 def insert_organization(registered_title, search_title, category):
     """Inserts an organization into the organizations table (ignores duplicates)."""
-    conn = None # ensure conn exists
     
     try:
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        
         # add orgs official title, search title and transparency registry category to the db
-        c.execute('INSERT OR IGNORE INTO organizations (registered_organisation_title, search_title, category) VALUES (?, ?, ?)', 
-                  (registered_title, search_title, category))
-        conn.commit() # add info to db
+        with transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO organizations (registered_organisation_title, search_title, category) VALUES (?, ?, ?)', 
+                         (registered_title, search_title, category))
     
     except sqlite3.Error as e:
         print(f"Error inserting organization: {e}")
-    
-    finally:
-        if conn:
-            conn.close() # close db connection
 
 def get_organization_id(search_title):
     """Retrieves an organization ID by search title."""
-    conn = None # ensure conn exists
     
     try:
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        
         # extract org id based on search title input
+        c = get_connection().cursor()
         c.execute('SELECT id FROM organizations WHERE search_title = ?', (search_title,))
         row = c.fetchone()
         return row[0] if row else None
@@ -40,59 +30,112 @@ def get_organization_id(search_title):
     except sqlite3.Error as e:
         print(f"Error fetching organization ID: {e}")
         return None
+
+def upsert_organizations(df):
+    """
+    Insert or update all organizations from a stakeholder dataframe (ddg_search.load_stakeholders) in one transaction.
+    Returns a search_title -> organization ids map that url ingestion can reuse.
+    """
+    # one tuple per org, skip incomplete rows (all three columns are NOT NULL in the schema)
+    orgs = df[['org_title', 'search_title', 'reg_category']].dropna()
+    orgs = orgs.drop_duplicates(subset='org_title', keep='first')  # first row wins, as with INSERT OR IGNORE
+    rows = list(orgs.itertuples(index=False, name=None))
+
+    try:
+        with transaction() as conn:
+            conn.executemany('''INSERT INTO organizations (registered_organisation_title, search_title, category)
+                                VALUES (?, ?, ?)
+                                ON CONFLICT(registered_organisation_title) DO UPDATE SET
+                                    search_title = excluded.search_title,
+                                    category = excluded.category''', rows)
+            org_ids = load_organization_ids()  # read inside the transaction so the map matches what was written
     
-    finally:
-        if conn:
-            conn.close() # close db connection
+    except sqlite3.Error as e:
+        print(f"Error inserting organizations: {e}")
+        return {}
+    
+    print(f"upserted {len(rows)} organizations")
+    return org_ids
 
 def read_org_data(df):
-    """Inserts multiple organizations from a dataframe."""
+    """Inserts multiple organizations from a dataframe, returns the search_title -> ids map."""
+    return upsert_organizations(df)
 
-    for _, row in df.iterrows():
-        insert_organization(row['org_title'], row['search_title'], row['reg_category'])
+def load_organization_ids():
+    """ map search title -> ids of every organization searched under it (ascending) in one query """
+    org_ids = {}
+    for search_title, organization_id in get_connection().execute('SELECT search_title, id FROM organizations ORDER BY id'):
+        org_ids.setdefault(search_title, []).append(organization_id)
+    return org_ids
 
-def add_ddg_urls(json_data):
-    """Inserts DuckDuckGo search results into the URLs table."""
-    conn = None # ensure conn exists
+def add_urls_bulk(records, org_ids=None):
+    """
+    Insert (search_title, url) or (search_title, url, title, snippet) records into the URLs table in one transaction.
     
-    try:
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH) 
-        c = conn.cursor()
+    - Organization ids are resolved from one in-memory map (pass org_ids to reuse an existing one), a url found for a
+      search title is added to every organization sharing that search title.
+    - Each url is parsed once into host / registered domain / site, and urls on the blocklist
+      (social media, google searches) are rejected before insert, counted per rule.
+    - Duplicates for the same organization are ignored by the UNIQUE(organization_id, url) index.
+    - file_path ("orgid_urlid") is derived from the assigned row id in one update.
+    Returns (inserted, skipped) counts.
+    """
+    if org_ids is None:
+        org_ids = load_organization_ids()  # one query instead of one per url
+    blocklist = load_blocklist()
+    
+    rows = []           # (organization_id, url, host, registered_domain, site, title, snippet) rows to insert
+    unknown_orgs = 0    # urls whose org is not in the organizations table
+    blocked = Counter() # blocklist rule -> urls rejected
+    
+    for org_name, url, *details in records:
+        organization_ids = org_ids.get(org_name)
+        if not organization_ids:
+            unknown_orgs += 1
+            continue
         
-        # loop through ddg search results (from ddg_search)
-        for data in json_data:
-            org_name = data['org']                          # extract org name
-            url = data['url']                               # extract url
-            organization_id = get_organization_id(org_name) # extract org id (for metadata)
-            
-            # if org exists, create url id and file names for each url
-            if organization_id is not None:
-                # find largest current id, and if none exist then start at 1
-                c.execute('SELECT MAX(id) FROM urls')
-                result = c.fetchone()
-                url_id = result[0] + 1 if result[0] is not None else 1
-                file_name = f"{organization_id}_{url_id}"
-                
-                # add data to urls table (if doesn't already exist)
-                c.execute('SELECT 1 FROM urls WHERE organization_id = ? AND url = ?', (organization_id, url))
-                exists = c.fetchone()
+        host, registered_domain, site = parse_url_domain(url)
+        rule = match_blocklist(url, site, blocklist)
+        if rule:
+            blocked[rule] += 1
+            continue
+        title, snippet = (list(details) + [None, None])[:2]  # search result text, scored by ddg_urls/relevance.py
+        rows.extend((organization_id, url, host, registered_domain, site, title or None, snippet or None)
+                    for organization_id in organization_ids)
 
-                if not exists:
-                    c.execute('''INSERT INTO urls (organization_id, url, file_path, download_status, timestamp)
-                                VALUES (?, ?, ?, ?, ?)''', 
-                            (organization_id, url, file_name, 'pending', None))
-        
-        conn.commit() # add changes to db
+    try:
+        with transaction() as conn:
+            # everything inserted below gets an id above the current max
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM urls').fetchone()[0]
+            changes_before = conn.total_changes
+            
+            conn.executemany('''INSERT OR IGNORE INTO urls (organization_id, url, host, registered_domain, site, title, snippet,
+                                                          download_status, timestamp)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', NULL)''', rows)
+            inserted = conn.total_changes - changes_before
+            
+            # build file names from the assigned ids (rowid range scan, only new rows)
+            conn.execute('''UPDATE urls SET file_path = organization_id || '_' || id
+                            WHERE id > ? AND file_path IS NULL''', (last_id,))
+            record_drops(conn, blocked)
     
     except sqlite3.Error as e:
         print(f"error inserting URLs: {e}")
+        return 0, len(rows) + unknown_orgs + sum(blocked.values())
     
-    finally:
-        if conn:
-            conn.close() # close db connection
+    duplicates = len(rows) - inserted
+    print(f"inserted {inserted} urls, skipped {duplicates} duplicates, {sum(blocked.values())} blocked "
+          f"and {unknown_orgs} with unknown organizations")
+    return inserted, duplicates + unknown_orgs + sum(blocked.values())
 
-def add_ddg_urls_csv():
+def add_ddg_urls(json_data, org_ids=None):
+    """Inserts DuckDuckGo search results into the URLs table."""
+    
+    # loop through ddg search results (from ddg_search)
+    records = ((data['org'], data['url'], data.get('title'), data.get('snippet')) for data in json_data)
+    return add_urls_bulk(records, org_ids)
+
+def add_ddg_urls_csv(org_ids=None):
     """Reads URLs from a CSV file and inserts them into the database.
     
     - Keeps duplicates across different organizations.
@@ -107,35 +150,12 @@ def add_ddg_urls_csv():
     if not {'organisation', 'url'}.issubset(df.columns):
         raise ValueError("CSV file must contain 'org' and 'url' columns")
 
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-
-    for _, row in df.iterrows():
-        org_name = row['organisation'].strip()
-        url = row['url'].strip()
-
-        # Get organization ID
-        organization_id = get_organization_id(org_name)
-
-        if organization_id is not None:
-            # Check if this URL already exists for this specific organization
-            cursor.execute("SELECT 1 FROM urls WHERE organization_id = ? AND url = ?", (organization_id, url))
-            exists = cursor.fetchone()
-
-            if not exists:  # Insert only if this URL is new for the organization
-                # Generate a new ID for the URL (if needed)
-                cursor.execute("SELECT MAX(id) FROM urls")
-                result = cursor.fetchone()
-                url_id = result[0] + 1 if result[0] is not None else 1
-
-                # File name based on org ID and new URL ID
-                file_name = f"{organization_id}_{url_id}"
-
-                # Insert the URL into the database
-                cursor.execute('''INSERT INTO urls (organization_id, url, file_path, download_status, timestamp)
-                                  VALUES (?, ?, ?, ?, ?)''',
-                               (organization_id, url, file_name, 'pending', None))
+    # strip whitespace column-wise and drop incomplete rows (title/snippet are only in csvs written since relevance scoring)
+    df = df.dropna(subset=['organisation', 'url'])
+    titles = df['title'].fillna('') if 'title' in df.columns else [None] * len(df)
+    snippets = df['snippet'].fillna('') if 'snippet' in df.columns else [None] * len(df)
+    records = zip(df['organisation'].str.strip(), df['url'].str.strip(), titles, snippets)
 
-    conn.commit()
-    conn.close()
-    print("✅ URLs inserted successfully from CSV!")
\ No newline at end of file
+    inserted, skipped = add_urls_bulk(records, org_ids)
+    print("✅ URLs inserted successfully from CSV!")
+    return inserted, skipped
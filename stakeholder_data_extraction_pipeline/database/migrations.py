@@ -0,0 +1,177 @@
+from datetime import datetime
+from .connection import get_connection, transaction
+
+# ordered schema migrations  # (version, description, list of sql statements)
+# never edit a released migration, append a new one instead
+MIGRATIONS = [
+    (1, "base schema", [
+        '''CREATE TABLE IF NOT EXISTS organizations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                registered_organisation_title TEXT NOT NULL UNIQUE,
+                search_title TEXT NOT NULL,
+                category TEXT NOT NULL)''',
+        '''CREATE TABLE IF NOT EXISTS urls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                organization_id INTEGER,
+                url TEXT NOT NULL,
+                file_path TEXT,
+                download_status TEXT,
+                file_type TEXT,
+                paywall_status TEXT,
+                timestamp TEXT,
+                FOREIGN KEY(organization_id) REFERENCES organizations(id))''',
+        '''CREATE TABLE IF NOT EXISTS html_text (
+                id INTEGER PRIMARY KEY,
+                organization_id INTEGER,
+                html_file TEXT,
+                extracted_text_path TEXT,
+                extract_status TEXT,
+                timestamp TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS pdf_text (
+                id INTEGER PRIMARY KEY,
+                organization_id INTEGER,
+                pdf_file TEXT,
+                extracted_text_path TEXT,
+                extract_status TEXT,
+                timestamp TEXT)''',
+    ]),
+    (2, "unique url per organization", [
+        # drop duplicates left by older runs (keeps the first instance) before adding the constraint
+        '''DELETE FROM urls
+           WHERE id NOT IN (SELECT MIN(id) FROM urls GROUP BY organization_id, url)''',
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_urls_org_url ON urls (organization_id, url)",
+    ]),
+    (3, "query indexes", [
+        # downloader and extraction queues filter on status (and file type)
+        "CREATE INDEX IF NOT EXISTS idx_urls_status_type ON urls (download_status, file_type)",
+        "CREATE INDEX IF NOT EXISTS idx_html_text_status ON html_text (extract_status)",
+        "CREATE INDEX IF NOT EXISTS idx_pdf_text_status ON pdf_text (extract_status)",
+        # covering index for search title -> id lookups
+        "CREATE INDEX IF NOT EXISTS idx_organizations_search_title ON organizations (search_title, id)",
+    ]),
+    (4, "work claim leases", [
+        # worker id, lease expiry and last heartbeat (unix seconds) for work_queue.claim
+        *[f"ALTER TABLE {table} ADD COLUMN {column}"
+          for table in ("urls", "html_text", "pdf_text")
+          for column in ("claimed_by TEXT", "lease_expires REAL", "heartbeat_at REAL")],
+    ]),
+    (5, "pipeline run ledger", [
+        '''CREATE TABLE IF NOT EXISTS pipeline_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT,
+                finished_at TEXT,
+                status TEXT,
+                notes TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS stage_metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER,
+                stage TEXT,
+                started_at TEXT,
+                wall_seconds REAL,
+                cpu_seconds REAL,
+                peak_rss_mb REAL,
+                items INTEGER,
+                failures INTEGER,
+                bytes_read INTEGER,
+                bytes_written INTEGER,
+                details TEXT,
+                error TEXT,
+                FOREIGN KEY(run_id) REFERENCES pipeline_runs(id))''',
+        "CREATE INDEX IF NOT EXISTS idx_stage_metrics_run ON stage_metrics (run_id, stage)",
+    ]),
+    (6, "url domains and blocklist", [
+        # parsed once at ingestion (url_domains.parse_url_domain), older rows are backfilled by the cleaning step
+        "ALTER TABLE urls ADD COLUMN host TEXT",
+        "ALTER TABLE urls ADD COLUMN registered_domain TEXT",
+        "ALTER TABLE urls ADD COLUMN site TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_urls_site ON urls (site)",
+        "CREATE INDEX IF NOT EXISTS idx_urls_registered_domain ON urls (registered_domain)",
+        # rules are synced from config.PLATFORMS and GOOGLE_SEARCH_PATTERN by setup_db
+        '''CREATE TABLE IF NOT EXISTS url_blocklist (
+                rule TEXT PRIMARY KEY,
+                site TEXT NOT NULL,
+                pattern TEXT,
+                dropped INTEGER NOT NULL DEFAULT 0)''',
+        "CREATE INDEX IF NOT EXISTS idx_url_blocklist_site ON url_blocklist (site)",
+    ]),
+    (7, "full-text index over extracted text", [
+        # filled by the html/pdf extraction (text_extraction/text_index.py), rowid = url id
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS document_text_fts USING fts5(
+                title,
+                text,
+                source UNINDEXED,
+                organization_id UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2')''',
+    ]),
+    (8, "content addressed downloads", [
+        # sha-256 of the downloaded body, file_path then points at the shared blob (ddg_urls/blob_store.py)
+        "ALTER TABLE urls ADD COLUMN content_hash TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_urls_content_hash ON urls (content_hash)",
+        # extraction looks up other rows of the same blob to fan results out
+        "CREATE INDEX IF NOT EXISTS idx_html_text_file ON html_text (html_file)",
+        "CREATE INDEX IF NOT EXISTS idx_pdf_text_file ON pdf_text (pdf_file)",
+    ]),
+    (9, "search result cache", [
+        # raw ddg result lists (json) per normalized query (ddg_urls/search_cache.py), fetched_at in unix seconds
+        '''CREATE TABLE IF NOT EXISTS search_cache (
+                query_key TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                max_results INTEGER NOT NULL,
+                query TEXT,
+                results TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (query_key, backend, max_results))''',
+    ]),
+    (10, "search result relevance", [
+        # title and snippet of the search result, relevance score from ddg_urls/relevance.py (NULL until scored)
+        "ALTER TABLE urls ADD COLUMN title TEXT",
+        "ALTER TABLE urls ADD COLUMN snippet TEXT",
+        "ALTER TABLE urls ADD COLUMN relevance_score REAL",
+        "CREATE INDEX IF NOT EXISTS idx_urls_org_score ON urls (organization_id, relevance_score)",
+    ]),
+    (11, "download retry state", [
+        # attempts so far, when a transient failure may be retried (unix seconds) and the last error (ddg_download.py)
+        "ALTER TABLE urls ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE urls ADD COLUMN next_retry_at REAL",
+        "ALTER TABLE urls ADD COLUMN last_error TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_urls_next_retry ON urls (next_retry_at) WHERE next_retry_at IS NOT NULL",
+    ]),
+    (12, "conditional refresh validators", [
+        # validators of the stored body, sent as If-None-Match / If-Modified-Since when a url is refreshed (ddg_download.py)
+        "ALTER TABLE urls ADD COLUMN etag TEXT",
+        "ALTER TABLE urls ADD COLUMN last_modified TEXT",
+        "ALTER TABLE urls ADD COLUMN final_url TEXT",
+    ]),
+]
+
+def schema_version(conn=None):
+    """ return the highest applied migration version (0 for a new or pre-migration db) """
+    conn = conn or get_connection()
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TEXT)''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def run_migrations(target=None):
+    """ apply pending migrations in order (up to target version if given), one transaction per migration """
+    applied = []
+
+    for version, description, statements in MIGRATIONS:
+        if target is not None and version > target:
+            break
+
+        with transaction() as conn:
+            # re-check inside the write lock in case another process migrated first
+            if version <= schema_version(conn):
+                continue
+
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                         (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+        applied.append(version)
+        print(f"applied migration {version}: {description}")
+
+    return applied
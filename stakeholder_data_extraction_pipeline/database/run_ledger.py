@@ -0,0 +1,152 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from .connection import get_connection, transaction
+
+# optional, only used for i/o and peak memory counters where /proc and resource are missing (windows)
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _io_counters():
+    """ bytes read and written by this process so far, (None, None) if the platform does not expose them """
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])  # includes page cache hits, i.e. what the stage asked for
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def _peak_rss_mb():
+    """ peak resident memory of this process so far in mb """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macos, kb on linux
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024  # peak working set on windows
+    return None
+
+def start_run(notes=None):
+    """ record the start of a pipeline run, returns its id """
+    with transaction() as conn:
+        cursor = conn.execute("INSERT INTO pipeline_runs (started_at, status, notes) VALUES (?, 'running', ?)",
+                              (_now(), notes))
+    return cursor.lastrowid
+
+def finish_run(run_id, status="success"):
+    """ mark a pipeline run as finished """
+    with transaction() as conn:
+        conn.execute("UPDATE pipeline_runs SET finished_at = ?, status = ? WHERE id = ?", (_now(), status, run_id))
+
+@contextmanager
+def track_stage(run_id, stage):
+    """
+    Time one pipeline stage and store its metrics in stage_metrics.
+    Yields a dict the stage fills in: items, failures, optional bytes_read/bytes_written (defaults to the
+    process i/o counters) and any extra counts (e.g. pages) which are stored as json details.
+    """
+    metrics = {"items": 0, "failures": 0}
+    started_at = _now()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    read_start, written_start = _io_counters()
+    error = None
+
+    try:
+        yield metrics
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        read_end, written_end = _io_counters()
+        if "bytes_read" not in metrics and read_start is not None:
+            metrics["bytes_read"] = read_end - read_start
+        if "bytes_written" not in metrics and written_start is not None:
+            metrics["bytes_written"] = written_end - written_start
+
+        known = ("items", "failures", "bytes_read", "bytes_written")
+        details = {key: value for key, value in metrics.items() if key not in known}
+
+        try:
+            with transaction() as conn:
+                conn.execute('''INSERT INTO stage_metrics (run_id, stage, started_at, wall_seconds, cpu_seconds, peak_rss_mb,
+                                    items, failures, bytes_read, bytes_written, details, error)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             (run_id, stage, started_at, wall, cpu, _peak_rss_mb(), metrics["items"], metrics["failures"],
+                              metrics.get("bytes_read"), metrics.get("bytes_written"),
+                              json.dumps(details) if details else None, error))
+        except sqlite3.Error as e:
+            print(f"Error recording metrics for stage {stage}: {e}")
+
+def stage_history(last=5):
+    """ stage metrics of the last n runs, newest run first """
+    c = get_connection().cursor()
+    c.execute('''SELECT r.id, r.started_at, r.status, s.stage, s.wall_seconds, s.cpu_seconds, s.peak_rss_mb,
+                        s.items, s.failures, s.bytes_read, s.bytes_written, s.details
+                 FROM pipeline_runs r
+                 JOIN stage_metrics s ON s.run_id = r.id
+                 WHERE r.id IN (SELECT id FROM pipeline_runs ORDER BY id DESC LIMIT ?)
+                 ORDER BY r.id DESC, s.id''', (last,))
+    return c.fetchall()
+
+def print_report(last=5):
+    """ print per-stage timings and throughput for the last n runs, with the change against the previous run """
+    rows = stage_history(last)
+    if not rows:
+        print("no pipeline runs recorded")
+        return
+
+    # stage -> list of rows, newest first, to compare each run with the one before it
+    by_stage = {}
+    for row in rows:
+        by_stage.setdefault(row[3], []).append(row)
+
+    header = f"{'run':>5} {'started':<20} {'wall s':>9} {'cpu s':>9} {'rss mb':>8} {'items':>8} {'items/s':>9} {'mb/s':>7} {'fail':>6} {'vs prev':>8}"
+    for stage, stage_rows in by_stage.items():
+        print(f"\n== {stage} ==")
+        print(header)
+        for i, (run_id, started, status, _, wall, cpu, rss, items, failures, read, written, details) in enumerate(stage_rows):
+            rate = items / wall if wall else 0
+            mb_rate = ((read or 0) + (written or 0)) / 1024 / 1024 / wall if wall else 0
+
+            # throughput change against the previous run of this stage (negative = regression)
+            change = ""
+            if i + 1 < len(stage_rows):
+                prev_wall, prev_items = stage_rows[i + 1][4], stage_rows[i + 1][7]
+                prev_rate = prev_items / prev_wall if prev_wall else 0
+                if prev_rate:
+                    change = f"{(rate - prev_rate) / prev_rate * 100:+.0f}%"
+
+            flag = "" if status == "success" else f"  ({status})"
+            print(f"{run_id:>5} {started:<20} {wall:>9.1f} {cpu:>9.1f} {rss or 0:>8.0f} {items:>8} {rate:>9.2f} "
+                  f"{mb_rate:>7.2f} {failures:>6} {change:>8}{flag}")
+            if details:
+                print(f"{'':>26}{details}")
+
+def main():
+    parser = argparse.ArgumentParser(description="compare stage timings and throughput of recent pipeline runs")
+    parser.add_argument("--last", type=int, default=5, help="number of runs to compare")
+    args = parser.parse_args()
+    print_report(args.last)
+
+# OBS run from the same folder as main: python -m stakeholder_data_extraction_pipeline.database.run_ledger --last 5
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import re
+import sqlite3
+from collections import Counter
+from urllib.parse import urlsplit
+from stakeholder_data_extraction_pipeline import config
+from .connection import get_connection, transaction
+
+# public suffixes with two labels seen in stakeholder urls  # registered domain keeps one more label for these
+MULTI_PART_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "org.au", "gov.au", "co.jp", "or.jp", "co.kr", "or.kr",
+    "go.kr", "com.cn", "org.cn", "gov.cn", "com.tr", "org.tr", "gov.tr", "co.in", "org.in", "gov.in", "com.br",
+    "co.za", "org.za", "co.nz", "com.mx", "com.ua", "com.sg", "com.tw", "co.il", "europa.eu",
+}
+
+def parse_url_domain(url):
+    """ split a url into (host, registered domain, site), e.g. ("uk.linkedin.com", "linkedin.com", "linkedin") """
+    if not url or "." not in url:
+        return "", None, None  # placeholders such as 'no_results'
+
+    # urls saved without a scheme (www.example.com/page) have no netloc for urlsplit
+    if "://" not in url:
+        url = "http://" + url
+    try:
+        host = (urlsplit(url).hostname or "").rstrip(".")
+    except ValueError:
+        return "", None, None
+
+    labels = host.split(".")
+    if len(labels) < 2 or host.replace(".", "").isdigit():
+        return host, host or None, host or None  # localhost, ip addresses
+
+    keep = 3 if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES and len(labels) >= 3 else 2
+    registered_domain = ".".join(labels[-keep:])
+    return host, registered_domain, labels[-keep]
+
+def sync_blocklist():
+    """
+    make url_blocklist match config: one rule per platform plus the google search pattern (counters are kept),
+    a rule's site is a prefix of urls.site, so 'springer' also covers springeropen.com and springernature.com
+    """
+    rules = [(platform, platform, None) for platform in config.PLATFORMS]   # any page on the platform's sites
+    rules.append(("google_search", "google", config.GOOGLE_SEARCH_PATTERN))  # only google search result pages
+
+    with transaction() as conn:
+        conn.executemany('''INSERT INTO url_blocklist (rule, site, pattern) VALUES (?, ?, ?)
+                            ON CONFLICT(rule) DO UPDATE SET site = excluded.site, pattern = excluded.pattern''', rules)
+        conn.execute(f"DELETE FROM url_blocklist WHERE rule NOT IN ({','.join('?' * len(rules))})",
+                     [rule[0] for rule in rules])
+
+def load_blocklist(conn=None):
+    """ site prefix -> list of (rule, compiled pattern or None), patterns are compiled once here """
+    conn = conn or get_connection()
+    blocklist = {}
+    for rule, site, pattern in conn.execute("SELECT rule, site, pattern FROM url_blocklist"):
+        blocklist.setdefault(site, []).append((rule, re.compile(pattern) if pattern else None))
+    return blocklist
+
+def match_blocklist(url, site, blocklist):
+    """ return the name of the first rule that blocks url, None if it is allowed  # rules apply to sites starting with their site """
+    if not site:
+        return None
+    for prefix, rules in blocklist.items():
+        if site.startswith(prefix):
+            for rule, pattern in rules:
+                if pattern is None or pattern.search(url):
+                    return rule
+    return None
+
+def site_range(prefix):
+    """ (lowest, first site after) the sites starting with prefix, for an indexed range scan on urls.site """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def record_drops(conn, dropped):
+    """ add per-rule drop counts (Counter rule -> n) to url_blocklist """
+    conn.executemany("UPDATE url_blocklist SET dropped = dropped + ? WHERE rule = ?",
+                     [(count, rule) for rule, count in dropped.items() if count])
+
+def backfill_url_domains(batch_size=5000):
+    """ parse host columns for urls inserted before domain indexing (or by hand), returns rows updated """
+    updated = 0
+
+    while True:
+        with transaction() as conn:
+            rows = conn.execute("SELECT id, url FROM urls WHERE host IS NULL LIMIT ?", (batch_size,)).fetchall()
+            conn.executemany("UPDATE urls SET host = ?, registered_domain = ?, site = ? WHERE id = ?",
+                             [(*parse_url_domain(url), url_id) for url_id, url in rows])
+        if not rows:
+            return updated
+        updated += len(rows)
+
+def remove_blocked_urls():
+    """ delete stored urls matched by the blocklist with indexed lookups on urls.site, returns Counter rule -> rows removed """
+    dropped = Counter()
+
+    with transaction() as conn:
+        for site, rules in load_blocklist(conn).items():
+            for rule, pattern in rules:
+                if pattern is None:
+                    dropped[rule] += conn.execute("DELETE FROM urls WHERE site >= ? AND site < ?", site_range(site)).rowcount
+                else:
+                    # only the site's rows are checked against the pattern, not the whole table
+                    ids = [(url_id,) for url_id, url in conn.execute("SELECT id, url FROM urls WHERE site >= ? AND site < ?",
+                                                                     site_range(site))
+                           if pattern.search(url)]
+                    conn.executemany("DELETE FROM urls WHERE id = ?", ids)
+                    dropped[rule] += len(ids)
+        record_drops(conn, dropped)
+
+    return dropped
+
+def blocklist_stats():
+    """ (rule, site, dropped) for every rule, most dropped first """
+    try:
+        return get_connection().execute("SELECT rule, site, dropped FROM url_blocklist ORDER BY dropped DESC, rule").fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reading blocklist counters: {e}")
+        return []
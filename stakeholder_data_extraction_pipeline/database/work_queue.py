@@ -0,0 +1,126 @@
+import os
+import socket
+import time
+from stakeholder_data_extraction_pipeline import config
+from .connection import get_connection, transaction
+
+# work queues backed by db tables  # name -> (table, pending condition, columns returned to the worker)
+# a row is claimable when it is pending and has no live lease (never claimed, released or expired)
+# conditions may use :now (unix seconds), downloads waiting for a retry are claimable once next_retry_at has passed
+QUEUES = {
+    "downloads": ("urls", "download_status = 'pending' AND (next_retry_at IS NULL OR next_retry_at <= :now)",
+                  "id, organization_id, url, file_path, attempts, etag, last_modified, content_hash, file_type, paywall_status"),
+    "html": ("html_text", "extract_status = 'pending'", "id, organization_id, html_file"),
+    "pdf": ("pdf_text", "extract_status = 'pending'", "id, organization_id, pdf_file"),
+}
+
+# extraction queues whose rows can share one downloaded blob  # name -> file column
+# an extraction result is computed once per file and fanned out to every row pointing at it
+SHARED_FILES = {"html": "html_file", "pdf": "pdf_file"}
+
+# statuses that depend only on the file content, so they are reused for other rows of the same file
+REUSABLE_STATUSES = ("success", "no_text", "decryption_failure")
+
+def worker_id():
+    """ identify this process across machines sharing the db, host:pid """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def claim(queue, limit=None, worker=None, lease_seconds=None):
+    """
+    Atomically claim up to limit pending rows of a queue for this worker.
+    Rows whose lease expired (crashed worker) are claimable again. Returns the claimed rows.
+    """
+    table, pending, columns = QUEUES[queue]
+    now = time.time()
+    lease_expires = now + (lease_seconds or config.WORKER_LEASE_SECONDS)
+
+    # BEGIN IMMEDIATE holds the write lock, so two workers can never claim the same row
+    with transaction() as conn:
+        rows = conn.execute(f"""
+            UPDATE {table}
+            SET claimed_by = :worker, lease_expires = :lease_expires, heartbeat_at = :now
+            WHERE id IN (SELECT id FROM {table}
+                         WHERE {pending}
+                         AND (lease_expires IS NULL OR lease_expires < :now)
+                         ORDER BY id
+                         LIMIT :limit)
+            RETURNING {columns}
+            """, {"worker": worker or worker_id(), "lease_expires": lease_expires, "now": now,
+                  "limit": limit or config.CLAIM_BATCH_SIZE}).fetchall()
+
+    return sorted(rows)  # RETURNING order is not guaranteed
+
+def next_download_retry():
+    """
+    earliest time (unix seconds) a download waiting for a retry becomes claimable, None if there are none.
+    Retries already due count too (the time is then in the past), a row leased by another worker counts from its lease end.
+    """
+    return get_connection().execute("""
+        SELECT MIN(MAX(next_retry_at, COALESCE(lease_expires, 0))) FROM urls
+        WHERE download_status = 'pending' AND next_retry_at IS NOT NULL
+        """).fetchone()[0]
+
+def requeue_downloads_for_refresh():
+    """
+    put downloaded urls (success / not_modified) without a live lease back to pending, the downloader then fetches them
+    conditionally with their stored ETag/Last-Modified, returns the number of urls queued
+    """
+    with transaction() as conn:
+        return conn.execute("""
+            UPDATE urls SET download_status = 'pending', attempts = 0, next_retry_at = NULL
+            WHERE download_status IN ('success', 'not_modified')
+            AND (lease_expires IS NULL OR lease_expires < ?)
+            """, (time.time(),)).rowcount
+
+def heartbeat(queue, ids, worker=None, lease_seconds=None):
+    """ extend this worker's lease on rows it is still working on, returns the number of rows renewed """
+    table = QUEUES[queue][0]
+    now = time.time()
+    lease_expires = now + (lease_seconds or config.WORKER_LEASE_SECONDS)
+
+    with transaction() as conn:
+        renewed = conn.executemany(f"""
+            UPDATE {table} SET lease_expires = ?, heartbeat_at = ?
+            WHERE id = ? AND claimed_by = ?
+            """, [(lease_expires, now, row_id, worker or worker_id()) for row_id in ids]).rowcount
+    return renewed
+
+def release(queue, ids, worker=None):
+    """ give unfinished rows back to the queue so another worker can claim them straight away """
+    table = QUEUES[queue][0]
+
+    with transaction() as conn:
+        conn.executemany(f"""
+            UPDATE {table} SET claimed_by = NULL, lease_expires = NULL, heartbeat_at = NULL
+            WHERE id = ? AND claimed_by = ?
+            """, [(row_id, worker or worker_id()) for row_id in ids])
+
+def finished_result(queue, file_path):
+    """ (extracted_text_path, status) of an earlier row extracted from the same file, None if there is none """
+    table, column = QUEUES[queue][0], SHARED_FILES[queue]
+
+    return get_connection().execute(f"""
+        SELECT extracted_text_path, extract_status FROM {table}
+        WHERE {column} = ? AND extract_status IN ({','.join('?' * len(REUSABLE_STATUSES))})
+        ORDER BY id LIMIT 1
+        """, (file_path, *REUSABLE_STATUSES)).fetchone()
+
+def fan_out(queue, file_path, extracted_text_path, status, worker=None):
+    """
+    Give every other pending row of the same file this extraction result, unless another worker holds it.
+    Returns the (id, organization_id) rows updated.
+    """
+    table, column = QUEUES[queue][0], SHARED_FILES[queue]
+    now = time.time()
+
+    with transaction() as conn:
+        rows = conn.execute(f"""
+            UPDATE {table}
+            SET extracted_text_path = ?, extract_status = ?, timestamp = CURRENT_TIMESTAMP,
+                claimed_by = NULL, lease_expires = NULL, heartbeat_at = NULL
+            WHERE {column} = ? AND extract_status = 'pending'
+            AND (lease_expires IS NULL OR lease_expires < ? OR claimed_by = ?)
+            RETURNING id, organization_id
+            """, (extracted_text_path, status, file_path, now, worker or worker_id())).fetchall()
+
+    return sorted(rows)
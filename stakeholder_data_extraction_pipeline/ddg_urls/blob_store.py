@@ -0,0 +1,65 @@
+import glob
+import hashlib
+import os
+import tempfile
+from stakeholder_data_extraction_pipeline import config
+
+# content addressed storage for downloads  # each unique body is stored once as blobs/<first 2 hex>/<sha256>[.ext]
+# paths stored in the db (urls.file_path) are relative to config.URL_DOWNLOADS_DIR
+
+def new_hasher():
+    """ hash object used for blob names """
+    return hashlib.sha256()
+
+def stored_file_hash(file_path):
+    """
+    sha-256 of a file already stored under urls.file_path, for rows downloaded before bodies were hashed
+    (legacy "orgid_urlid" files may have been renamed to .pdf), None if the file is not there
+    """
+    full_path = os.path.join(config.URL_DOWNLOADS_DIR, file_path)
+    if not os.path.isfile(full_path) and os.path.isfile(full_path + ".pdf"):
+        full_path += ".pdf"
+    hasher = new_hasher()
+    try:
+        with open(full_path, "rb") as f:
+            for chunk in iter(lambda: f.read(config.DOWNLOAD_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+    except OSError:
+        return None
+    return hasher.hexdigest()
+
+def open_temp_blob():
+    """ open a temp file next to the blobs (same filesystem, so the final rename is atomic), returns (file, path) """
+    tmp_dir = os.path.join(config.BLOB_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    return os.fdopen(fd, "wb"), temp_path
+
+def find_blob(content_hash):
+    """ relative path of an existing blob with this hash (any extension), None if not stored yet """
+    matches = glob.glob(os.path.join(config.BLOB_DIR, content_hash[:2], content_hash + "*"))
+    if not matches:
+        return None
+    return os.path.relpath(matches[0], config.URL_DOWNLOADS_DIR)
+
+def commit_blob(temp_path, content_hash, extension=None):
+    """
+    Move a fully written temp file to its content address, <hash>.<extension> if given (tools such as the pdf
+    pipeline go by extension). Returns (relative path, is_new), if the content is already stored the temp file is dropped.
+    """
+    existing = find_blob(content_hash)
+    if existing:
+        os.remove(temp_path)  # same bytes already on disk
+        return existing, False
+
+    blob_path = os.path.join(config.BLOB_DIR, content_hash[:2], content_hash + (f".{extension}" if extension else ""))
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(temp_path, blob_path)  # atomic, readers never see a partial blob
+    return os.path.relpath(blob_path, config.URL_DOWNLOADS_DIR), True
+
+def discard_temp_blob(temp_path):
+    """ remove a temp file left by a failed download """
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
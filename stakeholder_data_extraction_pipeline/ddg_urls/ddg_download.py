@@ -1,134 +1,419 @@
 import os
-import sqlite3
-import random
 import time
+import random
+import signal
+import sqlite3
 import aiohttp
 import asyncio
 from datetime import datetime
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from stakeholder_data_extraction_pipeline import config
-from .ddg_file_detection import detect_file_type # to detect file type
+from stakeholder_data_extraction_pipeline.database import work_queue
+from stakeholder_data_extraction_pipeline.database.url_domains import parse_url_domain
+from . import blob_store # content addressed download storage
+from .host_scheduler import HostScheduler, HostQueue, make_connector # per-host politeness, replaces the global semaphore and sleeps
+from .ddg_file_detection import detect_paywall, route_headers, sniff_file_type, OFFICE_TYPES, STORED_EXTENSIONS # route a response on its headers and first bytes
+from .status_writer import run_status_writer, status_record, flush_status_queue, WRITE_FAILED, LEASE_LOST # batched db writes
 
-# Semaphore to limit concurrent downloads
-semaphore = asyncio.Semaphore(5)  # adjust based on system/network capacity
+# a url claimed from the downloads queue (columns of work_queue.QUEUES["downloads"])
+DownloadRow = namedtuple("DownloadRow", "id organization_id url file_path attempts etag last_modified content_hash "
+                                        "file_type paywall_status")
+# a fetched response: body in a temp blob (None when the server answered 304), its file type and the validators for the next refresh
+Fetched = namedtuple("Fetched", "temp_path content_hash file_type etag last_modified final_url")
 
-async def download_file_and_update_status(conn, url_data, session):
-    """ download a file asynchronously and update its status in db, url_data = (id, organization_id, url, file_path) """
-    url_id, org_id, url, file_path = url_data  # unpack url data tuple
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    file_type, paywall_status = "unknown", "unknown"  # initialize variables
+# a body committed to the blob store, waiting for classification (paywall check) before its status is written
+Stored = namedtuple("Stored", "url_id timestamp file_type blob_path content_hash validators")
+
+# http answers worth another attempt (throttling, server trouble), any other 4xx is permanent
+TRANSIENT_HTTP_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+class DownloadFailure(Exception):
+    """ a download that ended without a stored body: status for the urls table, transient if a retry may succeed """
+
+    def __init__(self, status, transient=False, retry_after=None, message=""):
+        super().__init__(message or status)
+        self.status = status
+        self.transient = transient
+        self.retry_after = retry_after  # seconds the server asked us to wait (Retry-After)
+
+def classify_error(e):
+    """ (download status, transient) for an exception raised while downloading """
+    if isinstance(e, DownloadFailure):
+        return e.status, e.transient
+    if isinstance(e, (aiohttp.ClientSSLError, aiohttp.InvalidURL, aiohttp.TooManyRedirects)):
+        return "failure", False  # retrying gives the same answer
+    if isinstance(e, aiohttp.ClientResponseError):
+        return f"failure_{e.status}", e.status in TRANSIENT_HTTP_STATUSES or e.status >= 500
+    if isinstance(e, (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+        return "failure", True  # timeouts, refused or dropped connections, truncated bodies
+    return "failure", False  # unexpected errors (e.g. in file detection) are not retried
+
+def retry_delay(attempts):
+    """ jittered exponential backoff in seconds before the next attempt, after this many attempts """
+    delay = min(config.DOWNLOAD_RETRY_MAX_SECONDS, config.DOWNLOAD_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)  # spread retries of urls that failed together
+
+def retry_after_seconds(response):
+    """ wait requested by a 429/503 response (Retry-After in seconds), capped so one host cannot stall the run """
+    try:
+        wait = float(response.headers.get("Retry-After", config.DOWNLOAD_RETRY_AFTER_SECONDS))
+    except ValueError:
+        wait = config.DOWNLOAD_RETRY_AFTER_SECONDS  # http date form, use the default
+    return min(max(wait, 0), config.DOWNLOAD_MAX_RETRY_AFTER_SECONDS)
+
+async def fetch_body(session, url, etag=None, last_modified=None):
+    """
+    Stream one response into a temp blob, hashing it on the way. Returns a Fetched tuple,
+    raises DownloadFailure for error answers and oversized bodies (aiohttp errors are passed through).
+    With etag/last_modified of an earlier download the request is conditional, a 304 returns no temp blob.
+    The file type is routed on Content-Disposition/Content-Type and the first bytes as the stream starts,
+    media and archives are aborted with 'skipped_type' before the rest of the body is read.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    async with session.get(url, headers=headers) as response:
+        validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"), str(response.url))
+        if response.status == 304:
+            return Fetched(None, None, None, *validators)  # unchanged since the last download
+
+        if response.status >= 400:
+            retry_after = retry_after_seconds(response) if response.status in (429, 503) else None
+            raise DownloadFailure(f"failure_{response.status}", response.status in TRANSIENT_HTTP_STATUSES
+                                  or response.status >= 500, retry_after, f"http {response.status}")
+
+        response.raise_for_status()  # anything else aiohttp considers an error
 
-    async with semaphore: # control concurrency
+        # skip bodies announced as too large before reading anything
+        if response.content_length is not None and response.content_length > config.DOWNLOAD_MAX_BYTES:
+            raise DownloadFailure("too_large", message=f"{response.content_length} bytes announced, "
+                                                       f"limit {config.DOWNLOAD_MAX_BYTES}")
+
+        # skip types the pipeline cannot extract before reading anything
+        content_type = response.headers.get("Content-Type")
+        disposition = response.content_disposition
+        announced = route_headers(content_type, disposition.filename if disposition else None, str(response.url))
+        if announced == "skip":
+            raise DownloadFailure("skipped_type", message=f"unsupported type {content_type}")
+
+        # if file can be downloaded, stream it to a temp file in chunks and hash it on the way
+        hasher = blob_store.new_hasher()
+        f, temp_path = blob_store.open_temp_blob()
+        size = 0
+        head = b""        # first bytes, until the file type is known
+        file_type = None
         try:
-            # make http request
-            #async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                # if file is foribben to download or not found
-                if response.status in [403, 404]: 
-                    print(f"failed to download {url}: http {response.status}")   # print error status
-                    await update_db(conn, url_id, f"failure_{response.status}", timestamp, file_type, paywall_status)  # update as failure 
-                    return # exit 
-                
-                response.raise_for_status()  # raise error for other status codes (not 403 or 404)
-                
-                # if file can be downloaded, save file
-                full_path = os.path.join(config.URL_DOWNLOADS_DIR, file_path)  # build full path
-                os.makedirs(os.path.dirname(full_path), exist_ok=True)         # ensure directory exists
-                with open(full_path, "wb") as f:
-                    f.write(await response.read())  # write content to file in binary mode
-        
-            # after download, detect file type, paywall status and timestamp
-            file_type, paywall_status = detect_file_type(full_path)
-            #timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            await update_db(conn, url_id, "success", timestamp, file_type, paywall_status)  # if downloaded correctly, update db with success and other vars
-        
-        except aiohttp.ClientError as e:
-            print(f"failed to download {url}: {e}")
-            await update_db(conn, url_id, "failure", timestamp, file_type, paywall_status)
-
-        except Exception as e:
-            print(f"Unexpected error with {url}: {e}")
-            await update_db(conn, url_id, "failure", timestamp, file_type, paywall_status)
-
-        # add a random delay between download (to prevent overwhelming server)
-        finally:
-            # Random delay between downloads
-            await asyncio.sleep(random.uniform(1, 8))
-
-async def update_db(conn, url_id, download_status, timestamp, file_type, paywall_status):
-    """ update urls table for a specific id, with retry mechanism for locked db """
-    #conn = None # ensure conn exists
-   
-    try: 
-        # connect to db
-        #conn = sqlite3.connect(config.DB_PATH, check_same_thread=False)
-        #c = conn.cursor()
-        retries = 5 # number of retries (to avoid locked db due to multiple processes)
-        
-        for attempt in range(retries):
-            try:
-                # update url download status, add time stamp
-                c = conn.cursor()
-                c.execute("""
-                UPDATE urls 
-                SET download_status = ?, timestamp = ?, file_type = ?, paywall_status = ?
-                WHERE id = ?
-                """, (download_status or "unknown",         # ensure download_status is not None 
-                      timestamp or "2025-01-01 00:00:00",   # default timestamp if None
-                      file_type or "unknown",               # default file type if None
-                      paywall_status or "unknown",          # default paywall_status if None
-                      url_id))
-                conn.commit()  # commit to db
-                return         # exit function if successful
-            
-            except sqlite3.OperationalError as e:
-                if "locked" in str(e).lower():
-                    print(f"database locked, retrying... ({retries} retries left)")  # print retry message
-                    #retries -= 1
-                    await asyncio.sleep(20)  # wait 20 secs before retrying
-                else: 
-                    raise
+            with f:
+                async for chunk in response.content.iter_chunked(config.DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > config.DOWNLOAD_MAX_BYTES:
+                        # no or wrong content-length, stop reading a runaway response
+                        raise DownloadFailure("too_large", message=f"more than {config.DOWNLOAD_MAX_BYTES} bytes")
+                    if file_type is None:
+                        head += chunk
+                        if len(head) >= config.DOWNLOAD_SNIFF_BYTES:
+                            file_type = body_file_type(head, announced, content_type)
+                    hasher.update(chunk)
+                    f.write(chunk)  # write content to file in binary mode
+            if file_type is None:
+                file_type = body_file_type(head, announced, content_type)  # body shorter than the sniffed prefix
+        except BaseException:
+            blob_store.discard_temp_blob(temp_path)  # partial download
+            raise
 
-    except sqlite3.Error as e:
-        print(f"Error updating urls download status {e}")
-    
-    #finally: 
-    #    if conn: 
-    #        conn.close()  # close db connection
+        return Fetched(temp_path, hasher.hexdigest(), file_type, *validators)
+
+def body_file_type(head, announced, content_type=None):
+    """ file type of a body from its first bytes, the headers only decide when the bytes do not, raises for media/archives """
+    file_type = sniff_file_type(head[:config.DOWNLOAD_SNIFF_BYTES]) or announced or "unknown"
+    if file_type == "office" and announced in OFFICE_TYPES:
+        file_type = announced  # the bytes say office open xml, the Content-Type or url says which document (and extension)
+    if file_type == "skip":
+        raise DownloadFailure("skipped_type", message=f"unsupported content ({content_type or 'no content type'})")
+    return file_type
+
+async def download_file_and_update_status(url_data, session, status_queue, scheduler, classify_queue=None):
+    """
+    Download a file asynchronously into the content addressed blob store and queue its status for the db writer.
+    The request runs in a per-host slot of the scheduler. Transient failures (timeouts, dropped connections, 5xx, 429)
+    go back to pending with a jittered backoff (next_retry_at) until DOWNLOAD_MAX_ATTEMPTS, permanent ones fail at once.
+    Urls downloaded before are fetched conditionally (refresh), an unchanged document is recorded as 'not_modified'
+    and keeps its file, so extraction only sees documents whose content changed.
+    Stored bodies are handed to the classification stage through classify_queue (classified in place if None),
+    so file scans never run on the event loop and downloading goes on while earlier bodies are classified.
+    url_data is a row of the downloads queue (DownloadRow columns).
+    Returns the outcome: stored, duplicate, not_modified, retry, gave_up (transient failures exhausted), permanent,
+    too_large or skipped_type.
+    """
+    row = DownloadRow(*url_data)
+    url_id, url, attempts = row.id, row.url, row.attempts  # unpack url data tuple
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    file_type, paywall_status = row.file_type or "unknown", row.paywall_status or "unknown"  # kept while refreshing
+    host = parse_url_domain(url)[0]
+    temp_path = None
+
+    try:
+        async with scheduler.slot(host):  # per-host pacing and the global connection cap
+            fetched = await fetch_body(session, url, row.etag, row.last_modified)
+        temp_path = fetched.temp_path
+        validators = {"etag": fetched.etag, "last_modified": fetched.last_modified, "final_url": fetched.final_url}
+
+        # rows downloaded before bodies were hashed: hash the stored file once, the hash is saved with the status
+        previous_hash = row.content_hash
+        if temp_path is not None and previous_hash is None and row.file_path:
+            previous_hash = await asyncio.to_thread(blob_store.stored_file_hash, row.file_path)
+
+        # same document as last time (304, or a server without validators sent the same bytes): nothing to extract again
+        if temp_path is None or fetched.content_hash == previous_hash:
+            await update_db(status_queue, url_id, "not_modified", timestamp, file_type, paywall_status,
+                            content_hash=previous_hash, **validators)
+            return "not_modified"
 
-async def download_all_files():
-    """ download all files with pending status sequentially, fetch pending urls and process each one """
-    conn = None # ensure conn exists
+        # store the body under its hash with the extension of its type (dropped if the same content was downloaded before)
+        file_type = fetched.file_type
+        blob_path, is_new = blob_store.commit_blob(temp_path, fetched.content_hash,
+                                                   file_type if file_type in STORED_EXTENSIONS else None)
+        content_hash = fetched.content_hash
+        temp_path = None
+
+        #timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # html is checked for a paywall once stored, the success status is written after classification
+        stored = Stored(url_id, timestamp, file_type, blob_path, content_hash, validators)
+        if classify_queue is None:
+            await classify_stored(stored, status_queue)
+        else:
+            await classify_queue.put(stored)  # waits while classification lags behind (backpressure)
+        return "stored" if is_new else "duplicate"
+
+    except Exception as e:
+        status, transient = classify_error(e)
+        error = f"{'transient' if transient else 'permanent'}: {type(e).__name__}: {e}"[:500]
+        attempts += 1
+
+        if transient and attempts < config.DOWNLOAD_MAX_ATTEMPTS:
+            # back to the queue, claimable again once next_retry_at has passed (this run or the next)
+            wait = max(retry_delay(attempts), getattr(e, "retry_after", None) or 0)
+            if getattr(e, "retry_after", None) is not None:
+                scheduler.defer(host, e.retry_after)  # the whole host was asked to slow down
+            print(f"failed to download {url} ({error}), attempt {attempts}, retrying in {wait:.0f}s")
+            await update_db(status_queue, url_id, "pending", timestamp, file_type, paywall_status,
+                            error=error, next_retry_at=time.time() + wait)
+            return "retry"
+
+        print(f"failed to download {url}: {error}")
+        await update_db(status_queue, url_id, status, timestamp, file_type, paywall_status, error=error)
+        if status in ("too_large", "skipped_type"):
+            return status
+        return "gave_up" if transient else "permanent"
+
+    finally:
+        if temp_path:
+            blob_store.discard_temp_blob(temp_path)  # not committed (interrupted)
+
+async def classify_stored(stored, status_queue, executor=None):
+    """ paywall check of a stored html body in an executor thread (off the event loop), then queue its success status """
+    paywall_status = None
+    if stored.file_type == "html":
+        path = os.path.join(config.URL_DOWNLOADS_DIR, stored.blob_path)
+        paywall_status = await asyncio.get_running_loop().run_in_executor(executor, detect_paywall, path)
+    await update_db(status_queue, stored.url_id, "success", stored.timestamp, stored.file_type, paywall_status,
+                    stored.blob_path, stored.content_hash, **stored.validators)  # if downloaded correctly, update db with success
+
+async def update_db(status_queue, url_id, download_status, timestamp, file_type, paywall_status, file_path=None, content_hash=None,
+                    error=None, next_retry_at=None, etag=None, last_modified=None, final_url=None):
+    """ queue a status update for a specific url id, the writer task commits it in a batch (workers never touch sqlite) """
+    await status_queue.put(status_record(url_id, download_status, timestamp, file_type, paywall_status, file_path, content_hash,
+                                         error, next_retry_at, etag, last_modified, final_url))
+
+async def renew_leases(in_flight, worker):
+    """ keep the leases on in-flight downloads alive while this worker is running """
+    while True:
+        await asyncio.sleep(config.WORKER_LEASE_SECONDS / 3)  # renew well before expiry
+        if in_flight:
+            await asyncio.to_thread(work_queue.heartbeat, "downloads", list(in_flight), worker)
+
+async def report_progress(outcomes, in_flight, url_queue, classify_queue, claimed):
+    """
+    print a progress line every DOWNLOAD_PROGRESS_SECONDS: urls done of claimed, rate, in progress, queued for download
+    and for classification, and outcomes
+    """
+    start = time.monotonic()
+    while True:
+        await asyncio.sleep(config.DOWNLOAD_PROGRESS_SECONDS)
+        done = sum(outcomes.values())
+        queued = url_queue.qsize()
+        print(f"[{done}/{claimed()} urls, {done / (time.monotonic() - start):.1f}/s] {len(in_flight) - queued} in progress, "
+              f"{queued} queued, {classify_queue.qsize()} classifying | {outcomes['stored']} stored, {outcomes['duplicate']} duplicate, "
+              f"{outcomes['not_modified']} not modified, {outcomes['retry']} retrying, "
+              f"{outcomes['permanent'] + outcomes['gave_up'] + outcomes['too_large'] + outcomes['skipped_type']} failed",
+              flush=True)
+
+def handle_sigint(loop, stopping, tasks):
+    """
+    Ctrl-C stops claiming and lets in-flight downloads finish (queued urls are handed back), a second Ctrl-C cancels them.
+    Returns a function removing the handler, a no-op where signal handlers are not supported (windows, not the main thread).
+    """
+    def on_sigint():
+        if stopping.is_set():
+            print("interrupted again, cancelling in-flight downloads", flush=True)
+            for task in tasks:
+                task.cancel()
+        else:
+            stopping.set()
+            print("interrupted, finishing in-flight downloads and handing back queued urls (Ctrl-C again to abort)", flush=True)
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_sigint)
+    except (NotImplementedError, RuntimeError, ValueError):
+        return lambda: None
+    return lambda: loop.remove_signal_handler(signal.SIGINT)
+
+async def download_all_files(refresh=False):
+    """
+    Download all files with pending status with a fixed pool of DOWNLOAD_WORKERS download tasks.
+    A producer claims pages of pending urls (leased, so several downloader processes can share the queue) into a bounded
+    queue, memory and task count stay flat whatever the backlog. The queue hands a task only urls whose host is free
+    (HostQueue), urls of busy hosts wait in line without holding a task. Stored bodies go through a second bounded queue to
+    CLASSIFY_WORKERS classification tasks (paywall scan in a thread pool), so network i/o and file scans overlap. With refresh earlier downloads are queued again and
+    fetched conditionally. On SIGINT claiming stops, in-flight downloads finish and queued urls are released.
+    Returns a summary dict.
+    """
+    worker = work_queue.worker_id()
+    in_flight = set()  # url ids claimed by this worker and not yet finished (queued or downloading)
+    claimed_total = 0
+    outcomes = Counter()  # download outcome -> urls (stored, duplicate, retry, gave_up, permanent, too_large, skipped_type)
+    scheduler = HostScheduler()  # throughput grows with the number of hosts, each host gets polite traffic
+    # claimed urls waiting for a download task, handed out only when their host is free (busy hosts do not hold tasks)
+    url_queue = HostQueue(scheduler, lambda url_data: parse_url_domain(DownloadRow(*url_data).url)[0],
+                          config.DOWNLOAD_QUEUE_SIZE)
+    classify_queue = asyncio.Queue(maxsize=config.CLASSIFY_QUEUE_SIZE)  # stored bodies waiting for classification
+    classifier = ThreadPoolExecutor(max_workers=config.CLASSIFY_WORKERS, thread_name_prefix="classify")
+    stopping = asyncio.Event()  # set on SIGINT, nothing new is claimed or started
     
-    try: 
-        conn = sqlite3.connect(config.DB_PATH, check_same_thread=False)
-        c = conn.cursor()
-        c.execute('SELECT id, organization_id, url, file_path FROM urls WHERE download_status = "pending"')  # get pending downloads
-        urls = c.fetchall()  # fetch all pending records
-        
-        # process each url and download
-        #for url_data in urls:
-        #    await download_file_and_update_status(url_data)  # process each url sequentially
-        
-        # process each URL asynchronously (overwhelmed servers so had to rewrite)
-        #tasks = [download_file_and_update_status(conn, url_data) for url_data in urls]
-        #await asyncio.gather(*tasks)
-        
+    # single writer task batches status updates into few transactions
+    status_queue = asyncio.Queue(maxsize=config.DB_WRITE_QUEUE_SIZE)  # bounded, so workers wait if the db falls behind
+    writer = asyncio.create_task(run_status_writer(status_queue, worker=worker))  # writes only rows this worker still holds
+    heartbeat = asyncio.create_task(renew_leases(in_flight, worker))
+    progress = asyncio.create_task(report_progress(outcomes, in_flight, url_queue, classify_queue, lambda: claimed_total))
+    if refresh:
+        print(f"refresh: queued {await asyncio.to_thread(work_queue.requeue_downloads_for_refresh)} earlier downloads")
+
+    async def produce():
+        """ claim pending urls page by page into the queue (blocks while it is full), waits for retries due soon """
+        nonlocal claimed_total
+        while not stopping.is_set():
+            # claim the next page of pending urls (atomic, other workers get different rows)
+            urls = await asyncio.to_thread(work_queue.claim, "downloads", config.CLAIM_BATCH_SIZE, worker)
+            if not urls:
+                # nothing claimable now, wait for retries due within the window (later ones are left for the next run)
+                await url_queue.join()  # downloads still running may schedule a retry
+                await flush_status_queue(status_queue)
+                due = await asyncio.to_thread(work_queue.next_download_retry)
+                if due is None or due - time.time() > config.DOWNLOAD_RETRY_WINDOW_SECONDS:
+                    return
+                try:
+                    await asyncio.wait_for(stopping.wait(), max(due - time.time(), 0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            claimed_total += len(urls)
+            in_flight.update(url_data[0] for url_data in urls)
+            for url_data in urls:
+                await url_queue.put(url_data)
+
+    async def consume(session):
+        """ one download task: take urls off the queue until cancelled, queued urls are skipped once stopping """
+        while True:
+            url_data = await url_queue.get()
+            try:
+                if not stopping.is_set():
+                    outcome = await download_file_and_update_status(url_data, session, status_queue, scheduler,
+                                                                    classify_queue)
+                    outcomes[outcome] += 1
+                    if outcome not in ("stored", "duplicate"):
+                        in_flight.discard(url_data[0])  # status queued, the writer clears the lease
+            finally:
+                await url_queue.task_done(url_data)
+
+    async def hand_back():
+        """ once stopping, queued urls of busy hosts are handed out at once (skipped, their leases released at the end) """
+        await stopping.wait()
+        await url_queue.close()
+
+    async def classify():
+        """ one classification task: stored bodies off the queue, scanned in the thread pool, status queued """
+        while True:
+            stored = await classify_queue.get()
+            try:
+                await classify_stored(stored, status_queue, classifier)
+                in_flight.discard(stored.url_id)
+            finally:
+                classify_queue.task_done()
+
+    tasks = []
+    remove_handler = handle_sigint(asyncio.get_running_loop(), stopping, tasks)
+    try:
         timeout = aiohttp.ClientTimeout(total=30)  # 30-second timeout per request
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            tasks = [download_file_and_update_status(conn, url_data, session) for url_data in urls]
-            await asyncio.gather(*tasks)
+        async with aiohttp.ClientSession(timeout=timeout, connector=make_connector()) as session:
+            tasks.extend(asyncio.create_task(consume(session)) for _ in range(config.DOWNLOAD_WORKERS))
+            tasks.extend(asyncio.create_task(classify()) for _ in range(config.CLASSIFY_WORKERS))
+            tasks.append(asyncio.create_task(hand_back()))
+            producer = asyncio.create_task(produce())
+            tasks.append(producer)
+            try:
+                await producer
+                await url_queue.join()  # last downloads (or the skipped queue after a SIGINT)
+                await classify_queue.join()  # and their classification
+            except asyncio.CancelledError:
+                if not stopping.is_set():
+                    raise  # cancelled from outside, not by a second Ctrl-C
+            finally:
+                for task in tasks:
+                    task.cancel()
+                for result in await asyncio.gather(*tasks, return_exceptions=True):
+                    if isinstance(result, Exception) and not isinstance(result, sqlite3.Error):
+                        print(f"download task failed: {type(result).__name__}: {result}")
 
     except sqlite3.Error as e:
         print(f"Error fetching pending urls {e}")
     
-    finally: 
-        if conn: 
-            conn.close()  # close db connection
+    finally:
+        remove_handler()
+        heartbeat.cancel()
+        progress.cancel()
+        classifier.shutdown(wait=True)
+        await status_queue.put(None)  # flush remaining updates and stop the writer
+        written = await writer
+        write_failed = written.pop(WRITE_FAILED, 0)  # rows whose status could not be committed
+        lease_lost = written.pop(LEASE_LOST, 0)  # rows reclaimed by another worker, their status is left to it
+        if in_flight:
+            await asyncio.to_thread(work_queue.release, "downloads", list(in_flight), worker)  # hand back unfinished urls
+        print(f"claimed {claimed_total} urls, recorded download status for {sum(written.values())}"
+              f"{f' ({write_failed} status updates failed to commit)' if write_failed else ''}"
+              f"{f' ({lease_lost} urls reclaimed by another worker, not written)' if lease_lost else ''}, "
+              f"{outcomes['duplicate']} duplicate downloads not stored again, {outcomes['retry']} retries scheduled, "
+              f"{outcomes['permanent']} permanent and {outcomes['gave_up']} transient failures, "
+              f"{outcomes['not_modified']} not modified, {outcomes['skipped_type']} skipped by type"
+              f"{f', interrupted with {len(in_flight)} urls handed back' if stopping.is_set() else ''}")
+
+    # summary for the run ledger
+    failed = sum(count for status, count in written.items() if status.startswith("failure")) + write_failed
+    return {"items": sum(written.values()), "failures": failed, "status_write_failures": write_failed,
+            "leases_lost": lease_lost, "claimed": claimed_total, "duplicates": outcomes["duplicate"],
+            "too_large": outcomes["too_large"], "skipped_type": outcomes["skipped_type"], "retries": outcomes["retry"],
+            "permanent_failures": outcomes["permanent"], "transient_failures": outcomes["gave_up"],
+            "not_modified": outcomes["not_modified"], "changed": outcomes["stored"] + outcomes["duplicate"],
+            "interrupted": stopping.is_set()}
 
-def run_downloader():
-    """ run the async downloader, scheduling tasks, handles event loop issues"""
+def run_downloader(refresh=None):
+    """ run the async downloader (refresh re-checks earlier downloads, default DOWNLOAD_REFRESH), handles event loop issues"""
+    refresh = config.DOWNLOAD_REFRESH if refresh is None else refresh
     
     # check for an active loop (to avoid crashing in jupyter notebook)
     try:
@@ -137,12 +422,12 @@ def run_downloader():
         # if a loop exists, schedule the downloads
         if loop.is_running():
             print("event loop already, scheduling downloads") # print message
-            loop.create_task(download_all_files())            # schedule on current loop
+            loop.create_task(download_all_files(refresh))     # schedule on current loop
         
         # run event loop
         else:
             print("running downloader with asyncio.run()")  # print message
-            asyncio.run(download_all_files())               # run new event loop
+            return asyncio.run(download_all_files(refresh)) # run new event loop
     
     except Exception as e:
         print(f"error running downloader: {e}")  # print exception
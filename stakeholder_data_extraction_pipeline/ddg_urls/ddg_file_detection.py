@@ -1,38 +1,180 @@
-from stakeholder_data_extraction_pipeline import config 
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlparse
+from stakeholder_data_extraction_pipeline import config
+
+# optional, a c aho-corasick automaton for long paywall phrase lists (pip install pyahocorasick)
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# routing of a download before its body is read  # file type from the first bytes, else from the headers and file name
+# documents are kept, media and archives are aborted ('skipped_type'), anything else is stored as 'unknown'
+CONTENT_TYPES = {"application/pdf": "pdf", "application/x-pdf": "pdf", "text/html": "html", "application/xhtml+xml": "html",
+                 "application/json": "json", "application/xml": "xml", "text/xml": "xml",
+                 "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+                 "application/vnd.openxmlformats-officedocument.presentationml.presentation": "pptx"}
+EXTENSIONS = {".pdf": "pdf", ".html": "html", ".htm": "html", ".json": "json", ".xml": "xml",
+              ".docx": "docx", ".xlsx": "xlsx", ".pptx": "pptx"}
+MIME_TYPES = {file_type: mime for mime, file_type in reversed(list(CONTENT_TYPES.items()))}  # file type -> main mime type
+
+# magic numbers  # (offset, signature, file type, mime type), checked in order on the first bytes of a file
+MAGIC_NUMBERS = (
+    (0, b"%PDF-", "pdf", "application/pdf"),
+    (0, b"PK\x03\x04", "zip", "application/zip"),  # also docx/xlsx/pptx, told apart by their part names (zip_type)
+    (0, b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (0, b"\xff\xd8\xff", "jpeg", "image/jpeg"),
+    (0, b"GIF87a", "gif", "image/gif"),
+    (0, b"GIF89a", "gif", "image/gif"),
+    (8, b"WEBP", "webp", "image/webp"),
+    (8, b"AVI ", "avi", "video/x-msvideo"),
+    (8, b"WAVE", "wav", "audio/wav"),
+    (4, b"ftyp", "mp4", "video/mp4"),
+    (0, b"\x1a\x45\xdf\xa3", "webm", "video/webm"),
+    (0, b"ID3", "mp3", "audio/mpeg"),
+    (0, b"\x1f\x8b", "gzip", "application/gzip"),
+    (0, b"Rar!\x1a\x07", "rar", "application/vnd.rar"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7z", "application/x-7z-compressed"),
+    (0, b"MZ", "exe", "application/vnd.microsoft.portable-executable"),
+)
+# office open xml parts  # a zip holding one of these is a document, not an archive
+OFFICE_PARTS = ((b"word/", "docx"), (b"xl/", "xlsx"), (b"ppt/", "pptx"), (b"[Content_Types].xml", "office"))
+# specific office types  # when the first bytes only tell 'office' (the document part starts later), the headers or url decide
+OFFICE_TYPES = ("docx", "xlsx", "pptx")
+# types the downloader aborts ('skipped_type'), the pipeline cannot extract them
+SKIPPED_TYPES = {"zip", "png", "jpeg", "gif", "webp", "avi", "wav", "mp4", "webm", "mp3", "gzip", "rar", "7z", "exe"}
+# types stored with an extension (blob_store), tools such as the pdf pipeline go by extension
+STORED_EXTENSIONS = {"pdf", "html", "json", "xml", "docx", "xlsx", "pptx"}
+
+PAYWALL_MIN_BYTES = 200  # shorter html might be a paywall stub
+AUTOMATON_MIN_PHRASES = 16  # shorter phrase lists use the compiled regex alternation (benchmarks/classifier_benchmark.py)
+
+# result of classify_file  # paywall_status and matches (paywall phrases found) are only filled in for html
+FileClass = namedtuple("FileClass", "file_type mime paywall_status matches size")
 
 def is_pdf(filepath):
     """ check if file is a pdf  # by extension"""
     return filepath.lower().endswith(".pdf")  # return true if pdf
 
+def zip_type(head):
+    """ docx/xlsx/pptx (office for other office open xml) from the part names in a zip's first local headers, else zip """
+    for part, file_type in OFFICE_PARTS:
+        if part in head:
+            return file_type
+    return "zip"
+
+def magic_type(head):
+    """
+    (file type, mime type) from the first bytes of a file: magic numbers first, then text formats (json, html, xml),
+    (None, None) if the bytes do not tell
+    """
+    for offset, signature, file_type, mime in MAGIC_NUMBERS:
+        if head.startswith(signature, offset):
+            if file_type == "zip":
+                file_type = zip_type(head)
+                mime = MIME_TYPES.get(file_type, mime)
+            return file_type, mime
+
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n")  # utf-8 bom and leading whitespace
+    lowered = text[:config.DOWNLOAD_SNIFF_BYTES].lower()
+    if text.startswith((b"{", b"[")):
+        return "json", "application/json"
+    if b"<html" in lowered or b"<!doctype html" in lowered:
+        return "html", "text/html"
+    if lowered.startswith((b"<?xml", b"<rss", b"<feed")):
+        return "xml", "application/xml"
+    return None, None
+
+@lru_cache(maxsize=8)
+def phrase_matcher(phrases):
+    """
+    Build a function returning the phrases found in a lowercased prefix (bytes), one pass over the prefix in every
+    configuration: an aho-corasick automaton for long phrase lists when pyahocorasick is installed, otherwise one
+    compiled regex alternation (stdlib), longest phrases first so a phrase is not cut short by one it starts with.
+    """
+    phrases = sorted({phrase.lower() for phrase in phrases})
+    if ahocorasick is not None and len(phrases) >= AUTOMATON_MIN_PHRASES:
+        automaton = ahocorasick.Automaton()
+        for phrase in phrases:
+            automaton.add_word(phrase.encode().decode("latin-1"), phrase)  # keys in the same 1 char per byte form as the text
+        automaton.make_automaton()
+        return lambda lowered: {phrase for _, phrase in automaton.iter(lowered.decode("latin-1"))}
+
+    if not phrases:
+        return lambda lowered: set()
+    pattern = re.compile(b"|".join(re.escape(phrase.encode()) for phrase in sorted(phrases, key=len, reverse=True)))
+    return lambda lowered: {match.decode() for match in pattern.findall(lowered)}
+
+def paywall_status(head, size):
+    """ (paywall status, paywall phrases found) of an html prefix (lowercased once) and the full file size """
+    matches = tuple(sorted(phrase_matcher(tuple(config.PAYWALL_WORDS))(head.lower())))
+    if size < PAYWALL_MIN_BYTES:
+        return "possible paywall", matches  # too short might indicate paywall
+    if matches:
+        return "paywall detected", matches
+    return None, matches  # no paywall detected
+
+def read_prefix(filepath, scan_bytes=None):
+    """ (first CLASSIFY_SCAN_BYTES of a file, file size) """
+    with open(filepath, "rb") as file:
+        return file.read(scan_bytes or config.CLASSIFY_SCAN_BYTES), os.fstat(file.fileno()).st_size
+
+def classify_file(filepath, scan_bytes=None):
+    """
+    Classify a downloaded file from one read of a bounded prefix (CLASSIFY_SCAN_BYTES): file type and mime type from
+    magic numbers, and for html the paywall status and the paywall phrases found (one lowercase copy of the prefix).
+    Returns a FileClass, file type 'unreadable' if the file cannot be read.
+    """
+    try:
+        head, size = read_prefix(filepath, scan_bytes)
+    except OSError as e:
+        print(f"error reading {filepath}: {e}")  # print error
+        return FileClass("unreadable", None, "unreadable", (), 0)
+
+    file_type, mime = magic_type(head)
+    status, matches = paywall_status(head, size) if file_type == "html" else (None, ())
+    return FileClass(file_type or "unknown", mime, status, matches, size)
+
 def detect_paywall(filepath):
-    """ detect paywall indicators in html file, using file length and paywall keywords """
+    """ detect paywall indicators in html file, using file length and paywall keywords (in the scanned prefix) """
     try:
-        with open(filepath, "r", encoding="utf-8", errors="ignore") as file:
-            content = file.read()   # read file content
-            if len(content) < 200:  # too short might indicate paywall
-                return "possible paywall"  # flag as possible paywall
-            
-            for word in config.PAYWALL_WORDS:
-                if word in content.lower():  # check each keyword
-                    return "paywall detected"  # flag detected
-            return None  # no paywall detected
-    
-    except Exception as e:
+        head, size = read_prefix(filepath)
+    except OSError as e:
         print(f"error reading {filepath}: {e}")  # print error
         return "unreadable"  # mark unreadable
+    return paywall_status(head, size)[0]
+
+def sniff_file_type(header):
+    """ file type from the first bytes of a body: pdf, html, ..., skip (media or archive) or None if they do not tell """
+    file_type = magic_type(header)[0]
+    return "skip" if file_type in SKIPPED_TYPES else file_type
+
+def name_file_type(name):
+    """ file type from a file name or url path extension: pdf, html, ..., skip or None """
+    name = (name or "").lower()
+    if name.endswith(config.DOWNLOAD_SKIPPED_EXTENSIONS):
+        return "skip"
+    return EXTENSIONS.get(os.path.splitext(name)[1])
+
+def content_type_file_type(content_type):
+    """ file type from a Content-Type header (parameters ignored): pdf, html, ..., skip or None """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type.startswith(config.DOWNLOAD_SKIPPED_CONTENT_TYPES):
+        return "skip"
+    return CONTENT_TYPES.get(content_type)
+
+def route_headers(content_type=None, filename=None, url=None):
+    """
+    file type announced by a response before its body: pdf, html, ..., skip (unsupported media or archive) or None,
+    from the Content-Disposition file name, then the Content-Type, then the url path
+    """
+    return name_file_type(filename) or content_type_file_type(content_type) or name_file_type(urlparse(url or "").path)
 
 def detect_file_type(filepath):
-    # determine file type (pdf or html) and check for paywall  # returns tuple (type, paywall_status)
-    try:
-        with open(filepath, "rb") as file:
-            header = file.read(1024)  # read first 1kb
-            if header.startswith(b"%PDF-"):
-                return "pdf", None  # pdf detected
-            elif b"<html" in header.lower() or b"<!doctype html" in header.lower():
-                return "html", detect_paywall(filepath)  # html detected, check paywall
-            else:
-                return "unknown", None  # unknown type
-    
-    except Exception as e:
-        print(f"error reading {filepath}: {e}")  # print error
-        return "unreadable", None  # mark as unreadable
\ No newline at end of file
+    # determine file type and check for paywall  # returns tuple (type, paywall_status), see classify_file
+    result = classify_file(filepath)
+    return result.file_type, None if result.file_type == "unreadable" else result.paywall_status
@@ -1,9 +1,6 @@
 import pandas as pd
-import os
-import csv
 import time
-import random
-import json
+from contextlib import nullcontext
 
 # import user configs
 from stakeholder_data_extraction_pipeline import config 
@@ -11,6 +8,11 @@ from stakeholder_data_extraction_pipeline import config
 # library to run ddg search 
 from duckduckgo_search import DDGS 
 from duckduckgo_search.exceptions import RatelimitException, TimeoutException, DuckDuckGoSearchException
+from . import search_scheduler # parallel searches behind an adaptive rate limiter
+from .search_journal import get_journal # append-only per-org search state
+from . import search_cache # raw results per query, for re-runs without network
+from . import stakeholder_titles # canonical titles, one search per group of equivalent stakeholders
+from .search_providers import DDGSearchProvider, LocalFixtureProvider, PartialResults # pluggable search backends
 
 def load_stakeholders():
     """ load stakeholder names and dataframe from excel """
@@ -22,107 +24,104 @@ def load_stakeholders():
 
 def load_existing_results():
     """ 
-    Load existing DDG search results from CSV.
-    Consolidate entries so that each organization maps to a list of URLs.
+    Load the search state of each organization from the search journal (replayed once per process).
+    Returns (orgs with results, orgs to retry because they were rate limited, failed or timed out).
     """
-    #existing_results = set()    # use set for fast lookup of successful searches
-    #rate_limited_orgs = set()   # set tracking for rate-limited failures
-    
-    results_dict = {}  # to store the latest result for each organization
-    csv_file = config.LOGS_DIR + "/ddg_search_results.csv"
-    
+    journal = get_journal()
+    return journal.done_orgs(), journal.retry_orgs()
+
+def search_outcome(e):
+    """ classify a search exception for the limiter and the retry state (ddgs wraps backend errors in DuckDuckGoSearchException) """
+    cause = e.args[0] if e.args and isinstance(e.args[0], Exception) else e
+    message = str(e).lower()
+    if isinstance(e, RatelimitException) or isinstance(cause, RatelimitException) or "ratelimit" in message:
+        return search_scheduler.RATE_LIMITED
+    if isinstance(e, TimeoutException) or isinstance(cause, TimeoutException) or "timed out" in message:
+        return search_scheduler.TIMED_OUT
+    return search_scheduler.ERROR
+
+def search_query_for(org):
+    """ ddg query for one stakeholder """
+    return f'"{org}" {config.SEARCH_QUERY}'
+
+def org_result_rows(org, results):
+    """ org/url/title/snippet rows from a raw ddg result list (title and body are kept for relevance scoring) """
+    if not results:
+        return [{"org": org, "url": "no_results", "title": "", "snippet": ""}]
+    return [{"org": org, "url": result.get("href", "no_urls"), "title": result.get("title") or "",
+             "snippet": result.get("body") or ""} for result in results]
+
+def cached_search(org):
+    """ (result rows, outcome) from the search cache, None on a miss (in replay mode a miss is SKIPPED, never searched) """
+    results = search_cache.lookup(search_query_for(org))
+    if results is not None:
+        return org_result_rows(org, results), search_scheduler.OK
+    if config.SEARCH_REPLAY:
+        print(f"not in search cache (replay mode): {org}")
+        return [], search_scheduler.SKIPPED
+    return None
+
+def get_provider():
+    """ search provider for config.SEARCH_PROVIDER: live ddg, or the local fixture corpus (SEARCH_FIXTURE) """
+    if config.SEARCH_PROVIDER == "local":
+        return LocalFixtureProvider.from_file(config.SEARCH_FIXTURE) if config.SEARCH_FIXTURE else LocalFixtureProvider()
+    return DDGSearchProvider(DDGS)
+
+def search_org(ddgs, org):
+    """ run the ddg search for one stakeholder, returns (result rows, outcome for the rate limiter and retry state) """
+    search_query = search_query_for(org)
+
     try:
-        with open(csv_file, "r", encoding="utf-8", errors="replace") as file:
-            reader = csv.reader(file)
-            header = next(reader, None)  # skip header if present
-            for row in reader:
-                if len(row) < 2:
-                    continue
-                org, url = row[0], row[1]
-                if org not in results_dict:
-                    results_dict[org] = []      # initialize list for each org
-                results_dict[org].append(url)   # append each URL
-    except FileNotFoundError:
-        print("CSV file not found, running full search")
-    
-    existing_results = set()
-    rate_limited_orgs = set()
-    error_threshold = 3
-
-    for org, urls in results_dict.items():
-        error_count = sum(1 for url in urls if url in ["rate_limited", "error"])
-        if error_count >= error_threshold:
-            # If error count is too high, mark org as timed_out.
-            rate_limited_orgs.add(org)
-            # Also, update the results_dict so that this org shows only "timed_out"
-            results_dict[org] = ["timed_out"]
-        elif any(url not in ["rate_limited", "error", "timed_out"] for url in urls):
-            existing_results.add(org)
-        else:
-            rate_limited_orgs.add(org)
-    
-    # write the consolidated results back to the CSV to remove duplicates
-    with open(csv_file, "w", newline="", encoding="utf-8", errors="replace") as file:
-        writer = csv.writer(file)
-        writer.writerow(["organisation", "url"])
-        for org, urls in results_dict.items():
-            for url in urls:                    # write one row per url 
-                writer.writerow([org, url])
-
-    return existing_results, rate_limited_orgs
-
-def perform_search(stakeholder_names):
-    """ perform ddg search for each stakeholder """
-    
-    all_results = [] # where to store results
+        results = ddgs.text(
+            search_query,                   # perform search
+            max_results=config.MAX_RESULTS, # set max results 
+            backend=config.SEARCH_BACKEND   # use auto backend to avoid ratelimiting
+        )
+        search_cache.store(search_query, results)  # raw results, replayed by later runs
+        return org_result_rows(org, results), search_scheduler.OK
+
+    except PartialResults as e:
+        # keep what came back (merged by the journal), the org is searched again and nothing is cached
+        print(f"partial results for {org}: {len(e.results)} results")
+        return org_result_rows(org, e.results) if e.results else [], search_scheduler.PARTIAL
     
-    with DDGS() as ddgs:
-        for org in stakeholder_names:
-            # build queries
-            #if " " in org: 
-            #    search_query = f'"{org}" {config.SEARCH_QUERY}' # build query for org names with whitespace
-            #    print(f"searching for: {search_query}")  
-            #else: 
-            #    search_query = f'{org} {config.SEARCH_QUERY}'   # build query for org names w/out whitespace
-            #    print(f"searching for: {search_query}")
-
-            search_query = f'"{org}" {config.SEARCH_QUERY}'
-           
-            # try to avoid hitting rate limit
-            #retries = 0
-            #max_retries = 3
-            #success = False
-            org_results = []  
-
-            try:
-                results = ddgs.text(
-                    search_query,                   # perform search
-                    max_results=config.MAX_RESULTS, # set max results 
-                    backend='auto'                  # use auto backend to avoid ratelimiting
-                )
-                
-                if results:
-                    for result in results:
-                        org_results.append({"org": org, "url": result.get("href", "no_urls")})
-                else:
-                    org_results.append({"org": org, "url": "no_results"})
-            
-            except (RatelimitException, TimeoutException, DuckDuckGoSearchException, Exception) as e:
-                print(f"Exception for {org}: {e}. Sleeping for 80 seconds and moving to next org.")
-                time.sleep(80)  # easiest way to handle the DDGs backend error limit
-                # mark this org as having an error for this run.
-                # IMPORTANT !!!! this also marks urls even with partial success with an error and they will be re-run !!!!!
-                # To do: make this more efficient
-                org_results = [{"org": org, "url": "error"}]
-            
-            all_results.extend(org_results)
-            save_search_results(org_results)  # Save results immediately after each org.
-            
-            # reload rate-limited orgs (MAYBE NOT NEEDED)
-            _, _ = load_existing_results()
-            
-            time.sleep(random.uniform(1, 5))  # random sleep between requests
-    return all_results
+    except (RatelimitException, TimeoutException, DuckDuckGoSearchException, Exception) as e:
+        # the org is retried after its backoff, rate limits and timeouts also slow all workers down
+        outcome = search_outcome(e)
+        print(f"{outcome} for {org}: {e}")
+        return [], outcome
+
+def perform_search(stakeholder_names, not_before=None, members=None, provider=None):
+    """
+    Perform ddg search for each stakeholder with a few parallel workers behind the adaptive rate limiter.
+    Failed orgs are searched again in the same pass once their backoff has passed (if within SEARCH_RETRY_WINDOW_SECONDS).
+    members maps a searched title to the organizations sharing its search (stakeholder_titles.group_titles),
+    the results are saved for each of them. provider defaults to get_provider(). Returns the result rows of all members.
+    """
+    members = members or {}
+    provider = provider or get_provider()
+    found = []
+
+    def save(org, org_results, outcome):
+        if outcome == search_scheduler.SKIPPED:
+            return None  # replay mode cache miss, the org keeps its state
+        entry = None
+        for member in members.get(org, [org]):
+            member_results = [{**res, "org": member} for res in org_results]  # fan the urls out to every member
+            member_entry = save_search_results(member, member_results, outcome)  # Save results immediately after each org.
+            entry = entry or member_entry  # the searched title decides the retry
+            found.extend(member_results)
+        retry_at = entry["next_eligible"]
+        if retry_at is not None and retry_at - time.time() <= config.SEARCH_RETRY_WINDOW_SECONDS:
+            return retry_at  # retry in this pass
+        return None
+
+    # each worker opens its own provider session, the limiter replaces the fixed sleeps between requests
+    # cached queries are answered without a request (SEARCH_CACHE_TTL_DAYS, or only the cache in replay mode)
+    open_client = nullcontext if config.SEARCH_REPLAY else provider.session  # replay mode never opens a session
+    search_scheduler.run_searches(stakeholder_names, open_client, search_org, on_result=save,
+                                  not_before=not_before, cached=cached_search)
+    return found
             
 #            while not success and retries < max_retries:
                 # extract urls
@@ -166,85 +165,88 @@ def perform_search(stakeholder_names):
 #    unique_results = [res for res in results if res["org"] not in existing_results]
 #    return unique_results
 
-def save_search_results(results):
-    """For logging and future reference, save ddg search results to csv """ 
+def save_search_results(org, results, status="ok"):
+    """ For logging and future reference, append one search attempt of an org to the search journal, returns its new state """ 
+    journal = get_journal()
+    snippets = {res["url"]: [res.get("title", ""), res.get("snippet", "")] for res in results
+                if res.get("title") or res.get("snippet")}
+    entry = journal.record(org, [res["url"] for res in results], status, snippets=snippets)  # one appended line, nothing is re-read
     
-    csv_file = config.LOGS_DIR + "/ddg_search_results.csv"  # where to save
-    file_exists = os.path.isfile(csv_file)                  # check if file exists
-    write_header = not file_exists                          # assume need header if no file
-
-    if file_exists: 
-        with open(csv_file, "r", encoding="utf-8", errors='replace') as file: 
-            if file.read().strip() == "": 
-                write_header = True # if file is empty, write header
-
-    with open(csv_file, "a", newline="", encoding="utf-8", errors='replace') as file:
-        writer = csv.writer(file)                           # write csv
-        if write_header: 
-            writer.writerow(["organisation", "url"])        # write header if file is new or empty
-        for res in results:
-            writer.writerow([res["org"], res["url"]])       # write row
-    
-    print(f"saved search results for {results[0]['org']} to {csv_file}")            # confirmation
+    print(f"saved search results for {org} to {journal.path}")            # confirmation
+    return entry
 
 def run_search_pipeline():
-    """Run DDG search pipeline:
-       - If no CSV exists (first run), search for all stakeholders.
-       - If CSV exists, retry only those orgs that were rate-limited or missing.
-       Save the search results to CSV.
+    """Run DDG search pipeline in one bounded pass:
+       - Search stakeholders not in the search journal yet (all of them on the first run).
+       - Retry orgs that were partial, rate-limited or timed out once their backoff has passed
+         (retries due later than SEARCH_RETRY_WINDOW_SECONDS are left for the next run).
+       - Search equivalent titles once and save the urls for every member organization.
+       Compact the journal and export the results to CSV (read by the database ingest).
     """
     stakeholders, stake_df = load_stakeholders()  # Load stakeholders from Excel
-    csv_path = os.path.join(config.LOGS_DIR, "ddg_search_results.csv")
-
-    # Load existing search results from CSV
-    existing_results, rate_limited_orgs = load_existing_results()
-
-    # Identify missing stakeholders (those in the Excel list but not in the existing results)
-    missing_stakeholders = [stakeholder for stakeholder in stakeholders if stakeholder not in existing_results]
+    journal = get_journal()
+    now = time.time()
+    if config.SEARCH_REPLAY:
+        print(f"replay mode: serving searches from {search_cache.cache_stats()[0]} cached queries only")
+
+    # equivalent titles (case, accents, legal suffixes, acronyms) share one search, the first due member is searched
+    groups = stakeholder_titles.group_titles(list(dict.fromkeys(stakeholders)))
+    not_before = {}
+    members = {}   # searched title -> organizations receiving its urls
+    deferred = 0
+    copied = 0     # orgs answered by an earlier search of an equivalent title
+    for group in groups:
+        done = next((org for org in group if journal.status(org) == "ok"), None)
+        due = []
+        for stakeholder in group:
+            eligible = journal.next_eligible(stakeholder)
+            if eligible is None:
+                continue  # done, or given up after SEARCH_MAX_ATTEMPTS failures
+            if done is not None:
+                save_search_results(stakeholder, journal.results([done]))  # no search needed
+                copied += 1
+                continue
+            if eligible - now > config.SEARCH_RETRY_WINDOW_SECONDS:
+                deferred += 1
+                continue
+            due.append((eligible, stakeholder))
+        if due:
+            not_before[due[0][1]] = min(eligible for eligible, _ in due)
+            members[due[0][1]] = [stakeholder for _, stakeholder in due]
     results_list = []
 
-    if not os.path.exists(csv_path):  # If no CSV exists, perform search for all stakeholders
-        print("CSV not found. Running full search for all stakeholders.")
-        results_list.extend(perform_search(stakeholders))
-        
-        #results = perform_search(stakeholders)
-        #results = remove_duplicates(results, existing_results) # remove duplicate urls
-        #save_search_results(results)
-
+    titles = sum(len(group) for group in groups)
+    if titles > len(groups) or copied:
+        print(f"canonicalized {titles} titles into {len(groups)} search groups, saving "
+              f"{sum(len(group) - 1 for group in members.values()) + copied} searches")
+
+    if not_before:
+        due_orgs = [org for group in members.values() for org in group]
+        retries = sum(journal.status(org) != "pending" for org in due_orgs)
+        print(f"Performing search for {len(due_orgs) - retries} new stakeholders and {retries} retries "
+              f"({len(not_before)} searches)")
+        results_list.extend(perform_search(list(not_before), not_before, members))
+    
+    # if no stakeholder is due for a search, simply load results from the journal
     else:
-        print("CSV found. Checking if any stakeholders missing...")
-        
-        # if there are missing stakeholders, perform the search for those
-        if missing_stakeholders:
-            print(f"Performing search for missing stakeholders: {missing_stakeholders}")
-            results_list.extend(perform_search(missing_stakeholders))
-            #results = perform_search(missing_stakeholders)
-            #results = remove_duplicates(results, existing_results)
-            #save_search_results(results)
-
-        # if there are rate-limited organizations, retry searching for those
-        if rate_limited_orgs:
-            print(f"Retrying rate-limited orgs: {list(rate_limited_orgs)}")
-            results_list.extend(perform_search(list(rate_limited_orgs)))
-            
-            #results = perform_search(list(rate_limited_orgs))
-            #results = remove_duplicates(results, existing_results)
-            #save_search_results(results)
-        
-        # if all stakeholders are found, simply load results from the CSV
-        if not missing_stakeholders and not rate_limited_orgs:
-            print("All stakeholders are accounted for. Loading results from CSV.")
-
-            with open(csv_path, "r", encoding="utf-8", errors="replace") as file:
-                reader = csv.reader(file)
-                next(reader, None)  # skip header
-                results_list = [{"org": row[0], "url": row[1]} for row in reader]
+        print("All stakeholders are accounted for. Loading results from the search journal.")
+        results_list = journal.results()
+
+    given_up = journal.given_up_orgs()
+    if deferred:
+        print(f"{deferred} orgs are backing off until a later run")
+    if given_up:
+        print(f"{len(given_up)} orgs failed {config.SEARCH_MAX_ATTEMPTS} times in a row, inspect manually: {sorted(given_up)}")
+
+    # explicit compaction step, one line per org in the journal and a fresh csv export
+    print(f"compacted search journal to {journal.compact()} organizations")
 
     # convert results_list to JSON format
-    ddg_results = [{"org": res["org"], "url": res["url"]} for res in results_list]
+    ddg_results = [{"org": res["org"], "url": res["url"], "title": res.get("title", ""), "snippet": res.get("snippet", "")}
+                   for res in results_list]
 
     # save results for debugging
     #with open("ddg_results_debug.json", "w", encoding="utf-8") as f:
     #    json.dump(ddg_results, f, indent=4)
 
-    return ddg_results, stake_df # return results (used to update db) and stakeholder dataframe (used for org metadata for db)
\ No newline at end of file
+    return ddg_results, stake_df # return results (used to update db) and stakeholder dataframe (used for org metadata for db)
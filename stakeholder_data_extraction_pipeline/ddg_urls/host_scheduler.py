@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+import aiohttp
+from stakeholder_data_extraction_pipeline import config
+
+# per-host politeness for the downloader  # each host gets a few connections and a minimum (jittered) delay
+# between request starts, a global cap bounds all connections; waiting for a host never holds a global slot,
+# so unrelated hosts keep downloading while one host is being paced or backing off
+
+class HostScheduler:
+    """ request slots per host (DOWNLOAD_PER_HOST_CONNECTIONS, DOWNLOAD_HOST_DELAY_SECONDS) under a global cap """
+
+    def __init__(self, max_connections=None, per_host=None, delay=None, jitter=None):
+        self.per_host = per_host or config.DOWNLOAD_PER_HOST_CONNECTIONS
+        self.delay = config.DOWNLOAD_HOST_DELAY_SECONDS if delay is None else delay
+        self.jitter = config.DOWNLOAD_HOST_JITTER_SECONDS if jitter is None else jitter
+        self.connections = asyncio.Semaphore(max_connections or config.DOWNLOAD_MAX_CONNECTIONS)
+        self.hosts = {}       # host -> semaphore limiting its concurrent requests
+        self.next_start = {}  # host -> earliest monotonic time of its next request
+        self.booked = Counter()  # host -> starts reserved by HostQueue for requests not in their slot yet
+
+    def defer(self, host, seconds):
+        """ push the host's next request back (e.g. Retry-After of a 429/503), other hosts are not affected """
+        self.next_start[host] = max(self.next_start.get(host, 0), time.monotonic() + seconds)
+
+    def ready_at(self, host):
+        """ monotonic time from which a request to host may start, None while all its connections are in use """
+        semaphore = self.hosts.get(host)
+        if semaphore is not None and semaphore.locked():
+            return None
+        return self.next_start.get(host, 0)
+
+    def reserve(self, host):
+        """ reserve the host's next request start, requests to the same host are spaced by the delay, returns the start """
+        start = max(time.monotonic(), self.next_start.get(host, 0))
+        self.next_start[host] = start + self.delay + random.uniform(0, self.jitter)
+        return start
+
+    def book(self, host):
+        """ reserve a start now for a request handed out by HostQueue, its slot then starts without pacing again """
+        self.reserve(host)
+        self.booked[host] += 1
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """ wait for a connection to host (its own limit, its spacing, then the global cap) and hold it while the block runs """
+        async with self.hosts.setdefault(host, asyncio.Semaphore(self.per_host)):
+            if self.booked[host]:
+                self.booked[host] -= 1  # start reserved when the request was handed out
+                start = time.monotonic()
+            else:
+                start = self.reserve(host)
+            now = time.monotonic()
+            if start > now:
+                await asyncio.sleep(start - now)  # only this host's slot is held while pacing
+            async with self.connections:
+                yield
+
+class HostQueue:
+    """
+    Bounded queue of claimed urls for the download tasks that only hands out urls whose host can take a request now
+    (a free host connection and its delay passed), in claim order otherwise. Urls of busy or paced hosts wait in their
+    host's line instead of holding a download task in HostScheduler.slot, so a page of urls clustered on a few hosts
+    (claims come in id order) does not stall the tasks while other hosts are idle.
+    Used like asyncio.Queue: put, get, await task_done(item), join, qsize. close() hands out the rest at once (on SIGINT).
+    """
+
+    def __init__(self, scheduler, host_of, maxsize=None):
+        self.scheduler = scheduler
+        self.host_of = host_of   # item -> host
+        self.maxsize = maxsize or config.DOWNLOAD_QUEUE_SIZE
+        self.lines = {}          # host -> deque of waiting items, hosts in the order their first item arrived
+        self.taken = Counter()   # host -> items handed out and not done, at most per_host
+        self.size = 0            # items waiting
+        self.unfinished = 0      # items put and not done
+        self.closed = False
+        self.changed = asyncio.Condition()
+
+    def qsize(self):
+        """ urls waiting for a download task """
+        return self.size
+
+    async def put(self, item):
+        """ add an item to its host's line, waits while the queue is full """
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.size < self.maxsize)
+            self.lines.setdefault(self.host_of(item), deque()).append(item)
+            self.size += 1
+            self.unfinished += 1
+            self.changed.notify_all()
+
+    def next_ready(self):
+        """ (host whose next item may start now or None, seconds until a paced host is due or None) """
+        now, wait = time.monotonic(), None
+        for host in self.lines:
+            ready_at = self.scheduler.ready_at(host)
+            if self.closed or (self.taken[host] < self.scheduler.per_host and ready_at is not None and ready_at <= now):
+                return host, None
+            if self.taken[host] < self.scheduler.per_host and ready_at is not None:
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    async def get(self):
+        """ next item whose host may start a request now, waits (without polling) until one is """
+        async with self.changed:
+            while True:
+                host, wait = self.next_ready()
+                if host is not None:
+                    break
+                try:
+                    await asyncio.wait_for(self.changed.wait(), wait)  # woken by put/task_done, or when a host is due
+                except asyncio.TimeoutError:
+                    pass
+
+            line = self.lines[host]
+            item = line.popleft()
+            if not line:
+                del self.lines[host]  # a later item of the host goes to the back of the host order
+            self.size -= 1
+            self.taken[host] += 1
+            if not self.closed:
+                self.scheduler.book(host)  # the next item of this host waits for the delay here, not in slot()
+            self.changed.notify_all()
+            return item
+
+    async def task_done(self, item):
+        """ the item handed out by get is finished, its host may take the next one """
+        host = self.host_of(item)
+        self.taken[host] -= 1
+        if not self.taken[host]:
+            del self.taken[host]
+        self.unfinished -= 1
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def join(self):
+        """ wait until every item put is done """
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.unfinished)
+
+    async def close(self):
+        """ hand out every waiting item at once (the download tasks skip them once stopping) """
+        self.closed = True
+        async with self.changed:
+            self.changed.notify_all()
+
+def make_connector():
+    """ connection pool for the downloader: global and per-host limits matching the scheduler, keep-alive and dns cache """
+    return aiohttp.TCPConnector(limit=config.DOWNLOAD_MAX_CONNECTIONS,
+                                limit_per_host=config.DOWNLOAD_PER_HOST_CONNECTIONS,
+                                ttl_dns_cache=config.DOWNLOAD_DNS_CACHE_SECONDS,
+                                keepalive_timeout=config.DOWNLOAD_KEEPALIVE_SECONDS)
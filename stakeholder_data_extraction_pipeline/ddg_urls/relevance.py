@@ -0,0 +1,132 @@
+import re
+import sqlite3
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, transaction
+from stakeholder_data_extraction_pipeline.database.url_domains import parse_url_domain
+from .stakeholder_titles import canonical_title, acronyms
+
+# cheap cbam relevance score of a search result from its title, snippet and url (no download needed)
+# urls below the cutoff (RELEVANCE_TOP_K per organization, RELEVANCE_MIN_SCORE) get download_status 'pruned'
+# and are never downloaded, pruned urls that move back inside the cutoff (config change, rescore) become pending again
+
+def compile_keywords(keywords=None):
+    """
+    (pattern, weight) per keyword or phrase, longest first, matched on word boundaries with any whitespace/punctuation
+    between words
+    """
+    keywords = config.RELEVANCE_KEYWORDS if keywords is None else keywords
+    return [(re.compile(r"\b" + r"[\W_]+".join(map(re.escape, phrase.casefold().split())) + r"\b"), weight)
+            for phrase, weight in sorted(keywords.items(), key=lambda item: -len(item[0]))]
+
+def domain_prior(host):
+    """ prior of the most specific configured domain the host belongs to (0 if none) """
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        prior = config.RELEVANCE_DOMAIN_PRIORS.get(".".join(labels[i:]))
+        if prior is not None:
+            return prior
+    return 0.0
+
+def is_own_domain(site, org_title):
+    """ url site matches the organization, e.g. cefic.org for CEFIC or basf.com for BASF SE """
+    if not site or not org_title:
+        return False
+    site = re.sub(r"[\W_]", "", site.casefold())
+    name = canonical_title(org_title).replace(" ", "")
+    if site == name or site in acronyms(org_title):
+        return True
+    return len(site) >= 4 and len(name) >= 4 and (site in name or name in site)
+
+def score_result(url, title=None, snippet=None, org_title=None, keywords=None):
+    """
+    Relevance score of one search result: keyword/phrase weights (RELEVANCE_TITLE_WEIGHT times in the title, once in the
+    snippet, RELEVANCE_URL_WEIGHT times in the url only), plus the domain prior, own-domain boost and pdf boost.
+    A matched phrase is removed from the text, so "carbon border adjustment" does not count "carbon border" again.
+    """
+    keywords = compile_keywords() if keywords is None else keywords
+    fields = [[(title or "").casefold(), config.RELEVANCE_TITLE_WEIGHT],
+              [(snippet or "").casefold(), 1.0],
+              [(url or "").casefold(), config.RELEVANCE_URL_WEIGHT]]
+
+    score = 0.0
+    for pattern, weight in keywords:
+        factors = [factor for text, factor in fields if pattern.search(text)]
+        if factors:
+            score += weight * factors[0]  # counted once, where it weighs most (title before snippet before url)
+            for field in fields:
+                field[0] = pattern.sub(" ", field[0])
+
+    host, _, site = parse_url_domain(url)
+    score += domain_prior(host)
+    if is_own_domain(site, org_title):
+        score += config.RELEVANCE_OWN_DOMAIN_BOOST
+    if (url or "").casefold().split("?")[0].endswith(".pdf"):
+        score += config.RELEVANCE_PDF_BOOST
+    return round(score, 3)
+
+def score_urls(rescore=False, batch_size=5000):
+    """ score urls without a relevance score (all urls with rescore, e.g. after changing weights), returns rows scored """
+    keywords = compile_keywords()
+    scored = 0
+    last_id = 0
+
+    while True:
+        with transaction() as conn:
+            rows = conn.execute(f'''SELECT u.id, u.url, u.title, u.snippet, o.search_title
+                                    FROM urls AS u LEFT JOIN organizations AS o ON o.id = u.organization_id
+                                    WHERE u.id > ? {"" if rescore else "AND u.relevance_score IS NULL"}
+                                    ORDER BY u.id LIMIT ?''', (last_id, batch_size)).fetchall()
+            conn.executemany("UPDATE urls SET relevance_score = ? WHERE id = ?",
+                             [(score_result(url, title, snippet, org_title, keywords), url_id)
+                              for url_id, url, title, snippet, org_title in rows])
+        if not rows:
+            return scored
+        scored += len(rows)
+        last_id = rows[-1][0]
+
+def prune_urls(top_k=None, min_score=None):
+    """
+    Apply the download cutoff per organization: pending urls outside the top_k best scores (RELEVANCE_TOP_K) or below
+    min_score (RELEVANCE_MIN_SCORE) become 'pruned', pruned urls inside the cutoff become pending again.
+    urls saved without a title or snippet are only ranked, the threshold needs the search text to be fair.
+    Returns (pruned, restored) counts.
+    """
+    top_k = config.RELEVANCE_TOP_K if top_k is None else top_k
+    min_score = config.RELEVANCE_MIN_SCORE if min_score is None else min_score
+
+    # rank every url of an organization (downloaded ones too, they already took their place in the top k)
+    ranked = '''SELECT id FROM (
+                    SELECT id, download_status,
+                           (? IS NULL OR ROW_NUMBER() OVER (PARTITION BY organization_id
+                                                            ORDER BY relevance_score DESC, id) <= ?)
+                           AND (? IS NULL OR relevance_score >= ? OR (title IS NULL AND snippet IS NULL)) AS keep
+                    FROM urls
+                    WHERE download_status IN ('pending', 'pruned', 'success', 'not_modified'))'''
+    params = (top_k, top_k, min_score, min_score)
+
+    try:
+        with transaction() as conn:
+            pruned = conn.execute(f'''UPDATE urls SET download_status = 'pruned'
+                                      WHERE id IN ({ranked} WHERE download_status = 'pending' AND NOT keep)''',
+                                  params).rowcount
+            restored = conn.execute(f'''UPDATE urls SET download_status = 'pending'
+                                        WHERE id IN ({ranked} WHERE download_status = 'pruned' AND keep)''',
+                                    params).rowcount
+    except sqlite3.Error as e:
+        print(f"Error pruning urls by relevance: {e}")
+        return 0, 0
+
+    return pruned, restored
+
+def prune_irrelevant_urls(rescore=False):
+    """ score new urls and apply the download cutoff, returns the number of urls pruned """
+    try:
+        scored = score_urls(rescore)
+    except sqlite3.Error as e:
+        print(f"Error scoring urls: {e}")
+        return 0
+
+    pruned, restored = prune_urls()
+    kept = get_connection().execute("SELECT COUNT(*) FROM urls WHERE download_status = 'pending'").fetchone()[0]
+    print(f"scored {scored} urls, pruned {pruned} below the relevance cutoff, restored {restored}, {kept} pending download")
+    return pruned
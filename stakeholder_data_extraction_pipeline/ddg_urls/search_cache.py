@@ -0,0 +1,60 @@
+import json
+import sqlite3
+import time
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, transaction
+
+# offline cache of raw search result lists (search_cache table, migrations.py)
+# keyed on (normalized query, backend, max_results) so a changed SEARCH_QUERY or MAX_RESULTS is a different entry
+
+def normalize_query(query):
+    """ cache key for a query, case and whitespace differences do not change the results """
+    return " ".join(query.casefold().split())
+
+def cache_backend():
+    """ backend part of the cache key, results of a non-ddg provider never mix with real ones """
+    if config.SEARCH_PROVIDER == "ddg":
+        return config.SEARCH_BACKEND
+    return f"{config.SEARCH_PROVIDER}:{config.SEARCH_BACKEND}"
+
+def lookup(query, backend=None, max_results=None, ttl_days=None):
+    """
+    Cached result list for a query, None on a miss.
+    Entries older than ttl_days (default SEARCH_CACHE_TTL_DAYS) are misses, except in replay mode where any entry is served.
+    """
+    backend = backend or cache_backend()
+    max_results = max_results or config.MAX_RESULTS
+    ttl_days = config.SEARCH_CACHE_TTL_DAYS if ttl_days is None else ttl_days
+
+    try:
+        row = get_connection().execute('''SELECT results, fetched_at FROM search_cache
+                                          WHERE query_key = ? AND backend = ? AND max_results = ?''',
+                                       (normalize_query(query), backend, max_results)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error reading search cache: {e}")
+        return None
+
+    if row is None:
+        return None
+    if not config.SEARCH_REPLAY and time.time() - row[1] > ttl_days * 86400:
+        return None  # expired, fetch again
+    return json.loads(row[0])
+
+def store(query, results, backend=None, max_results=None):
+    """ save the raw result list of a query (an empty list is cached too, it is a valid answer) """
+    try:
+        with transaction() as conn:
+            conn.execute('''INSERT OR REPLACE INTO search_cache (query_key, backend, max_results, query, results, fetched_at)
+                            VALUES (?, ?, ?, ?, ?, ?)''',
+                         (normalize_query(query), backend or cache_backend(), max_results or config.MAX_RESULTS,
+                          query, json.dumps(results or [], ensure_ascii=False), time.time()))
+    except sqlite3.Error as e:
+        print(f"Error writing search cache: {e}")
+
+def cache_stats():
+    """ (entries, oldest fetch, newest fetch) of the cache """
+    try:
+        return get_connection().execute("SELECT COUNT(*), MIN(fetched_at), MAX(fetched_at) FROM search_cache").fetchone()
+    except sqlite3.Error as e:
+        print(f"Error reading search cache: {e}")
+        return 0, None, None
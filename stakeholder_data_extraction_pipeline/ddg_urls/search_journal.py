@@ -0,0 +1,168 @@
+import csv
+import json
+import os
+import threading
+import time
+from stakeholder_data_extraction_pipeline import config
+
+# append-only journal of search attempts (jsonl), one line per attempt holding the org's state after it
+# the last line of an org wins, so replaying the file rebuilds the in-memory index and compaction keeps one line per org
+JOURNAL_FILE = "ddg_search_journal.jsonl"
+RESULTS_CSV = "ddg_search_results.csv"  # exported on compaction, read by database_update.add_ddg_urls_csv
+
+# per-org retry state machine
+#   pending -> ok                              results complete, never searched again
+#   pending -> partial/rate_limited/timed_out  retried once next_eligible has passed (exponential backoff),
+#                                              given up (next_eligible None) after SEARCH_MAX_ATTEMPTS failures in a row
+# error (any other search exception) is retried like timed_out, results of partial attempts are kept and merged
+STATUSES = ("pending", "ok", "partial", "rate_limited", "timed_out", "error")
+FAILED = ("rate_limited", "timed_out", "error")  # placeholder urls of orgs without results
+
+def retry_delay(failures):
+    """ seconds to wait before the next attempt after this many failures in a row """
+    return min(config.SEARCH_RETRY_MAX_SECONDS, config.SEARCH_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+
+class SearchJournal:
+    """ per-org search state (status, urls, attempts, failures, next_eligible) backed by an append-only jsonl file """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(config.LOGS_DIR, JOURNAL_FILE)
+        self.orgs = {}  # org -> latest state, o(1) lookups for resume and retry decisions
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """ replay the journal into the index (imports the results csv of older runs if there is no journal yet) """
+        if not os.path.exists(self.path):
+            self.import_csv(os.path.join(os.path.dirname(self.path), RESULTS_CSV))
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                # lines written before retry scheduling are eligible straight away
+                entry.setdefault("next_eligible", None if entry["status"] == "ok" else 0)
+                self.orgs[entry["org"]] = entry
+
+    def import_csv(self, csv_path):
+        """ seed the journal from an organisation,url csv written before the journal existed """
+        try:
+            with open(csv_path, "r", encoding="utf-8", errors="replace") as file:
+                reader = csv.reader(file)
+                next(reader, None)  # skip header
+                grouped = {}
+                for row in reader:
+                    if len(row) >= 2:
+                        grouped.setdefault(row[0], []).append(row[1])
+        except FileNotFoundError:
+            return
+
+        for org, urls in grouped.items():
+            found = [url for url in urls if url not in FAILED]
+            if found:
+                self.record(org, found)
+            else:
+                self.record(org, [], urls[-1], retry_at=0)  # retried in the next pass
+        print(f"imported search results of {len(grouped)} orgs from {csv_path}")
+
+    def record(self, org, urls, status="ok", retry_at=None, snippets=None):
+        """
+        Append the outcome of one search attempt and return the org's new state.
+        urls are the result urls (or ['no_results']), partial results are merged with earlier ones.
+        snippets maps urls to the [title, body] the search returned for them (used for relevance scoring).
+        next_eligible is set from the backoff (or retry_at), None when done or given up.
+        """
+        with self.lock:
+            previous = self.orgs.get(org, {})
+            now = time.time()
+            failures = 0 if status == "ok" else previous.get("failures", 0) + 1
+            kept = previous.get("urls", []) if previous.get("status") != "ok" else []
+            kept_snippets = previous.get("snippets", {}) if previous.get("status") != "ok" else {}
+
+            if status == "ok":
+                next_eligible = None
+            elif failures >= config.SEARCH_MAX_ATTEMPTS:
+                next_eligible = None  # give up, inspect manually
+            else:
+                next_eligible = retry_at if retry_at is not None else now + retry_delay(failures)
+
+            entry = {"org": org,
+                     "status": status,
+                     "urls": list(dict.fromkeys([*kept, *urls])),  # results of earlier partial attempts are kept
+                     "snippets": {**kept_snippets, **(snippets or {})},
+                     "attempts": previous.get("attempts", 0) + 1,
+                     "failures": failures,
+                     "next_eligible": next_eligible,
+                     "ts": time.strftime("%Y-%m-%d %H:%M:%S")}
+            self.orgs[org] = entry
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")  # one append per attempt, nothing is rewritten
+            return entry
+
+    def status(self, org):
+        """ status of an org: ok, partial, rate_limited, timed_out, error or pending (never searched) """
+        return self.orgs.get(org, {}).get("status", "pending")
+
+    def next_eligible(self, org):
+        """ unix time from which an org may be searched (0 if never searched), None if done or given up """
+        return self.orgs.get(org, {}).get("next_eligible", 0)
+
+    def done_orgs(self):
+        return {org for org, entry in self.orgs.items() if entry["status"] == "ok"}
+
+    def retry_orgs(self):
+        """ orgs waiting for another attempt """
+        return {org for org, entry in self.orgs.items() if entry["next_eligible"] is not None}
+
+    def given_up_orgs(self):
+        """ orgs that failed SEARCH_MAX_ATTEMPTS times in a row """
+        return {org for org, entry in self.orgs.items() if entry["status"] != "ok" and entry["next_eligible"] is None}
+
+    def results(self, orgs=None):
+        """
+        org/url/title/snippet rows for all (or the given) orgs, failed orgs without any urls get their status as placeholder
+        url (title and snippet are empty for urls saved without them)
+        """
+        rows = []
+        for org in (self.orgs if orgs is None else orgs):
+            entry = self.orgs.get(org)
+            if entry is None:
+                continue
+            urls = entry["urls"] or [entry["status"]]
+            snippets = entry.get("snippets", {})
+            for url in urls:
+                title, snippet = snippets.get(url, ("", ""))
+                rows.append({"org": org, "url": url, "title": title, "snippet": snippet})
+        return rows
+
+    def compact(self, csv_path=None):
+        """ rewrite the journal with one line per org and export the results csv, returns the number of orgs """
+        with self.lock:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for entry in self.orgs.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(temp_path, self.path)  # atomic, an interrupted compaction leaves the old journal
+
+            csv_path = csv_path or os.path.join(os.path.dirname(self.path), RESULTS_CSV)
+            with open(csv_path + ".tmp", "w", newline="", encoding="utf-8", errors="replace") as file:
+                writer = csv.writer(file)
+                writer.writerow(["organisation", "url", "title", "snippet"])
+                for row in self.results():
+                    writer.writerow([row["org"], row["url"], row["title"], row["snippet"]])
+            os.replace(csv_path + ".tmp", csv_path)
+
+        return len(self.orgs)
+
+_journals = {}  # path -> journal, replayed once per process
+
+def get_journal():
+    """ the journal for the configured logs dir, loaded on first use """
+    path = os.path.join(config.LOGS_DIR, JOURNAL_FILE)
+    if path not in _journals:
+        _journals[path] = SearchJournal(path)
+    return _journals[path]
@@ -0,0 +1,125 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import ContextManager, Protocol
+
+from stakeholder_data_extraction_pipeline import config
+from duckduckgo_search.exceptions import RatelimitException, TimeoutException
+from .search_cache import normalize_query
+
+# search backends behind perform_search  # 'ddg' = live duckduckgo, 'local' = fixture corpus for load tests
+# a provider opens one session per search worker, the session's text() answers like DDGS.text (list of href/title/body dicts)
+
+class SearchProvider(Protocol):
+    name: str
+
+    def session(self) -> ContextManager:
+        """ context manager giving one worker a client with text(query, max_results=..., backend=...) """
+
+class PartialResults(Exception):
+    """ the backend stopped before max_results (e.g. a failed page), results holds what was returned """
+
+    def __init__(self, results, message="partial results"):
+        super().__init__(message)
+        self.results = results
+
+class DDGSearchProvider:
+    """ live duckduckgo searches, one DDGS session per worker """
+    name = "ddg"
+
+    def __init__(self, client_class=None):
+        if client_class is None:
+            from duckduckgo_search import DDGS
+            client_class = DDGS
+        self.client_class = client_class
+
+    def session(self):
+        return self.client_class()
+
+class LocalFixtureProvider:
+    """
+    Deterministic offline provider for benchmarks and tests.
+    Answers from a corpus (normalized query -> result list), queries not in the corpus get synthetic results.
+    Simulates latency and injects rate limits, timeouts and partial results at the given rates. Failures are drawn per
+    (query, attempt) from the seed, so a run gives the same outcomes whatever the worker interleaving.
+    max_rate_per_min additionally rate limits every request above that many in the last minute, like the live service.
+    All calls are logged in self.calls as (time, query, outcome).
+    """
+    name = "local"
+
+    def __init__(self, corpus=None, latency=0.0, rate_limit_rate=0.0, timeout_rate=0.0, partial_rate=0.0,
+                 max_rate_per_min=None, seed=0):
+        self.corpus = {normalize_query(query): results for query, results in (corpus or {}).items()}
+        self.latency = latency                    # mean seconds per request (uniform 0.5x - 1.5x)
+        self.rate_limit_rate = rate_limit_rate    # share of requests answered with a rate limit
+        self.timeout_rate = timeout_rate          # share of requests timing out (after the full latency)
+        self.partial_rate = partial_rate          # share of requests returning only part of the results
+        self.max_rate_per_min = max_rate_per_min
+        self.seed = seed
+        self.attempts = {}                        # query -> requests so far
+        self.recent = deque()                     # request times of the last minute
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """ provider with a json corpus {query: [results]} """
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    @classmethod
+    def from_cache(cls, **kwargs):
+        """ provider answering with the raw results in the search cache (real result lists without the network) """
+        from stakeholder_data_extraction_pipeline.database.connection import get_connection
+        rows = get_connection().execute("SELECT query_key, results FROM search_cache").fetchall()
+        return cls({query: json.loads(results) for query, results in rows}, **kwargs)
+
+    def session(self):
+        return nullcontext(self)  # stateless client, shared by all workers
+
+    def synthetic_results(self, query, rng, max_results):
+        """ made-up result list for a query outside the corpus, same query -> same results """
+        slug = "-".join(normalize_query(query).replace('"', "").split()[:3]) or "org"
+        return [{"href": f"https://{slug}.example.org/doc/{i}", "title": f"{query} {i}", "body": f"result {i} for {query}"}
+                for i in range(rng.randint(0, max_results))]
+
+    def text(self, query, max_results=None, backend=None):
+        max_results = max_results or config.MAX_RESULTS
+        with self.lock:
+            attempt = self.attempts.get(query, 0)
+            self.attempts[query] = attempt + 1
+            now = time.monotonic()
+            while self.recent and self.recent[0] < now - 60:
+                self.recent.popleft()
+            self.recent.append(now)
+            over_rate = self.max_rate_per_min is not None and len(self.recent) > self.max_rate_per_min
+
+        rng = random.Random(f"{self.seed}:{query}:{attempt}")
+        time.sleep(self.latency * rng.uniform(0.5, 1.5))
+        draw = rng.random()
+
+        outcome = "ok"
+        if over_rate or draw < self.rate_limit_rate:
+            outcome = "rate_limited"
+        elif draw < self.rate_limit_rate + self.timeout_rate:
+            outcome = "timed_out"
+        elif draw < self.rate_limit_rate + self.timeout_rate + self.partial_rate:
+            outcome = "partial"
+        with self.lock:
+            self.calls.append((time.time(), query, outcome))
+
+        if outcome == "rate_limited":
+            raise RatelimitException(f"local fixture: {query} 202 Ratelimit")
+        if outcome == "timed_out":
+            raise TimeoutException(f"local fixture: {query} timed out")
+
+        results = self.corpus.get(normalize_query(query))
+        if results is None:
+            results = self.synthetic_results(query, random.Random(f"{self.seed}:{query}"), max_results)
+        results = results[:max_results]
+        if outcome == "partial":
+            raise PartialResults(results[:len(results) // 2])
+        return results
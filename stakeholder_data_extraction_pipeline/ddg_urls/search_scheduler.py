@@ -0,0 +1,208 @@
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from stakeholder_data_extraction_pipeline import config
+
+# outcomes a search task reports back to the limiter  # SKIPPED = not searched (replay mode cache miss)
+OK, PARTIAL, RATE_LIMITED, TIMED_OUT, ERROR, SKIPPED = "ok", "partial", "rate_limited", "timed_out", "error", "skipped"
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by the search workers, with an AIMD rate.
+    The rate (requests/min) grows by SEARCH_RATE_INCREASE after each successful search and is multiplied by
+    SEARCH_RATE_DECREASE on a rate limit or timeout, which also pauses all workers for an exponentially growing backoff.
+    Rate and pause are saved to state_path so the next run starts where this one left off.
+    """
+
+    def __init__(self, state_path=None, rate=None):
+        self.state_path = state_path if state_path is not None else config.SEARCH_LIMITER_STATE
+        self.rate = rate or config.SEARCH_RATE_PER_MIN
+        self.backoff = 0             # current pause length in seconds, 0 after a success
+        self.paused_until = 0.0      # wall clock time before which no request is sent
+        self.tokens = 1.0            # one request may go out straight away
+        self.refilled = time.monotonic()
+        self.sent = deque()          # send times of the last minute, for the effective rate
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        if rate is None:
+            self.load()
+
+    def load(self):
+        """ continue from the saved rate and any pause still running """
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.rate = min(max(float(state["rate"]), config.SEARCH_MIN_RATE_PER_MIN), config.SEARCH_MAX_RATE_PER_MIN)
+            self.backoff = float(state.get("backoff", 0))
+            self.paused_until = float(state.get("paused_until", 0))
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # no usable state, start from config
+
+    def save(self):
+        """ write rate and pause to the state file (called with the lock held) """
+        if not self.state_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"rate": self.rate, "backoff": self.backoff, "paused_until": self.paused_until,
+                           "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+            os.replace(self.state_path + ".tmp", self.state_path)
+        except OSError as e:
+            print(f"could not save search limiter state: {e}")
+
+    def acquire(self):
+        """ block until this worker may send the next request """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(1.0, self.tokens + (now - self.refilled) * self.rate / 60)  # bucket holds one request
+                self.refilled = now
+                wait = self.paused_until - time.time()
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.sent.append(now)
+                    return
+                if wait <= 0:
+                    wait = (1 - self.tokens) * 60 / self.rate  # time until the next token
+            time.sleep(wait)
+
+    def record(self, outcome):
+        """ adapt the rate to the outcome of a search (OK grows it, RATE_LIMITED/TIMED_OUT cut it, others leave it) """
+        with self.lock:
+            if outcome == OK:
+                self.rate = min(config.SEARCH_MAX_RATE_PER_MIN, self.rate + config.SEARCH_RATE_INCREASE)
+                self.backoff = 0
+            elif outcome in (RATE_LIMITED, TIMED_OUT):
+                self.rate = max(config.SEARCH_MIN_RATE_PER_MIN, self.rate * config.SEARCH_RATE_DECREASE)
+                self.backoff = min(config.SEARCH_MAX_BACKOFF_SECONDS, self.backoff * 2 or config.SEARCH_BACKOFF_SECONDS)
+                self.paused_until = time.time() + self.backoff
+                self.tokens = 0.0
+                print(f"{outcome.replace('_', ' ')}, pausing searches for {self.backoff:.0f}s, rate now {self.rate:.1f}/min")
+            else:
+                return  # other errors say nothing about the rate limit
+            self.save()
+
+    def requests_per_minute(self):
+        """ requests actually sent over the last minute (or since start if shorter) """
+        with self.lock:
+            now = time.monotonic()
+            while self.sent and self.sent[0] < now - 60:
+                self.sent.popleft()
+            return len(self.sent) * 60 / max(min(now - self.started, 60), 1)
+
+def run_searches(names, open_client, search_one, on_result=None, workers=None, limiter=None, not_before=None, cached=None):
+    """
+    Search all names with a small pool of workers sharing one rate limiter.
+    open_client() returns a context manager giving each worker its own client (e.g. DDGS),
+    search_one(client, name) returns (results list, outcome). on_result(name, results, outcome) is called
+    in the calling thread as searches finish (so saving needs no locking), it may return a unix time at which
+    the name should be searched again (retry), None otherwise. not_before maps names to the earliest time they
+    may be searched. cached(name) may return (results, outcome) without a request (cache hit), these skip the limiter.
+    Workers sleep until the next name is due, there is no polling. Every name taken reports exactly one outcome
+    (ERROR if cached or search_one raise), if on_result raises the workers stop after their current search.
+    Returns all results in finish order.
+    """
+    workers = workers or config.SEARCH_WORKERS
+    limiter = limiter or AdaptiveRateLimiter()
+    not_before = not_before or {}
+
+    # heap of (due time, order, name), order keeps the input order for names due at the same time
+    due = [(not_before.get(name, 0), i, name) for i, name in enumerate(names)]
+    heapq.heapify(due)
+    order = len(due)
+    in_flight = 0  # names being searched or waiting for on_result (which may schedule a retry)
+    stopped = False  # set when the calling thread gives up, workers take no further names
+    cond = threading.Condition()
+    finished = queue.Queue()
+
+    def next_name():
+        """ pop the next due name, waiting until it is due, None when nothing is left """
+        nonlocal in_flight
+        with cond:
+            while True:
+                if stopped:
+                    return None
+                if due:
+                    wait = due[0][0] - time.time()
+                    if wait <= 0:
+                        in_flight += 1
+                        return heapq.heappop(due)[2]
+                    cond.wait(wait)   # sleep until the next retry is due (or a retry is added)
+                elif in_flight:
+                    cond.wait()       # an in-flight search may still schedule a retry
+                else:
+                    return None
+
+    def search(client, name):
+        """ (results, outcome) of one name, from the cache or one rate limited request, ERROR if either raises """
+        try:
+            hit = cached(name) if cached else None
+            if hit is not None:
+                return hit  # no request sent
+            limiter.acquire()
+            try:
+                results, outcome = search_one(client, name)
+            except Exception as e:
+                print(f"Exception for {name}: {e}")
+                results, outcome = [], ERROR
+            limiter.record(outcome)
+            return results, outcome
+        except Exception as e:
+            print(f"Error searching {name}: {e}")
+            return [], ERROR
+
+    def worker():
+        try:
+            with open_client() as client:
+                while (name := next_name()) is not None:
+                    finished.put((name, *search(client, name)))  # always reported, so in_flight goes back down
+        finally:
+            finished.put(None)  # this worker is done
+
+    all_results = []
+    attempts = 0
+    running = min(workers, len(names))
+    with ThreadPoolExecutor(max_workers=max(running, 1), thread_name_prefix="search") as pool:
+        futures = [pool.submit(worker) for _ in range(running)]
+
+        try:
+            while running:
+                item = finished.get()
+                if item is None:
+                    running -= 1
+                    continue
+
+                name, results, outcome = item
+                attempts += 1
+                all_results.extend(results)
+                retry_at = None
+                try:
+                    retry_at = on_result(name, results, outcome) if on_result else None
+                finally:
+                    with cond:
+                        if retry_at is not None:
+                            heapq.heappush(due, (retry_at, order, name))
+                            order += 1
+                        in_flight -= 1
+                        cond.notify_all()
+
+                retry = f", retry in {max(retry_at - time.time(), 0):.0f}s" if retry_at is not None else ""
+                print(f"[{attempts} searches, {len(names) - len(due) - in_flight}/{len(names)} orgs] {name}: {outcome}, "
+                      f"{len(results)} results{retry} | {limiter.requests_per_minute():.1f} req/min "
+                      f"(limit {limiter.rate:.1f}/min)", flush=True)
+        except BaseException:
+            with cond:
+                stopped = True  # let the workers finish their current search and exit, the pool can then shut down
+                cond.notify_all()
+            raise
+
+        for future in futures:
+            future.result()  # surface a worker that died
+
+    return all_results
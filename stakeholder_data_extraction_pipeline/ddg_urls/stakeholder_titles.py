@@ -0,0 +1,80 @@
+import re
+import unicodedata
+
+# canonical search titles  # equivalent stakeholder titles (case, accents, punctuation, legal suffixes, acronyms)
+# are grouped so ddg is searched once per group and the urls are fanned out to every member organization
+
+# legal form suffixes dropped from the end of a title (compared after punctuation is removed)
+LEGAL_SUFFIXES = {
+    "ev", "aisbl", "asbl", "ivzw", "vzw", "gmbh", "ag", "sa", "sas", "sarl", "spa", "srl", "se", "nv", "bv", "kg",
+    "oy", "oyj", "ab", "as", "asa", "ltd", "limited", "inc", "incorporated", "corp", "corporation", "llc", "plc",
+    "ulc", "co", "aps", "kft", "sp z oo", "zrt", "doo", "ou",
+}
+# words skipped when building initials for acronym matching
+STOPWORDS = {"of", "the", "and", "for", "in", "on", "de", "der", "des", "du", "la", "le", "di", "del", "et", "und"}
+ACRONYM = re.compile(r"\(([A-Za-z][A-Za-z&.\-]{1,14})\)")  # "European Steel Association (EUROFER)"
+
+def title_words(title):
+    """ words of a title without accents, case, punctuation or a bracketed acronym, '&' -> 'and' """
+    text = unicodedata.normalize("NFKD", str(title))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = ACRONYM.sub(" ", text)  # the acronym in brackets is matched separately
+    text = text.replace("&", " and ")
+    text = re.sub(r"[^\w\s]", "", text)  # e.V. -> ev, s.a. -> sa
+    return text.replace("_", " ").split()
+
+def canonical_title(title):
+    """ comparison key of a title: normalized words without legal suffix, single spaces """
+    words = title_words(title)
+
+    # drop legal suffixes from the end (several in a row, e.g. "gmbh co kg"), keep at least one word
+    while len(words) > 1:
+        for size in (3, 2, 1):
+            if len(words) > size and " ".join(words[-size:]) in LEGAL_SUFFIXES:
+                del words[-size:]
+                break
+        else:
+            break
+    return " ".join(words)
+
+def acronyms(title):
+    """ acronyms a title can be known by: a bracketed acronym, and the initials of a multi-word name """
+    found = {canonical_title(match) for match in ACRONYM.findall(str(title))}
+    words = [word for word in canonical_title(title).split() if word not in STOPWORDS]
+    if len(words) >= 2:
+        found.add("".join(word[0] for word in words))
+    return found
+
+def is_acronym(title):
+    """ a single all-caps word such as CEFIC or EUROFER """
+    title = str(title).strip()
+    return " " not in title and len(title) >= 2 and title.upper() == title and any(ch.isalpha() for ch in title)
+
+def group_titles(titles):
+    """
+    Group equivalent titles, returns a list of member lists in input order (first member = title used for the search).
+    Titles are equal if their canonical keys match. A bare acronym joins the group of the one full title it abbreviates,
+    ambiguous acronyms (initials of several groups) stay on their own.
+    """
+    groups = {}  # canonical key -> members
+    for title in titles:
+        groups.setdefault(canonical_title(title), []).append(title)
+
+    # acronym -> keys of groups whose full titles it abbreviates
+    abbreviates = {}
+    for key, members in groups.items():
+        if all(is_acronym(member) for member in members):
+            continue
+        for member in members:
+            for acronym in acronyms(member):
+                abbreviates.setdefault(acronym, set()).add(key)
+
+    for key in list(groups):
+        members = groups[key]
+        if key in abbreviates and all(is_acronym(member) for member in members):
+            targets = abbreviates[key] - {key}
+            if len(targets) == 1:
+                groups[targets.pop()].extend(groups.pop(key))
+
+    # search with a full name where the group has one, it finds the organization more reliably than an acronym
+    return [sorted(members, key=is_acronym) for members in groups.values()]
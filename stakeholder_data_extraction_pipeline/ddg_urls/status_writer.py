@@ -0,0 +1,121 @@
+import asyncio
+import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import transaction, close_connection
+from stakeholder_data_extraction_pipeline.database import work_queue
+
+# key of the writer's Counter for rows whose batch could not be written (their leases stay until they expire)
+WRITE_FAILED = "write_failed"
+# key of the writer's Counter for rows not written because another worker claimed them after this worker's lease expired
+LEASE_LOST = "lease_lost"
+
+def status_record(url_id, download_status, timestamp, file_type, paywall_status, file_path=None, content_hash=None,
+                  error=None, next_retry_at=None, etag=None, last_modified=None, final_url=None):
+    """
+    build one urls status row for the writer queue, with defaults for missing values (file_path/content_hash and the
+    refresh validators etag/last_modified/final_url kept if None), every record counts as one download attempt,
+    error and next_retry_at (unix seconds) are cleared when None
+    """
+    return (download_status or "unknown",         # ensure download_status is not None
+            timestamp or "2025-01-01 00:00:00",   # default timestamp if None
+            file_type or "unknown",               # default file type if None
+            paywall_status or "unknown",          # default paywall_status if None
+            file_path,                            # blob path of the stored body
+            content_hash,                         # sha-256 of the body
+            error,                                # last error, None after a success
+            next_retry_at,                        # when a transient failure may be retried
+            etag,                                 # ETag of the stored body (If-None-Match of the next refresh)
+            last_modified,                        # Last-Modified of the stored body (If-Modified-Since)
+            final_url,                            # url after redirects
+            url_id)
+
+def write_status_batch(batch, worker):
+    """
+    write a batch of status rows in one transaction and drop their work leases (runs in the writer thread, never on
+    the event loop), only rows still claimed by worker are written (a row reclaimed by another worker after this
+    worker's lease expired is left to it), returns a Counter of statuses written and LEASE_LOST, None if not committed
+    """
+    written = Counter()
+    try:
+        with transaction() as conn:
+            for record in batch:
+                updated = conn.execute("""
+                UPDATE urls
+                SET download_status = ?, timestamp = ?, file_type = ?, paywall_status = ?,
+                    file_path = COALESCE(?, file_path), content_hash = COALESCE(?, content_hash),
+                    last_error = ?, next_retry_at = ?, attempts = attempts + 1,
+                    etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), final_url = COALESCE(?, final_url),
+                    claimed_by = NULL, lease_expires = NULL, heartbeat_at = NULL
+                WHERE id = ? AND claimed_by = ?
+                """, (*record, worker)).rowcount
+                written[record[0] if updated else LEASE_LOST] += 1
+
+    except sqlite3.Error as e:
+        print(f"Error updating urls download status for {len(batch)} rows: {e}")
+        return None
+    return written
+
+async def flush_status_queue(queue):
+    """ wait until every status row queued so far is written """
+    written = asyncio.Event()
+    await queue.put(written)
+    await written.wait()
+
+async def run_status_writer(queue, batch_size=None, flush_ms=None, worker=None):
+    """
+    Drain status rows from queue and write them in batched transactions, for rows claimed by worker (default this process).
+    A batch is flushed every batch_size rows or flush_ms after its first row, whichever comes first.
+    An asyncio.Event on the queue flushes straight away and is set when written (flush_status_queue).
+    Put None on the queue to flush what is left and stop. Returns a Counter of committed statuses,
+    rows of batches that failed to commit are counted under WRITE_FAILED, rows reclaimed by another worker under LEASE_LOST.
+    """
+    worker = worker or work_queue.worker_id()
+    batch_size = batch_size or config.DB_WRITE_BATCH_SIZE
+    flush_s = (flush_ms or config.DB_WRITE_FLUSH_MS) / 1000
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="status_writer")  # one thread, one connection
+
+    batch = []
+    deadline = None  # when the current batch must be flushed
+    written = Counter()  # download status -> rows written
+
+    async def flush():
+        nonlocal batch, written
+        if batch:
+            committed = await loop.run_in_executor(executor, write_status_batch, batch, worker)  # sqlite off the event loop
+            if committed is None:
+                written[WRITE_FAILED] += len(batch)
+            else:
+                written.update(committed)
+            batch = []
+
+    try:
+        while True:
+            timeout = max(0, deadline - loop.time()) if batch else None
+            try:
+                record = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await flush()  # time based flush
+                continue
+
+            if record is None:
+                break  # stop sentinel
+            if isinstance(record, asyncio.Event):
+                await flush()  # flush request
+                record.set()
+                continue
+
+            batch.append(record)
+            if len(batch) == 1:
+                deadline = loop.time() + flush_s
+            if len(batch) >= batch_size:
+                await flush()  # size based flush
+    finally:
+        await flush()
+        await loop.run_in_executor(executor, close_connection)  # close the writer thread's connection
+        executor.shutdown(wait=True)
+
+    return written
@@ -1,5 +1,5 @@
 import os
-import time
+import argparse
 
 # where all file paths, keyword search stored
 from stakeholder_data_extraction_pipeline import config 
@@ -7,21 +7,31 @@ from stakeholder_data_extraction_pipeline import config
 # for ddg url extraction, download 
 from .ddg_urls.ddg_search import run_search_pipeline, load_existing_results
 from .ddg_urls.ddg_download import run_downloader
-from .ddg_urls import ddg_file_detection
+from .ddg_urls.relevance import prune_irrelevant_urls
 
 # for creating, updating and cleaning the database
 from .database.database_setup import setup_db
 from .database.database_update import read_org_data, add_ddg_urls_csv
 from .database.database_clean import remove_noresults_urls, remove_duplicate_urls, filter_unwanted_urls
+from .database.run_ledger import start_run, finish_run, track_stage
 
 # for extracting text from identified pdf and html files
 from .text_extraction import html_text_extraction 
 from .text_extraction import pdf_text_extraction 
 
 # OBS MUST RUN FROM TERMINAL FROM DATA FOLDER VIA CODE python -m stakeholder_data_extraction_pipeline.main
+# compare stage timings of recent runs with python -m stakeholder_data_extraction_pipeline.database.run_ledger --last 5
+# re-run without searching ddg (cached results only) with python -m stakeholder_data_extraction_pipeline.main --replay
+# re-check earlier downloads (conditional requests, unchanged documents are not re-extracted) with --refresh
 
 def main():
     " Main pipeline for running url data extraction"
+    parser = argparse.ArgumentParser(description="stakeholder document pipeline")
+    parser.add_argument("--replay", action="store_true", help="serve ddg searches only from the search cache (no network)")
+    parser.add_argument("--refresh", action="store_true", help="re-check downloaded urls, re-extract only changed documents")
+    args = parser.parse_args()
+    config.SEARCH_REPLAY = config.SEARCH_REPLAY or args.replay
+    config.DOWNLOAD_REFRESH = config.DOWNLOAD_REFRESH or args.refresh
     
     # ensure required directories exist  # create directories if they don't exist
     os.makedirs(config.DATA_DIR, exist_ok=True)             # data directory
@@ -35,44 +45,58 @@ def main():
     # 1. Set up database
     print("Setting up database...", flush=True)
     setup_db()  # create database (if they don't already exist)
+    run_id = start_run()  # record timings and throughput of each stage in the run ledger
     
-    # 2. Search DDG for stakeholder documents
-    print("\nSearching DDG for stakeholder documents...")
+    try:
+        # 2. Search DDG for stakeholder documents
+        print("\nSearching DDG for stakeholder documents...")
 
-    # Loop until no organizations remain in a "rate_limited" or "error" state.
-    # OBS: need to play around with this because the DDGs backend often can return ratelimit error
-    
-    while True:
-        ddg_results, org_df = run_search_pipeline()  # Run the search pipeline
-        # Check CSV for any rate-limited orgs remaining.
-        _, rate_limited_orgs = load_existing_results()
-        if not rate_limited_orgs:
-            print(" 🎉 All organizations processed successfully 🎉 ")
-            break  # Exit loop if no org is rate-limited
-        
-        print("Some organizations are still rate-limited. Retrying in 10 seconds...")
-        time.sleep(10)  # Wait before retrying
+        # one bounded pass, failed orgs are retried in the pass once their backoff has passed (see ddg_urls/search_journal.py)
+        with track_stage(run_id, "search") as stage:
+            ddg_results, org_df = run_search_pipeline()  # Run the search pipeline
+            _, retry_orgs = load_existing_results()
+            stage.update(items=len(ddg_results), waiting_for_retry=len(retry_orgs))
+            if not retry_orgs:
+                print(" 🎉 All organizations processed successfully 🎉 ")
+            else:
+                print(f"{len(retry_orgs)} organizations are still backing off, they are retried in the next run")
 
-    # 3. Add organization and url into database
-    print("\nAdding organization and DDG url data into database...")
-    read_org_data (org_df)    # add stakeholder information into db
-    add_ddg_urls_csv()        # add url information in db
-    
-    # 4. Clean url database
-    print("\nCleaning up database: filtering unwanted urls...")
-    filter_unwanted_urls()   # remove social media and google searches
-    remove_noresults_urls()  # remove orgs with no urls extracted, or extra error/timed_out messages
-    remove_duplicate_urls()  # remove duplicate urls              ** THINK WHAT INFORMATION LOST
+        # 3. Add organization and url into database
+        print("\nAdding organization and DDG url data into database...")
+        with track_stage(run_id, "ingest") as stage:
+            org_ids = read_org_data(org_df)                  # add stakeholder information into db (one transaction)
+            inserted, skipped = add_ddg_urls_csv(org_ids)    # add url information in db, reusing the search title -> ids map
+            stage.update(items=inserted, skipped=skipped, organizations=sum(map(len, org_ids.values())))
+        
+        # 4. Clean url database
+        print("\nCleaning up database: filtering unwanted urls...")
+        with track_stage(run_id, "cleaning") as stage:
+            stage["items"] += filter_unwanted_urls()   # remove social media and google searches
+            stage["items"] += remove_noresults_urls()  # remove orgs with no urls extracted, or extra error/timed_out messages
+            stage["items"] += remove_duplicate_urls()  # remove duplicate urls              ** THINK WHAT INFORMATION LOST
+            stage["pruned"] = prune_irrelevant_urls()  # only the most relevant urls per org are downloaded (top-k / threshold)
 
-    # 5. Download files (locally) from extracted urls
-    print("\nDownloading files from ddg urls...")
-    run_downloader() # download pending urls asynchronously
+        # 5. Download files (locally) from extracted urls
+        print("\nDownloading files from ddg urls...")
+        with track_stage(run_id, "download") as stage:
+            stage.update(run_downloader() or {})  # download pending urls asynchronously
+        if stage.get("interrupted"):
+            finish_run(run_id, "interrupted")  # Ctrl-C during downloads, unfinished urls stay pending for the next run
+            print("\nDownloads interrupted, stopping the pipeline")
+            return
+        
+        # 6. Extracting text from downloaded files
+        print("\nExtracting text from HTML and PDF files")
+        with track_stage(run_id, "html_extraction") as stage:
+            stage.update(html_text_extraction.run_html_extraction()) # process html files
+        with track_stage(run_id, "pdf_extraction") as stage:
+            stage.update(pdf_text_extraction.run_pdf_extraction())   # process pdf files 
     
-    # 6. Extracting text from downloaded files
-    print("\nExtracting text from HTML and PDF files")
-    html_text_extraction.run_html_extraction() # process html files
-    pdf_text_extraction.run_pdf_extraction()   # process pdf files 
+    except BaseException:
+        finish_run(run_id, "failed")  # keep the partial run in the ledger
+        raise
 
+    finish_run(run_id)
     print("\nStakeholder document pipeline completed successfully!")
 
 if __name__ == "__main__":
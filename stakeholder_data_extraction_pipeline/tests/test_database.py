@@ -1,7 +1,12 @@
 import sqlite3
+import pytest
+import pandas as pd
 from stakeholder_data_extraction_pipeline import config 
+from stakeholder_data_extraction_pipeline.database.migrations import MIGRATIONS, run_migrations, schema_version
+from stakeholder_data_extraction_pipeline.database import work_queue, run_ledger
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, close_connection, transaction
 from stakeholder_data_extraction_pipeline.database.database_setup import setup_db
-from stakeholder_data_extraction_pipeline.database.database_update import insert_organization, get_organization_id
+from stakeholder_data_extraction_pipeline.database.database_update import insert_organization, get_organization_id, add_ddg_urls, read_org_data
 
 def test_database_setup():
     """Test if the database and tables are created successfully."""
@@ -37,3 +42,172 @@ def test_insert_organization():
     assert result[3] == "NGO"  # category
 
     conn.close()
+
+def test_connection_pragmas(tmp_path, monkeypatch):
+    """Test that the shared connection uses wal journaling and a busy timeout."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    conn = get_connection()
+    
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == config.DB_BUSY_TIMEOUT_MS
+    assert get_connection() is conn  # same connection reused within a thread
+
+    close_connection()
+
+def test_transaction_rollback(tmp_path, monkeypatch):
+    """Test that a failed transaction leaves no partial writes behind."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    
+    with pytest.raises(RuntimeError):
+        with transaction() as conn:
+            conn.execute("INSERT INTO organizations (registered_organisation_title, search_title, category) VALUES ('A', 'A', 'NGO')")
+            raise RuntimeError("abort")
+    
+    count = get_connection().execute("SELECT COUNT(*) FROM organizations").fetchone()[0]
+    assert count == 0
+
+    close_connection()
+
+def test_add_ddg_urls_bulk(tmp_path, monkeypatch):
+    """Test bulk url ingestion skips duplicates and unknown orgs and builds file names from row ids."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    insert_organization("Test Org", "Test Org Search", "NGO")
+    org_id = get_organization_id("Test Org Search")
+    
+    results = [
+        {"org": "Test Org Search", "url": "https://example.com/a"},
+        {"org": "Test Org Search", "url": "https://example.com/b"},
+        {"org": "Test Org Search", "url": "https://example.com/a"},  # duplicate
+        {"org": "Unknown Org", "url": "https://example.com/c"},      # org not in db
+    ]
+    inserted, skipped = add_ddg_urls(results)
+    assert (inserted, skipped) == (2, 2)
+    
+    # re-running inserts nothing new
+    assert add_ddg_urls(results) == (0, 4)
+    
+    rows = get_connection().execute("SELECT id, file_path, download_status FROM urls ORDER BY id").fetchall()
+    assert [row[1] for row in rows] == [f"{org_id}_{row[0]}" for row in rows]
+    assert all(row[2] == "pending" for row in rows)
+
+    close_connection()
+
+def test_migrations(tmp_path, monkeypatch):
+    """Test that migrations bring a db to the latest version, add indexes and only run once."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    conn = get_connection()
+    
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+    assert run_migrations() == []  # nothing left to apply
+    
+    indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert "idx_urls_org_url" in indexes
+    assert "idx_urls_status_type" in indexes
+
+    # duplicate (organization_id, url) pairs are rejected at insert time
+    insert_organization("Test Org", "Test Org Search", "NGO")
+    conn.execute("INSERT INTO urls (organization_id, url) VALUES (1, 'https://example.com')")
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO urls (organization_id, url) VALUES (1, 'https://example.com')")
+
+    close_connection()
+
+def test_read_org_data(tmp_path, monkeypatch):
+    """Test that organizations are upserted in bulk and the search title -> ids map is returned."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    
+    df = pd.DataFrame({
+        "org_title": ["Org A", "Org B", "Org A"],   # duplicate official title, first row wins
+        "search_title": ["A", "B", "A again"],
+        "reg_category": ["NGO", "Companies & groups", "NGO"],
+    })
+    org_ids = read_org_data(df)
+    assert set(org_ids) == {"A", "B"}
+    assert org_ids["A"] == [get_organization_id("A")]
+
+    # re-running with a changed category updates the existing row
+    df.loc[1, "reg_category"] = "Think tanks and research institutions"
+    assert read_org_data(df) == org_ids
+    category = get_connection().execute("SELECT category FROM organizations WHERE search_title = 'B'").fetchone()[0]
+    assert category == "Think tanks and research institutions"
+
+    close_connection()
+
+def test_shared_search_title_urls(tmp_path, monkeypatch):
+    """Test that urls found for a search title are added to every organization searched under it."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+
+    df = pd.DataFrame({
+        "org_title": ["Eurofer Brussels", "Eurofer Germany", "Cefic"],  # two registrations, one search title
+        "search_title": ["Eurofer", "Eurofer", "Cefic"],
+        "reg_category": ["Trade and business associations"] * 3,
+    })
+    org_ids = read_org_data(df)
+    assert org_ids == {"Eurofer": [1, 2], "Cefic": [3]}
+
+    inserted, skipped = add_ddg_urls([{"org": "Eurofer", "url": "https://eurofer.eu/cbam"},
+                                      {"org": "Cefic", "url": "https://cefic.org/cbam"},
+                                      {"org": "Eurofer", "url": "https://eurofer.eu/cbam"}], org_ids)
+    assert (inserted, skipped) == (3, 2)  # the repeated url is a duplicate for both organizations
+    rows = get_connection().execute("SELECT organization_id, url FROM urls ORDER BY organization_id").fetchall()
+    assert rows == [(1, "https://eurofer.eu/cbam"), (2, "https://eurofer.eu/cbam"), (3, "https://cefic.org/cbam")]
+
+    close_connection()
+
+def test_work_queue_claims(tmp_path, monkeypatch):
+    """Test that workers claim disjoint rows and that expired or released leases are reclaimed."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    with transaction() as conn:
+        conn.executemany("INSERT INTO html_text (id, organization_id, html_file, extract_status) VALUES (?, 1, ?, 'pending')",
+                         [(i, f"1_{i}") for i in range(1, 6)])
+    
+    first = work_queue.claim("html", 3, worker="a")
+    second = work_queue.claim("html", 3, worker="b")
+    assert [row[0] for row in first] == [1, 2, 3]
+    assert [row[0] for row in second] == [4, 5]
+    assert work_queue.claim("html", 3, worker="c") == []  # everything is leased
+    
+    # worker a crashed: its lease expires and another worker picks the rows up
+    work_queue.release("html", [1], worker="a")
+    get_connection().execute("UPDATE html_text SET lease_expires = 0 WHERE claimed_by = 'a'")
+    assert [row[0] for row in work_queue.claim("html", 5, worker="c")] == [1, 2, 3]
+    
+    # only the lease holder can renew
+    assert work_queue.heartbeat("html", [4, 5], worker="a") == 0
+    assert work_queue.heartbeat("html", [4, 5], worker="b") == 2
+
+    close_connection()
+
+def test_run_ledger(tmp_path, monkeypatch, capsys):
+    """Test that stage metrics are recorded per run, including failed stages, and reported."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    
+    for items in (10, 20):
+        run_id = run_ledger.start_run()
+        with run_ledger.track_stage(run_id, "download") as stage:
+            stage.update(items=items, failures=1, pages=3)
+        run_ledger.finish_run(run_id)
+    
+    run_id = run_ledger.start_run()
+    with pytest.raises(ValueError):
+        with run_ledger.track_stage(run_id, "download"):
+            raise ValueError("boom")
+    run_ledger.finish_run(run_id, "failed")
+
+    rows = run_ledger.stage_history(last=3)
+    assert [row[7] for row in rows] == [0, 20, 10]  # items, newest run first
+    assert rows[1][11] == '{"pages": 3}'            # extra counts kept as details
+    error = get_connection().execute("SELECT error FROM stage_metrics WHERE run_id = ?", (run_id,)).fetchone()[0]
+    assert error == "ValueError: boom"
+
+    run_ledger.print_report(last=3)
+    assert "== download ==" in capsys.readouterr().out
+
+    close_connection()
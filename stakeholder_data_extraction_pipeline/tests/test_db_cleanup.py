@@ -2,6 +2,8 @@ import sqlite3
 from stakeholder_data_extraction_pipeline import config 
 from stakeholder_data_extraction_pipeline.database.database_clean import filter_unwanted_urls
 from stakeholder_data_extraction_pipeline.database.database_setup import setup_db
+from stakeholder_data_extraction_pipeline.database.database_update import insert_organization, add_ddg_urls
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, close_connection, transaction
 
 def test_filter_unwanted_urls():
     """Test that social media and Google search results are removed."""
@@ -45,3 +47,82 @@ def test_filter_unwanted_urls():
 
     
     conn.close()
+
+def test_blocked_urls_rejected_at_ingestion(tmp_path, monkeypatch):
+    """Test that blocklisted urls are never inserted and are counted per rule."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    insert_organization("Test Org", "Test Org Search", "NGO")
+
+    urls = ["https://uk.linkedin.com/company/test", "https://www.google.com/search?q=cbam",
+            "https://www.google.com/maps", "www.facebook.com/example", "https://eurofer.eu/publications"]
+    inserted, skipped = add_ddg_urls([{"org": "Test Org Search", "url": url} for url in urls])
+    assert (inserted, skipped) == (2, 3)
+
+    conn = get_connection()
+    rows = conn.execute("SELECT url, registered_domain, site FROM urls ORDER BY id").fetchall()
+    assert rows == [("https://www.google.com/maps", "google.com", "google"),
+                    ("https://eurofer.eu/publications", "eurofer.eu", "eurofer")]
+    
+    counters = dict(conn.execute("SELECT rule, dropped FROM url_blocklist WHERE dropped > 0").fetchall())
+    assert counters == {"linkedin": 1, "google_search": 1, "facebook": 1}
+
+    close_connection()
+
+def test_blocklist_matches_platform_sites(tmp_path, monkeypatch):
+    """Test that a platform rule covers every site starting with its name, on ingestion and cleanup."""
+    from stakeholder_data_extraction_pipeline.database.url_domains import (load_blocklist, match_blocklist, parse_url_domain,
+                                                                            remove_blocked_urls)
+
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    blocked = ["https://link.springer.com/article/1", "https://www.springeropen.com/cbam", "https://www.springernature.com/gp",
+               "https://fr.linkedin.com/in/test"]
+    allowed = ["https://example.com/springer-article", "https://eurofer.eu/linkedin", "https://www.google.com/maps"]
+    blocklist = load_blocklist()
+    assert [match_blocklist(url, parse_url_domain(url)[2], blocklist) for url in blocked] == ["springer"] * 3 + ["linkedin"]
+    assert [match_blocklist(url, parse_url_domain(url)[2], blocklist) for url in allowed] == [None] * 3
+
+    insert_organization("Test Org", "Test Org Search", "NGO")
+    with transaction() as conn:  # stored before the rules applied
+        conn.executemany("INSERT INTO urls (organization_id, url, site) VALUES (1, ?, ?)",
+                         [(url, parse_url_domain(url)[2]) for url in blocked + allowed])
+    assert +remove_blocked_urls() == {"springer": 3, "linkedin": 1}
+    assert [row[0] for row in get_connection().execute("SELECT url FROM urls ORDER BY id")] == allowed
+
+    close_connection()
+
+def test_relevance_pruning(tmp_path, monkeypatch):
+    """Test that search results are scored and only the top urls per organization stay pending for download."""
+    from stakeholder_data_extraction_pipeline.ddg_urls.relevance import score_result, prune_irrelevant_urls, prune_urls
+
+    assert score_result("https://cefic.org/cbam-position.pdf", "CEFIC position paper on the CBAM", "", "CEFIC") > \
+        score_result("https://www.cefic.org/jobs", "Careers", "join us", "CEFIC") > \
+        score_result("https://www.youtube.com/watch?v=1", "Careers", "join us", "CEFIC")
+    assert score_result("https://example.com/carbon-border-adjustment") == 3.0 * config.RELEVANCE_URL_WEIGHT
+
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "RELEVANCE_TOP_K", 2)
+    monkeypatch.setattr(config, "RELEVANCE_MIN_SCORE", 1.0)
+    setup_db()
+    insert_organization("European Chemical Industry Council", "CEFIC", "Trade association")
+    results = [
+        {"org": "CEFIC", "url": "https://cefic.org/cbam.pdf", "title": "CBAM position paper", "snippet": "carbon leakage"},
+        {"org": "CEFIC", "url": "https://ec.europa.eu/cbam-feedback", "title": "Feedback on CBAM", "snippet": ""},
+        {"org": "CEFIC", "url": "https://example.com/news", "title": "CBAM news", "snippet": ""},
+        {"org": "CEFIC", "url": "https://shop.example.com", "title": "Buy chemicals", "snippet": "free delivery"},
+        {"org": "CEFIC", "url": "https://example.com/old"},  # stored before titles were kept: ranked, no threshold
+    ]
+    add_ddg_urls(results)
+
+    assert prune_irrelevant_urls() == 3
+    rows = dict(get_connection().execute("SELECT url, download_status FROM urls").fetchall())
+    assert [url for url, status in rows.items() if status == "pending"] == \
+        ["https://cefic.org/cbam.pdf", "https://ec.europa.eu/cbam-feedback"]
+    assert get_connection().execute("SELECT title FROM urls WHERE url = 'https://cefic.org/cbam.pdf'").fetchone() == \
+        ("CBAM position paper",)
+
+    assert prune_urls(top_k=3) == (0, 1)  # a wider cutoff restores the next best url
+    assert prune_urls(top_k=10, min_score=-100) == (0, 2)
+
+    close_connection()
@@ -1,4 +1,11 @@
+import os
+import asyncio
+import sqlite3
+from stakeholder_data_extraction_pipeline import config
 from stakeholder_data_extraction_pipeline.ddg_urls import ddg_search
+from stakeholder_data_extraction_pipeline.ddg_urls.status_writer import run_status_writer, status_record
+from stakeholder_data_extraction_pipeline.database.database_setup import setup_db
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, close_connection, transaction
 from unittest.mock import patch, MagicMock
 
 def test_ddg_search():
@@ -21,4 +28,683 @@ def test_ddg_search():
         assert isinstance(results, list)
         assert len(results) > 0
         assert "org" in results[0]
-        assert "url" in results[0]
\ No newline at end of file
+        assert "url" in results[0]
+
+def test_status_writer(tmp_path, monkeypatch):
+    """Test that queued download statuses are written in batches and flushed on shutdown."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    setup_db()
+    with transaction() as conn:
+        conn.executemany("INSERT INTO urls (url, download_status, claimed_by) VALUES (?, 'pending', 'me:1')",
+                         [(f"https://example.com/{i}",) for i in range(25)])
+
+    async def run():
+        queue = asyncio.Queue()
+        writer = asyncio.create_task(run_status_writer(queue, batch_size=10, flush_ms=50, worker="me:1"))
+        for url_id in range(1, 26):
+            await queue.put(status_record(url_id, "success", None, "html", None))
+        await queue.put(None)
+        return await writer
+
+    assert asyncio.run(run()) == {"success": 25}
+    
+    statuses = get_connection().execute("SELECT DISTINCT download_status, file_type, paywall_status FROM urls").fetchall()
+    assert statuses == [("success", "html", "unknown")]
+    assert get_connection().execute("SELECT COUNT(*) FROM urls WHERE claimed_by IS NOT NULL").fetchone()[0] == 0
+
+    # our lease on two rows expired and another downloader reclaimed them: our late statuses must not overwrite theirs
+    with transaction() as conn:
+        conn.execute("UPDATE urls SET download_status = 'pending', claimed_by = 'me:1'")
+        conn.execute("UPDATE urls SET claimed_by = 'other:2', lease_expires = 1e12 WHERE id IN (3, 4)")
+    assert asyncio.run(run()) == {"success": 23, "lease_lost": 2}
+    reclaimed = get_connection().execute("SELECT download_status, claimed_by, lease_expires FROM urls WHERE id IN (3, 4)").fetchall()
+    assert reclaimed == [("pending", "other:2", 1e12)] * 2
+    with transaction() as conn:
+        conn.execute("UPDATE urls SET claimed_by = 'me:1'")
+
+    # a batch that cannot be committed is reported, not counted as written
+    with patch("stakeholder_data_extraction_pipeline.ddg_urls.status_writer.transaction",
+               side_effect=sqlite3.OperationalError("database is locked")):
+        assert asyncio.run(run()) == {"write_failed": 25}
+
+    close_connection()
+
+def test_download_dedup_blobs(tmp_path, monkeypatch):
+    """Test that identical bodies are stored once by content hash and oversized responses are never stored."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "URL_DOWNLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "BLOB_DIR", str(tmp_path / "blobs"))
+    monkeypatch.setattr(config, "DOWNLOAD_HOST_DELAY_SECONDS", 0)  # no politeness delay in tests
+    monkeypatch.setattr(config, "DOWNLOAD_HOST_JITTER_SECONDS", 0)
+    monkeypatch.setattr(config, "DOWNLOAD_RETRY_BASE_SECONDS", 0.01)
+    setup_db()
+
+    monkeypatch.setattr(config, "DOWNLOAD_MAX_BYTES", 1000)
+    monkeypatch.setattr(config, "DOWNLOAD_CHUNK_SIZE", 100)
+
+    busy = []
+
+    async def handler(request):
+        name = request.match_info["name"]
+        if name == "busy" and not busy:
+            busy.append(1)
+            return web.Response(status=429, headers={"Retry-After": "0"})  # retried in the run
+        if name == "large":
+            return web.Response(body=b"x" * 2000)  # rejected on its content-length
+        if name == "stream":
+            response = web.StreamResponse()  # chunked, no content-length
+            await response.prepare(request)
+            for _ in range(20):
+                await response.write(b"y" * 100)
+            await response.write_eof()
+            return response
+        return web.Response(body=b"<html>other</html>" if name == "other" else b"%PDF-1.4 same report")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.executemany("INSERT INTO urls (url, file_path, download_status) VALUES (?, ?, 'pending')",
+                                 [(str(server.make_url(f"/{name}")), f"0_{i}") for i, name in enumerate(["a", "b", "other", "large", "stream", "busy"])])
+            return await ddg_download.download_all_files()
+
+    summary = asyncio.run(run())
+    assert summary["items"] == 7 and summary["duplicates"] == 2 and summary["too_large"] == 2 and summary["retries"] == 1
+
+    rows = get_connection().execute("SELECT file_path, content_hash, file_type FROM urls ORDER BY id").fetchall()
+    assert rows[0] == rows[1] and rows[0][2] == "pdf" and rows[0][0].endswith(".pdf")
+    assert rows[2][1] != rows[0][1] and rows[2][2] == "html"
+    assert get_connection().execute("SELECT download_status, file_path FROM urls WHERE id > 3").fetchall() == [
+        ("too_large", "0_3"), ("too_large", "0_4"), ("success", rows[0][0])]  # busy served on the retry
+    blobs = [path for path in (tmp_path / "blobs").rglob("*") if path.is_file()]
+    assert len(blobs) == 2  # temp files are gone, one blob per unique body
+
+    close_connection()
+
+def test_download_content_routing(tmp_path, monkeypatch):
+    """Test that downloads are typed from headers and first bytes as they stream and unsupported types are skipped."""
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+    from stakeholder_data_extraction_pipeline.ddg_urls.ddg_file_detection import route_headers, sniff_file_type
+
+    assert route_headers("application/pdf; charset=binary") == "pdf"
+    assert route_headers("application/octet-stream", "CBAM report.PDF") == "pdf"
+    assert route_headers("video/mp4") == route_headers(None, None, "https://x.org/clip.mp4?s=1") == "skip"
+    assert route_headers("text/html", None, "https://x.org/photo.jpg") == "html"  # the header beats the url
+    assert route_headers("text/plain", None, "https://x.org/notes") is None
+    assert sniff_file_type(b"\n\n<!DOCTYPE HTML><html>") == "html" and sniff_file_type(b"PK\x03\x04zip") == "skip"
+    office = b"PK\x03\x04" + b"\x00" * 26 + b"[Content_Types].xml" + b"\x00" * 100  # document part beyond the prefix
+    assert ddg_download.body_file_type(office, None) == "office"
+    assert ddg_download.body_file_type(office, "xlsx") == "xlsx"  # the specific type of the headers is kept
+    assert ddg_download.body_file_type(office, "pdf") == "office"  # the bytes still beat a wrong header
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "URL_DOWNLOADS_DIR": str(tmp_path),
+                        "BLOB_DIR": str(tmp_path / "blobs"), "DOWNLOAD_HOST_DELAY_SECONDS": 0,
+                        "DOWNLOAD_HOST_JITTER_SECONDS": 0}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+
+    routes = {
+        "report": web.Response(body=b"%PDF-1.7 cbam", content_type="application/octet-stream"),
+        "page": web.Response(body=b"<!doctype html><html>cbam</html>", content_type="text/html"),
+        "clip": web.Response(body=b"\x00" * 5000, content_type="video/mp4"),
+        "export": web.Response(body=b"data", headers={"Content-Disposition": 'attachment; filename="data.zip"'}),
+        "archive": web.Response(body=b"PK\x03\x04" + b"\x00" * 100, content_type="text/plain"),
+        "notes": web.Response(body=b"plain cbam notes", content_type="text/plain"),
+        "sheet": web.Response(body=office, content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    }
+
+    async def handler(request):
+        return routes[request.match_info["name"]]
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.executemany("INSERT INTO urls (url, download_status) VALUES (?, 'pending')",
+                                 [(str(server.make_url(f"/{name}")),) for name in routes])
+            return await ddg_download.download_all_files()
+
+    summary = asyncio.run(run())
+    assert summary["skipped_type"] == 3
+
+    rows = get_connection().execute("SELECT download_status, file_type, file_path FROM urls ORDER BY id").fetchall()
+    assert [row[:2] for row in rows] == [("success", "pdf"), ("success", "html"), ("skipped_type", "unknown"),
+                                         ("skipped_type", "unknown"), ("skipped_type", "unknown"), ("success", "unknown"),
+                                         ("success", "xlsx")]
+    assert rows[0][2].endswith(".pdf") and rows[1][2].endswith(".html") and "." not in os.path.basename(rows[5][2])
+    assert rows[6][2].endswith(".xlsx")
+    blobs = [path for path in (tmp_path / "blobs").rglob("*") if path.is_file()]
+    assert len(blobs) == 4  # skipped bodies leave nothing behind
+
+    close_connection()
+
+def test_file_classifier(tmp_path, monkeypatch):
+    """Test that files are typed by magic numbers and html is scanned once for paywall phrases within the prefix."""
+    from stakeholder_data_extraction_pipeline.ddg_urls.ddg_file_detection import classify_file, detect_paywall
+
+    monkeypatch.setattr(config, "CLASSIFY_SCAN_BYTES", 4096)
+    filler = b"<p>" + b"cbam reporting " * 40 + b"</p>"
+    files = {
+        "paywall": b"<!DOCTYPE html><html>" + filler + b"<div>Paywall: LOG IN TO READ the paywall article</div></html>",
+        "open": b"\xef\xbb\xbf\n<html>" + filler + b"</html>",
+        "late": b"<html>" + filler * 20 + b"membership required</html>",  # phrase beyond the scanned prefix
+        "stub": b"<html>log in</html>",
+        "docx": b"PK\x03\x04" + b"\x00" * 26 + b"[Content_Types].xml" + b"\x00" * 200 + b"word/document.xml",
+        "xlsx": b"PK\x03\x04" + b"\x00" * 26 + b"xl/workbook.xml",
+        "zip": b"PK\x03\x04" + b"\x00" * 26 + b"data.csv",
+        "png": b"\x89PNG\r\n\x1a\n" + b"\x00" * 20,
+        "json": b'  {"cbam": true}',
+        "xml": b"<?xml version='1.0'?><rss></rss>",
+        "pdf": b"%PDF-1.7 report",
+        "text": b"plain cbam notes",
+    }
+    for name, body in files.items():
+        (tmp_path / name).write_bytes(body)
+    results = {name: classify_file(str(tmp_path / name)) for name in files}
+
+    assert {name: result.file_type for name, result in results.items()} == {
+        "paywall": "html", "open": "html", "late": "html", "stub": "html", "docx": "docx", "xlsx": "xlsx", "zip": "zip",
+        "png": "png", "json": "json", "xml": "xml", "pdf": "pdf", "text": "unknown"}
+    assert results["paywall"].paywall_status == "paywall detected"
+    assert results["paywall"].matches == ("log in to read", "paywall")
+    assert results["open"].paywall_status is None and results["late"].paywall_status is None
+    assert results["stub"].paywall_status == "possible paywall" and results["pdf"].paywall_status is None
+    assert results["pdf"].mime == "application/pdf" and results["docx"].mime.endswith("wordprocessingml.document")
+    assert results["late"].size == len(files["late"])
+    assert detect_paywall(str(tmp_path / "paywall")) == "paywall detected"
+    assert classify_file(str(tmp_path / "missing")).file_type == "unreadable"
+
+def test_search_scheduler_rate_limiter(tmp_path, monkeypatch):
+    """Test that the limiter backs off on rate limits, recovers on success and keeps its state between runs."""
+    from contextlib import nullcontext
+    from stakeholder_data_extraction_pipeline.ddg_urls import search_scheduler
+
+    monkeypatch.setattr(config, "SEARCH_MAX_RATE_PER_MIN", 6000)
+    monkeypatch.setattr(config, "SEARCH_BACKOFF_SECONDS", 0.05)
+    state_path = str(tmp_path / "limiter.json")
+    limiter = search_scheduler.AdaptiveRateLimiter(state_path, rate=4000)
+
+    def search_one(client, name):
+        if name == "limited" and not client.setdefault(name, False):
+            client[name] = True  # rate limited once per worker
+            return [], search_scheduler.RATE_LIMITED
+        return [{"org": name, "url": f"https://{name}.example"}], search_scheduler.OK
+
+    seen = []
+    names = [f"org{i}" for i in range(20)] + ["limited"]
+    results = search_scheduler.run_searches(names, lambda: nullcontext({}), search_one,
+                                            on_result=lambda *args: seen.append(args[0]), workers=3, limiter=limiter)
+    assert sorted(seen) == sorted(names) and len(results) == 20
+
+    saved = search_scheduler.AdaptiveRateLimiter(state_path)  # next run starts from the saved rate and pause
+    assert (saved.rate, saved.backoff, saved.paused_until) == (limiter.rate, limiter.backoff, limiter.paused_until)
+    limiter.record(search_scheduler.OK)
+    assert limiter.rate == saved.rate + 1 and limiter.backoff == 0  # additive increase, backoff reset
+    limiter.record(search_scheduler.RATE_LIMITED)
+    assert limiter.rate == (saved.rate + 1) / 2 and limiter.backoff == 0.05  # multiplicative decrease
+    limiter.record(search_scheduler.RATE_LIMITED)
+    assert limiter.backoff == 0.1  # exponential backoff while rate limits continue
+
+def test_search_journal(tmp_path, monkeypatch):
+    """Test that the search journal appends per attempt, replays its retry state and compacts to one line per org."""
+    from stakeholder_data_extraction_pipeline.ddg_urls.search_journal import SearchJournal
+
+    monkeypatch.setattr(config, "SEARCH_MAX_ATTEMPTS", 3)
+    (tmp_path / "ddg_search_results.csv").write_text("organisation,url\nCEFIC,https://cefic.org\nEurofer,error\n")
+    journal = SearchJournal(str(tmp_path / "journal.jsonl"))  # older csv results are imported once
+    assert journal.status("CEFIC") == "ok" and journal.status("Eurofer") == "error"
+    assert journal.next_eligible("Eurofer") == 0 and journal.next_eligible("Aurubis") == 0  # retry now, never searched
+
+    entry = journal.record("Eurofer", ["https://eurofer.eu/a"], "partial", snippets={"https://eurofer.eu/a": ["CBAM", "steel"]})
+    assert entry["next_eligible"] > 0 and entry["failures"] == 2  # backoff grows with failures in a row
+    journal.record("Eurofer", [], "rate_limited")
+    assert journal.status("Eurofer") == "rate_limited" and journal.next_eligible("Eurofer") is None  # given up
+    journal.record("Aurubis", [], "timed_out")
+    journal.record("Aurubis", ["no_results"])
+    assert len((tmp_path / "journal.jsonl").read_text().splitlines()) == 6  # appended, never rewritten
+
+    replayed = SearchJournal(str(tmp_path / "journal.jsonl"))
+    assert replayed.orgs == journal.orgs
+    assert replayed.done_orgs() == {"CEFIC", "Aurubis"} and replayed.given_up_orgs() == {"Eurofer"}
+    assert not replayed.retry_orgs()
+    assert replayed.orgs["Eurofer"]["attempts"] == 3
+
+    assert replayed.compact() == 3
+    assert len((tmp_path / "journal.jsonl").read_text().splitlines()) == 3
+    assert (tmp_path / "ddg_search_results.csv").read_text().splitlines() == [
+        "organisation,url,title,snippet", "CEFIC,https://cefic.org,,", "Eurofer,https://eurofer.eu/a,CBAM,steel",
+        "Aurubis,no_results,,"]  # partial kept, with its title and snippet
+
+def test_search_scheduler_retries_in_one_pass(tmp_path, monkeypatch):
+    """Test that failed names are searched again once due, without polling, and the pass ends when nothing is left."""
+    import time
+    from contextlib import nullcontext
+    from stakeholder_data_extraction_pipeline.ddg_urls import search_scheduler
+
+    monkeypatch.setattr(config, "SEARCH_MAX_RATE_PER_MIN", 6000)
+    limiter = search_scheduler.AdaptiveRateLimiter(str(tmp_path / "limiter.json"), rate=6000)
+    attempts = {}
+
+    def search_one(client, name):
+        attempts[name] = attempts.get(name, 0) + 1
+        if name == "flaky" and attempts[name] < 3:
+            return [], search_scheduler.ERROR
+        return [name], search_scheduler.OK
+
+    def on_result(name, results, outcome):
+        return time.time() + 0.05 if outcome != search_scheduler.OK else None
+
+    start = time.time()
+    results = search_scheduler.run_searches(["a", "flaky", "b"], lambda: nullcontext(), search_one, on_result,
+                                            workers=2, limiter=limiter, not_before={"b": start + 0.1})
+    assert sorted(results) == ["a", "b", "flaky"] and attempts == {"a": 1, "flaky": 3, "b": 1}
+    assert time.time() - start >= 0.1  # b waited until it was due
+
+def test_search_scheduler_survives_errors(tmp_path, monkeypatch):
+    """Test that a failing cache lookup is reported as an error and a failing on_result ends the pass instead of hanging."""
+    import pytest
+    from contextlib import nullcontext
+    from stakeholder_data_extraction_pipeline.ddg_urls import search_scheduler
+
+    monkeypatch.setattr(config, "SEARCH_MAX_RATE_PER_MIN", 6000)
+    limiter = search_scheduler.AdaptiveRateLimiter(str(tmp_path / "limiter.json"), rate=6000)
+
+    def cached(name):
+        if name == "broken":
+            raise ValueError("corrupt cache entry")
+        return None
+
+    outcomes = {}
+    results = search_scheduler.run_searches(["a", "broken", "b"], lambda: nullcontext(), lambda client, name: ([name], "ok"),
+                                            lambda name, results, outcome: outcomes.update({name: outcome}),
+                                            workers=2, limiter=limiter, cached=cached)
+    assert sorted(results) == ["a", "b"] and outcomes == {"a": "ok", "broken": "error", "b": "ok"}
+
+    def on_result(name, results, outcome):
+        raise OSError("disk full")
+
+    names = [f"org{i}" for i in range(10)]
+    searched = []
+    with pytest.raises(OSError):
+        search_scheduler.run_searches(names, lambda: nullcontext(), lambda client, name: searched.append(name) or ([], "ok"),
+                                      on_result, workers=3, limiter=limiter)
+    assert len(searched) < len(names)  # workers stopped taking names
+
+def test_search_cache_replay(tmp_path, monkeypatch):
+    """Test that cached searches are served without ddg, expire after the ttl and replay mode never searches."""
+    from stakeholder_data_extraction_pipeline.ddg_urls import search_cache
+
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "LOGS_DIR", str(tmp_path))
+    setup_db()
+    search_cache.store(ddg_search.search_query_for("CEFIC"), [{"href": "https://cefic.org/cbam", "title": "CBAM"}])
+    assert search_cache.lookup('  "cefic"   ' + config.SEARCH_QUERY.upper()) is not None  # normalized key
+    assert search_cache.lookup(ddg_search.search_query_for("CEFIC"), max_results=5) is None  # other max_results
+
+    with transaction() as conn:
+        conn.execute("UPDATE search_cache SET fetched_at = fetched_at - 40 * 86400")
+    assert search_cache.lookup(ddg_search.search_query_for("CEFIC"), ttl_days=30) is None  # expired
+
+    monkeypatch.setattr(config, "SEARCH_REPLAY", True)
+    with patch('stakeholder_data_extraction_pipeline.ddg_urls.ddg_search.DDGS', side_effect=AssertionError("no network")):
+        results = ddg_search.perform_search(["CEFIC", "Eurofer"])
+
+    assert results == [{"org": "CEFIC", "url": "https://cefic.org/cbam", "title": "CBAM", "snippet": ""}]  # expired entries are still replayed
+    journal = ddg_search.get_journal()
+    assert journal.status("CEFIC") == "ok" and journal.status("Eurofer") == "pending"  # misses are not recorded
+
+    close_connection()
+
+def test_stakeholder_title_groups(tmp_path, monkeypatch):
+    """Test that equivalent titles are searched once and the urls are saved for every member organization."""
+    from stakeholder_data_extraction_pipeline.ddg_urls import stakeholder_titles
+    import pandas as pd
+
+    assert stakeholder_titles.canonical_title("Société Générale S.A.") == stakeholder_titles.canonical_title("societe generale")
+    assert stakeholder_titles.canonical_title("Foo GmbH & Co. KG") == "foo gmbh and"  # only trailing legal suffixes
+    titles = ["European Steel Association (EUROFER)", "CEFIC", "EUROFER", "Eurofer", "BASF SE", "basf", "thyssenkrupp"]
+    assert stakeholder_titles.group_titles(titles) == [
+        ["European Steel Association (EUROFER)"], ["CEFIC"], ["Eurofer", "EUROFER"], ["BASF SE", "basf"], ["thyssenkrupp"]]
+    assert stakeholder_titles.group_titles(["BDI", "Bundesverband der Deutschen Industrie e.V."]) == [
+        ["Bundesverband der Deutschen Industrie e.V.", "BDI"]]  # acronym joins the full name it abbreviates
+
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "LOGS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "SEARCH_LIMITER_STATE", str(tmp_path / "limiter.json"))
+    monkeypatch.setattr(config, "SEARCH_RATE_PER_MIN", 6000)
+    monkeypatch.setattr(config, "SEARCH_MAX_RATE_PER_MIN", 6000)
+    setup_db()
+    stake_df = pd.DataFrame({"search_title": ["BASF SE", "basf", "CEFIC"]})
+    with patch.object(ddg_search, "load_stakeholders", return_value=(stake_df["search_title"].tolist(), stake_df)), \
+         patch('stakeholder_data_extraction_pipeline.ddg_urls.ddg_search.DDGS') as MockDDGS:
+        ddgs = MockDDGS.return_value.__enter__.return_value
+        ddgs.text.side_effect = lambda query, **kwargs: [{"href": f"https://example.com/{query.split()[0]}"}]
+        results, _ = ddg_search.run_search_pipeline()
+
+    assert ddgs.text.call_count == 2  # one search for BASF SE and basf
+    journal = ddg_search.get_journal()
+    assert journal.status("basf") == "ok"
+    assert journal.orgs["basf"]["urls"] == journal.orgs["BASF SE"]["urls"] == ['https://example.com/"BASF']
+    assert {res["org"] for res in results} == {"BASF SE", "basf", "CEFIC"}
+
+    close_connection()
+
+def test_local_fixture_provider(tmp_path, monkeypatch):
+    """Test that the local provider injects failures deterministically and the search pass recovers from them."""
+    from stakeholder_data_extraction_pipeline.ddg_urls.search_providers import LocalFixtureProvider
+
+    def outcomes(provider):
+        for _ in range(20):
+            try:
+                provider.text("CEFIC")
+            except Exception:
+                pass
+        return [outcome for _, _, outcome in provider.calls]
+
+    assert outcomes(LocalFixtureProvider(rate_limit_rate=0.3, partial_rate=0.2, seed=1)) == \
+        outcomes(LocalFixtureProvider(rate_limit_rate=0.3, partial_rate=0.2, seed=1))
+    corpus = {'"cefic" +cbam future': [{"href": "https://cefic.org/cbam"}]}
+    assert LocalFixtureProvider(corpus).text(ddg_search.search_query_for("CEFIC")) == [{"href": "https://cefic.org/cbam"}]
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "LOGS_DIR": str(tmp_path), "SEARCH_PROVIDER": "local",
+                        "SEARCH_LIMITER_STATE": str(tmp_path / "limiter.json"), "SEARCH_RATE_PER_MIN": 6000,
+                        "SEARCH_MIN_RATE_PER_MIN": 6000, "SEARCH_MAX_RATE_PER_MIN": 6000, "SEARCH_BACKOFF_SECONDS": 0.01,
+                        "SEARCH_RETRY_BASE_SECONDS": 0.01, "SEARCH_MAX_ATTEMPTS": 20}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+    provider = LocalFixtureProvider(rate_limit_rate=0.2, timeout_rate=0.1, partial_rate=0.1, seed=3)
+    orgs = [f"Org {i}" for i in range(15)]
+    ddg_search.perform_search(orgs, provider=provider)
+
+    journal = ddg_search.get_journal()
+    assert journal.done_orgs() == set(orgs)  # every injected failure was retried within the pass
+    assert {"rate_limited", "timed_out", "partial"} <= {outcome for _, _, outcome in provider.calls}
+    backends = get_connection().execute("SELECT DISTINCT backend FROM search_cache").fetchall()
+    assert backends == [("local:auto",)]  # fixture results never mix with real cached ones
+
+    close_connection()
+
+def test_host_scheduler():
+    """Test that requests to one host are spaced and limited while other hosts are not held up."""
+    import time
+    from stakeholder_data_extraction_pipeline.ddg_urls.host_scheduler import HostScheduler
+
+    async def run():
+        scheduler = HostScheduler(max_connections=10, per_host=2, delay=0.1, jitter=0)
+        starts = []
+
+        async def request(host):
+            async with scheduler.slot(host):
+                starts.append((host, time.monotonic()))
+                await asyncio.sleep(0.02)
+
+        begin = time.monotonic()
+        await asyncio.gather(*(request("a.example") for _ in range(3)), request("b.example"), request("c.example"))
+        return [(host, start - begin) for host, start in starts]
+
+    starts = asyncio.run(run())
+    a_starts = [start for host, start in starts if host == "a.example"]
+    assert all(later - earlier >= 0.09 for earlier, later in zip(a_starts, a_starts[1:]))  # polite to one host
+    assert all(start < 0.05 for host, start in starts if host != "a.example")  # other hosts start straight away
+
+def test_host_queue_mixed_hosts():
+    """Test that urls clustered on one busy host do not hold the download tasks while other hosts wait."""
+    import time
+    from stakeholder_data_extraction_pipeline.ddg_urls.host_scheduler import HostScheduler, HostQueue
+
+    async def run():
+        scheduler = HostScheduler(max_connections=10, per_host=1, delay=0.1, jitter=0)
+        queue = HostQueue(scheduler, lambda url: url.split("/")[2], maxsize=20)
+        starts = []
+
+        async def download_task():
+            while True:
+                url = await queue.get()
+                try:
+                    async with scheduler.slot(url.split("/")[2]):
+                        starts.append((url, time.monotonic()))
+                        await asyncio.sleep(0.01)
+                finally:
+                    await queue.task_done(url)
+
+        # a claim page in id order: five pages of one site first, then one page each of four others
+        urls = [f"https://a.example/{i}" for i in range(5)] + [f"https://{host}.example/" for host in "bcde"]
+        begin = time.monotonic()
+        tasks = [asyncio.create_task(download_task()) for _ in range(2)]
+        for url in urls:
+            await queue.put(url)
+        await queue.join()
+        for task in tasks:
+            task.cancel()
+        return [(url, start - begin) for url, start in starts]
+
+    starts = asyncio.run(run())
+    a_starts = [start for url, start in starts if "a.example" in url]
+    assert len(starts) == 9 and len(a_starts) == 5
+    assert all(later - earlier >= 0.09 for earlier, later in zip(a_starts, a_starts[1:]))  # still polite to a
+    assert all(start < 0.08 for url, start in starts if "a.example" not in url)  # not stuck behind a's delay
+
+def test_download_retries(tmp_path, monkeypatch):
+    """Test that transient failures are retried in the run with a persisted attempt count and permanent ones are not."""
+    import aiohttp
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+
+    assert ddg_download.classify_error(asyncio.TimeoutError()) == ("failure", True)
+    assert ddg_download.classify_error(aiohttp.InvalidURL("x")) == ("failure", False)
+    assert ddg_download.classify_error(ValueError("bad pdf")) == ("failure", False)
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "URL_DOWNLOADS_DIR": str(tmp_path),
+                        "BLOB_DIR": str(tmp_path / "blobs"), "DOWNLOAD_HOST_DELAY_SECONDS": 0,
+                        "DOWNLOAD_HOST_JITTER_SECONDS": 0, "DOWNLOAD_RETRY_BASE_SECONDS": 0.01,
+                        "DOWNLOAD_MAX_ATTEMPTS": 3}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+    hits = {}
+
+    async def handler(request):
+        name = request.match_info["name"]
+        hits[name] = hits.get(name, 0) + 1
+        if name == "down" or (name == "flaky" and hits[name] < 3):
+            return web.Response(status=503 if name == "flaky" else 500, headers={"Retry-After": "0"})
+        if name == "missing":
+            return web.Response(status=404)
+        return web.Response(body=b"<html>ok</html>")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.executemany("INSERT INTO urls (url, file_path, download_status) VALUES (?, ?, 'pending')",
+                                 [(str(server.make_url(f"/{name}")), f"0_{i}") for i, name in enumerate(["flaky", "down", "missing"])])
+            return await ddg_download.download_all_files()
+
+    summary = asyncio.run(run())
+    assert hits == {"flaky": 3, "down": 3, "missing": 1}
+    assert (summary["retries"], summary["permanent_failures"], summary["transient_failures"]) == (4, 1, 1)
+
+    rows = get_connection().execute("SELECT download_status, attempts, next_retry_at, last_error FROM urls ORDER BY id").fetchall()
+    assert rows[0][:3] == ("success", 3, None) and rows[0][3] is None
+    assert rows[1][:3] == ("failure_500", 3, None) and rows[1][3].startswith("transient")
+    assert rows[2][:3] == ("failure_404", 1, None) and rows[2][3].startswith("permanent")
+
+    close_connection()
+
+def test_download_worker_pool_and_sigint(tmp_path, monkeypatch):
+    """Test that a fixed pool of download tasks drains the queue and a SIGINT hands back unstarted urls."""
+    import signal
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "URL_DOWNLOADS_DIR": str(tmp_path),
+                        "BLOB_DIR": str(tmp_path / "blobs"), "DOWNLOAD_HOST_DELAY_SECONDS": 0,
+                        "DOWNLOAD_HOST_JITTER_SECONDS": 0, "DOWNLOAD_PER_HOST_CONNECTIONS": 10,
+                        "DOWNLOAD_WORKERS": 4, "DOWNLOAD_QUEUE_SIZE": 3, "CLAIM_BATCH_SIZE": 5}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+    state = {"running": 0, "peak": 0, "hits": 0, "interrupt_at": None}
+
+    async def handler(request):
+        state["hits"] += 1
+        if state["hits"] == state["interrupt_at"]:
+            os.kill(os.getpid(), signal.SIGINT)  # as if Ctrl-C was pressed during this download
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.01)
+        state["running"] -= 1
+        return web.Response(body=f"%PDF-1.4 {request.match_info['name']}".encode())
+
+    async def run(count):
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.execute("DELETE FROM urls")
+                conn.executemany("INSERT INTO urls (url, download_status) VALUES (?, 'pending')",
+                                 [(str(server.make_url(f"/doc{i}")),) for i in range(count)])
+            return await ddg_download.download_all_files()
+
+    summary = asyncio.run(run(40))
+    assert summary["items"] == 40 and not summary["interrupted"]
+    assert state["peak"] <= 4  # never more downloads than tasks in the pool
+
+    state.update(hits=0, interrupt_at=6)
+    summary = asyncio.run(run(40))
+    assert summary["interrupted"]
+    statuses = dict(get_connection().execute("SELECT download_status, COUNT(*) FROM urls GROUP BY download_status").fetchall())
+    assert statuses == {"success": state["hits"], "pending": 40 - state["hits"]}  # started downloads finished, nothing lost
+    assert get_connection().execute("SELECT COUNT(*) FROM urls WHERE claimed_by IS NOT NULL").fetchone()[0] == 0
+
+    close_connection()
+
+def test_download_classification_off_loop(tmp_path, monkeypatch):
+    """Test that stored html is scanned for paywalls in the classification threads while downloads continue."""
+    import threading
+    import time
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "URL_DOWNLOADS_DIR": str(tmp_path),
+                        "BLOB_DIR": str(tmp_path / "blobs"), "DOWNLOAD_HOST_DELAY_SECONDS": 0,
+                        "DOWNLOAD_HOST_JITTER_SECONDS": 0, "DOWNLOAD_PER_HOST_CONNECTIONS": 10,
+                        "CLASSIFY_WORKERS": 2, "CLASSIFY_QUEUE_SIZE": 1}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+    scans = []
+
+    def slow_scan(path):
+        scans.append(threading.current_thread().name)
+        time.sleep(0.05)  # a large page, blocking
+        return "paywall detected" if "members" in open(path).read() else None
+
+    monkeypatch.setattr(ddg_download, "detect_paywall", slow_scan)
+
+    async def handler(request):
+        name = request.match_info["name"]
+        if name.startswith("report"):
+            return web.Response(body=f"%PDF-1.4 {name}".encode())
+        return web.Response(body=f"<html>{name}</html>".encode())
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.executemany("INSERT INTO urls (url, download_status) VALUES (?, 'pending')",
+                                 [(str(server.make_url(f"/{name}")),) for name in
+                                  ["page1", "members", "report1", "page2", "report2", "page3"]])
+            return await ddg_download.download_all_files()
+
+    summary = asyncio.run(run())
+    assert summary["items"] == 6
+    assert len(scans) == 4 and all(name.startswith("classify") for name in scans)  # html only, never on the loop thread
+    rows = get_connection().execute("SELECT file_type, paywall_status, claimed_by FROM urls ORDER BY id").fetchall()
+    assert [row[:2] for row in rows] == [("html", "unknown"), ("html", "paywall detected"), ("pdf", "unknown"),
+                                         ("html", "unknown"), ("pdf", "unknown"), ("html", "unknown")]
+    assert all(row[2] is None for row in rows)  # leases dropped once classified
+
+    close_connection()
+
+def test_download_refresh(tmp_path, monkeypatch):
+    """Test that a refresh sends the stored validators and only re-extracts documents whose content changed."""
+    import hashlib
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from stakeholder_data_extraction_pipeline.ddg_urls import ddg_download
+    from stakeholder_data_extraction_pipeline.text_extraction.html_text_extraction import add_html_url_data
+
+    for name, value in {"DB_PATH": str(tmp_path / "temp.db"), "URL_DOWNLOADS_DIR": str(tmp_path),
+                        "BLOB_DIR": str(tmp_path / "blobs"), "DOWNLOAD_HOST_DELAY_SECONDS": 0,
+                        "DOWNLOAD_HOST_JITTER_SECONDS": 0}.items():
+        monkeypatch.setattr(config, name, value)
+    setup_db()
+    version = {"changing": 1}
+    conditional = []
+    text = "<p>" + "cbam reporting obligations " * 10 + "</p>"  # long enough not to look like a paywall
+    legacy_body = f"<html>downloaded before hashing {text}</html>".encode()
+    (tmp_path / "0_9").write_bytes(legacy_body)  # "orgid_urlid" file of an old download, no content_hash
+
+    async def handler(request):
+        name = request.match_info["name"]
+        if name == "etag":
+            conditional.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"v1"':
+                return web.Response(status=304)
+            return web.Response(body=f"<html>etag {text}</html>".encode(), headers={"ETag": '"v1"'})
+        if name == "changing":
+            return web.Response(body=f"<html>version {version['changing']} {text}</html>".encode())
+        if name == "legacy":
+            return web.Response(body=legacy_body)
+        return web.Response(body=f"<html>same bytes, no validators {text}</html>".encode())
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{name}", handler)
+        async with TestServer(app) as server:
+            with transaction() as conn:
+                conn.executemany("INSERT INTO urls (url, file_path, download_status) VALUES (?, ?, 'pending')",
+                                 [(str(server.make_url(f"/{name}")), f"0_{i}")
+                                  for i, name in enumerate(["etag", "changing", "static"])])
+            await ddg_download.download_all_files()
+
+            # extract the first downloads, then refresh after one document changed
+            add_html_url_data()
+            with transaction() as conn:
+                conn.execute("UPDATE html_text SET extract_status = 'success', extracted_text_path = 'done.json'")
+            with transaction() as conn:
+                conn.execute("INSERT INTO urls (url, file_path, download_status, file_type, paywall_status) "
+                             "VALUES (?, '0_9', 'success', 'html', 'unknown')", (str(server.make_url("/legacy")),))
+            first = get_connection().execute("SELECT file_path FROM urls ORDER BY id").fetchall()
+            version["changing"] = 2
+            return first, await ddg_download.download_all_files(refresh=True)
+
+    first, summary = asyncio.run(run())
+    assert conditional == [None, '"v1"']
+    assert (summary["not_modified"], summary["changed"]) == (3, 1)
+
+    rows = get_connection().execute("SELECT download_status, etag, file_path, final_url FROM urls ORDER BY id").fetchall()
+    assert [row[0] for row in rows] == ["not_modified", "success", "not_modified", "not_modified"]
+    assert rows[0][1] == '"v1"' and rows[0][3].endswith("/etag")
+    assert rows[0][2] == first[0][0] and rows[1][2] != first[1][0] and rows[2][2] == first[2][0]
+    assert rows[3][2] == "0_9"  # legacy download unchanged, hashed from its file and kept
+    legacy_hash = get_connection().execute("SELECT content_hash FROM urls WHERE id = 4").fetchone()[0]
+    assert legacy_hash == hashlib.sha256(legacy_body).hexdigest()
+
+    add_html_url_data()
+    extraction = get_connection().execute("SELECT extract_status, html_file FROM html_text ORDER BY id").fetchall()
+    assert [status for status, _ in extraction] == ["success", "pending", "success", "pending"]  # legacy row never extracted here
+    assert extraction[1][1] == rows[1][2]
+
+    close_connection()
@@ -1,9 +1,13 @@
 import os
+import json
 import pytest
 from stakeholder_data_extraction_pipeline import config
 import sqlite3
 from stakeholder_data_extraction_pipeline.text_extraction import html_text_extraction
 from stakeholder_data_extraction_pipeline.text_extraction import pdf_text_extraction
+from stakeholder_data_extraction_pipeline.text_extraction import text_index
+from stakeholder_data_extraction_pipeline.database.database_setup import setup_db
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, close_connection
 
 # --- Dummy classes to replace the deepdoctection pipeline ---
 class DummyPage:
@@ -37,10 +41,10 @@ def test_html_extraction(tmp_path):
 def test_pdf_extraction(tmp_path, monkeypatch):
     """
     Test that run_pdf_extraction:
-      - Renames PDF files to include the .pdf extension.
+      - Reads PDF files where the downloader stored them (with .pdf extension), without renaming anything.
       - Processes pending PDFs (using the deepdoctection pipeline) and creates JSON output.
       
-    Sets up two sample PDF files (without .pdf extensions) in a temporary downloads directory.
+    Sets up a downloaded PDF stored with its extension and a legacy "orgid_urlid" record whose file has the extension.
     """
     # Create temporary directories for PDF downloads and for extracted output.
     downloads_dir = tmp_path / "temp_pdf"
@@ -48,41 +52,33 @@ def test_pdf_extraction(tmp_path, monkeypatch):
     extracted_dir = tmp_path / "extracted"
     extracted_dir.mkdir()
 
-    # Create a temporary SQLite database with the proper schema.
+    # Create a temporary SQLite database with the pipeline schema (including work claim columns).
     temp_db = tmp_path / "temp.db"
+    monkeypatch.setattr(config, "DB_PATH", str(temp_db))
+    setup_db()
     conn = sqlite3.connect(str(temp_db))
     c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS pdf_text (
-            id INTEGER PRIMARY KEY,
-            organization_id INTEGER,
-            pdf_file TEXT,
-            extract_status TEXT,
-            extracted_text_path TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
     # Insert records for two sample PDFs.
-    # The naming convention is "orgid_urlid" so that the file id is parsed from the part after '_'
+    # The downloader stores pdfs with their extension, legacy records "orgid_urlid" point at files renamed to .pdf
     c.execute(
         "INSERT INTO pdf_text (id, pdf_file, organization_id, extract_status) VALUES (?, ?, ?, ?)",
-        (123, "31_123", 31, "pending")
+        (123, "31_123.pdf", 31, "pending")
     )
     c.execute(
         "INSERT INTO pdf_text (id, pdf_file, organization_id, extract_status) VALUES (?, ?, ?, ?)",
         (456, "32_456", 32, "pending")
     )
+    c.execute("INSERT INTO urls (id, organization_id, url) VALUES (123, 31, 'https://example.org/cbam-report.pdf')")
     conn.commit()
     conn.close()
 
     # Override configuration values so that the extraction uses our temporary directories and DB.
     monkeypatch.setattr(config, "URL_DOWNLOADS_DIR", str(downloads_dir))
     monkeypatch.setattr(config, "EXTRACTED_PDF_DIR", str(extracted_dir))
-    monkeypatch.setattr(config, "DB_PATH", str(temp_db))
     # Override add_pdf_url_data to be a no-op (we already inserted our records).
     monkeypatch.setattr(pdf_text_extraction, "add_pdf_url_data", lambda: None)
 
-    # Create two sample PDF files (without the .pdf extension).
+    # Create two sample PDF files.
     pdf_content = b"""%PDF-1.4
 1 0 obj
 << /Type /Catalog /Pages 2 0 R >>
@@ -120,22 +116,17 @@ startxref
 350
 %%EOF
 """
-    # Write two sample PDF files (initially without .pdf extension).
-    sample_pdf1 = downloads_dir / "31_123"
+    # Write two sample PDF files (with the .pdf extension given at download time).
+    sample_pdf1 = downloads_dir / "31_123.pdf"
     sample_pdf1.write_bytes(pdf_content)
-    sample_pdf2 = downloads_dir / "32_456"
+    sample_pdf2 = downloads_dir / "32_456.pdf"
     sample_pdf2.write_bytes(pdf_content)
 
-    print("Files before renaming:", os.listdir(str(downloads_dir)))
-
     # Call the actual extraction pipeline.
     pdf_text_extraction.run_pdf_extraction()
 
-    print("Files after renaming:", os.listdir(str(downloads_dir)))
-
-    # Verify that the PDF files have been renamed (i.e. have the .pdf extension).
-    assert (downloads_dir / "31_123.pdf").exists(), "Expected file 31_123.pdf to exist"
-    assert (downloads_dir / "32_456.pdf").exists(), "Expected file 32_456.pdf to exist"
+    # Verify that no rename pass touched the downloads.
+    assert sorted(os.listdir(str(downloads_dir))) == ["31_123.pdf", "32_456.pdf"], "Expected the downloads unchanged"
 
     # Verify that JSON output files were created in the extracted directory.
     output1 = extracted_dir / "31_123.json"
@@ -149,4 +140,121 @@ startxref
         assert content1, "Extracted file 31_123.json is empty"
     with open(output2, "r", encoding="utf-8") as f:
         content2 = f.read().strip()
-        assert content2, "Extracted file 32_456.json is empty"
\ No newline at end of file
+        assert content2, "Extracted file 32_456.json is empty"
+
+    # Indexed under the source url (the sample pdfs have no metadata title), never the stored file name.
+    titles = dict(get_connection().execute(f"SELECT rowid, title FROM {text_index.FTS_TABLE}").fetchall())
+    assert titles == {123: "https://example.org/cbam-report.pdf", 456: ""}
+    close_connection()
+
+def test_text_index_search(tmp_path, monkeypatch):
+    """Test that extracted html is indexed on save and found by ranked, per-organization search."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "EXTRACTED_HTML_DIR", str(tmp_path))
+    setup_db()
+
+    docs = {
+        (1, 10): {"title": "CBAM default values", "raw_text": "Default values for embedded emissions in steel."},
+        (2, 11): {"title": "Annual report", "raw_text": "We discuss CBAM certificates and default values briefly."},
+        (2, 12): {"title": "Careers", "raw_text": "Join our team."},
+    }
+    for (org_id, file_id), doc in docs.items():
+        html_text_extraction.save_extracted_json(file_id, org_id, json.dumps(doc))
+
+    hits = text_index.search("default values")
+    assert [hit["document_id"] for hit in hits] == [10, 11]  # title match ranks first
+    assert "[default]" in hits[0]["snippet"].lower()
+
+    assert [hit["document_id"] for hit in text_index.search("default values", organization_ids=[2])] == [11]
+    assert [hit["document_id"] for hit in text_index.search("CBAM-certificates")] == [11]  # not fts syntax, searched as terms
+    close_connection()
+
+def test_html_extraction_fans_out_shared_blob(tmp_path, monkeypatch):
+    """Test that rows pointing at the same downloaded blob are extracted once and all get the result."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "URL_DOWNLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EXTRACTED_HTML_DIR", str(tmp_path))
+    setup_db()
+
+    (tmp_path / "blob").write_text("<html><head><title>CBAM position</title></head><body><article><p>"
+                                   + "Our position on CBAM default values for imported steel. " * 5 + "</p></article></body></html>")
+    conn = sqlite3.connect(str(tmp_path / "temp.db"))
+    conn.executemany("INSERT INTO html_text (id, organization_id, html_file, extract_status) VALUES (?, ?, 'blob', 'pending')",
+                     [(1, 31), (2, 32), (3, 33)])
+    conn.commit()
+
+    calls = []
+    extract = html_text_extraction.extract_html_content
+    monkeypatch.setattr(html_text_extraction, "extract_html_content", lambda path: calls.append(path) or extract(path))
+
+    counts = html_text_extraction.extract_all_html()
+    assert len(calls) == 1
+    assert counts == {"items": 3, "failures": 0, "deduplicated": 2}
+
+    rows = conn.execute("SELECT extract_status, extracted_text_path FROM html_text ORDER BY id").fetchall()
+    assert {row[0] for row in rows} == {"success"} and len({row[1] for row in rows}) == 1
+    conn.close()
+
+    hits = text_index.search("default values")
+    assert sorted(hit["organization_id"] for hit in hits) == [31, 32, 33]  # indexed for every organization
+    close_connection()
+
+def test_html_extraction_keeps_batch_leases(tmp_path, monkeypatch):
+    """Test that the whole claimed batch is renewed while extracting and a row whose lease was lost is not written."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "URL_DOWNLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EXTRACTED_HTML_DIR", str(tmp_path))
+    setup_db()
+
+    conn = sqlite3.connect(str(tmp_path / "temp.db"))
+    conn.executemany("INSERT INTO html_text (id, organization_id, html_file, extract_status) VALUES (?, 31, ?, 'pending')",
+                     [(1, "a"), (2, "b")])
+    conn.commit()
+
+    leases = []
+    def extract(path):
+        # row 1's lease expired and another worker claimed it while we were extracting
+        conn.execute("UPDATE html_text SET claimed_by = 'other:1' WHERE id = 1")
+        conn.commit()
+        leases.append(conn.execute("SELECT lease_expires FROM html_text WHERE id = 2").fetchone()[0])
+        return json.dumps({"title": "t", "raw_text": "CBAM text"})
+    monkeypatch.setattr(html_text_extraction, "extract_html_content", extract)
+
+    counts = html_text_extraction.extract_all_html()
+    assert counts == {"items": 1, "failures": 0, "deduplicated": 0}
+    assert leases[1] > leases[0]  # row 2 renewed while row 1 was worked on
+    rows = conn.execute("SELECT id, extract_status, claimed_by FROM html_text ORDER BY id").fetchall()
+    assert rows == [(1, "pending", "other:1"), (2, "success", None)]
+    conn.close()
+    close_connection()
+
+def test_type_flip_keeps_new_index_entry(tmp_path, monkeypatch):
+    """Test that dropping a url's stale pdf/html row does not remove the text indexed for its new file type."""
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "temp.db"))
+    monkeypatch.setattr(config, "URL_DOWNLOADS_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "EXTRACTED_HTML_DIR", str(tmp_path))
+    setup_db()
+
+    # url 1 was a pdf and is html after a refresh, url 2 was html and is a pdf now
+    (tmp_path / "new.html").write_text("<html><head><title>CBAM page</title></head><body><article><p>"
+                                       + "Our position on CBAM default values for imported steel. " * 5 + "</p></article></body></html>")
+    conn = sqlite3.connect(str(tmp_path / "temp.db"))
+    conn.executemany("INSERT INTO urls (id, organization_id, url, file_path, download_status, file_type, paywall_status) "
+                     "VALUES (?, 31, ?, ?, 'success', ?, 'unknown')",
+                     [(1, "https://example.org/a", "new.html", "html"), (2, "https://example.org/b", "new.pdf", "pdf")])
+    conn.execute("INSERT INTO pdf_text (id, organization_id, pdf_file, extract_status) VALUES (1, 31, 'old.pdf', 'success')")
+    conn.execute("INSERT INTO html_text (id, organization_id, html_file, extract_status) VALUES (2, 31, 'old.html', 'success')")
+    conn.commit()
+    text_index.index_document("pdf", 1, 31, "old", "outdated pdf text")
+    text_index.index_document("pdf", 2, 31, "new", "emissions report for the new pdf")  # the pdf step of this run
+
+    html_text_extraction.run_html_extraction()
+    assert [hit["document_id"] for hit in text_index.search("default values")] == [1]
+    pdf_text_extraction.add_pdf_url_data()
+
+    assert [hit["document_id"] for hit in text_index.search("default values")] == [1]  # html text of url 1 kept
+    assert [hit["document_id"] for hit in text_index.search("emissions report")] == [2]  # pdf text of url 2 kept
+    assert conn.execute("SELECT id FROM html_text").fetchall() == [(1,)]
+    assert conn.execute("SELECT id, pdf_file FROM pdf_text").fetchall() == [(2, "new.pdf")]
+    conn.close()
+    close_connection()
@@ -3,63 +3,50 @@ import json
 import csv
 import sqlite3
 from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, transaction
+from stakeholder_data_extraction_pipeline.database import work_queue
+from .text_index import index_document, index_shared_document, FTS_TABLE
 from trafilatura import extract
 
 # define error log file path
 HTML_ERROR_LOG = os.path.join(config.LOGS_DIR, "html_extract_errors.csv")  # error log for html extraction
 
 def add_html_url_data():
-    """ add html extraction pending data from urls table into html_text table, only for html files with success download""" 
-    conn = None # ensure conn exists
+    """
+    add html extraction pending data from urls table into html_text table, only for html files with success download,
+    rows whose url was refreshed to a different file are extracted again, rows whose url is no longer html are dropped
+    """
     
     try: 
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-
-        # insert pending htmls
-        c.execute("""INSERT INTO html_text (id, organization_id, html_file, extract_status)
-                    SELECT u.id, u.organization_id, u.file_path, 'pending'
-                    FROM urls u
-                    WHERE u.paywall_status = 'unknown'
-                    AND u.download_status = 'success'
-                    AND u.file_type = 'html'
-                """)
-        
-        conn.commit()
+        with transaction() as conn:
+            # drop rows (and their indexed text) whose url changed to another file type or a paywall
+            stale = """SELECT h.id FROM html_text h JOIN urls u ON u.id = h.id
+                       WHERE u.download_status IN ('success', 'not_modified')
+                       AND (u.file_type IS NOT 'html' OR u.paywall_status IS NOT 'unknown')"""
+            conn.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({stale}) AND source = 'html'")  # not the url's new pdf text
+            conn.execute(f"DELETE FROM html_text WHERE id IN ({stale})")
+
+            # content changed on refresh (new blob): extract again, the new text replaces the old index entry
+            conn.execute("""UPDATE html_text
+                        SET html_file = u.file_path, extract_status = 'pending', extracted_text_path = NULL
+                        FROM urls u
+                        WHERE u.id = html_text.id
+                        AND u.download_status = 'success'
+                        AND u.file_type = 'html'
+                        AND u.file_path IS NOT html_text.html_file
+                    """)
+
+            # insert pending htmls (ignore rows already queued by an earlier run or another worker)
+            conn.execute("""INSERT OR IGNORE INTO html_text (id, organization_id, html_file, extract_status)
+                        SELECT u.id, u.organization_id, u.file_path, 'pending'
+                        FROM urls u
+                        WHERE u.paywall_status = 'unknown'
+                        AND u.download_status IN ('success', 'not_modified')
+                        AND u.file_type = 'html'
+                    """)
     
     except sqlite3.Error as e:
         print(f"Error adding html info: {e}")
-    
-    finally:
-        if conn:
-            conn.close() # close db connection
-
-def get_pending_htmls():
-    """ get all html records pending extraction, returns list of tuples (id, organization_id, html_file)"""
-    conn = None # ensure conn exists
-    
-    try: 
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-
-        # get all html records with pending extraction status
-        c.execute("SELECT id, organization_id, html_file FROM html_text WHERE extract_status = 'pending'")  # query pending
-        rows = c.fetchall()
-
-        if not rows: 
-            print("no pending html records")
-        return rows
-
-    except sqlite3.Error as e:
-        print(f"Error when getting pending htmls: {e}")
-    
-    finally:
-        if conn:
-            conn.close() # close db connection
-    
-    return rows # returns list of tuples (id, organization_id, html_file)
 
 def extract_html_content(html_file_path):
     """ using library trafilatura (Barbaresi, 2021) extract text and metadata from html file """
@@ -108,7 +95,7 @@ def clean_json(raw_json):
         return None
 
 def save_extracted_json(file_id, organization_id, json_data):
-    """ save cleaned json to file and return path, filename based on org and id """
+    """ save cleaned json to file, add it to the full-text index and return path, filename based on org and id """
     
     cleaned = clean_json(json_data)  # clean json
     if cleaned:
@@ -118,6 +105,8 @@ def save_extracted_json(file_id, organization_id, json_data):
         # save json path and cleaned json 
         with open(json_path, "w", encoding="utf-8") as f:
             json.dump(cleaned, f, ensure_ascii=False, indent=4)  # save json
+        
+        index_document("html", file_id, organization_id, cleaned["title"], cleaned["text"])  # searchable straight away
         return json_path  # return saved file path
     
     return None
@@ -135,48 +124,94 @@ def log_html_error(file_id, organization_id, file_path, error_message):
         writer = csv.writer(file)
         writer.writerow([file_id, organization_id, file_path, error_message])  # log error
 
+def update_html_database(c, file_id, json_path, status, worker):
+    """
+    update html_text record with extracted json path and status, and drop this worker's lease,
+    returns False if the lease was lost (expired and claimed by another worker), the row is then left to that worker
+    """
+    c.execute("""UPDATE html_text
+                SET extracted_text_path = ?, extract_status = ?, timestamp = CURRENT_TIMESTAMP,
+                    claimed_by = NULL, lease_expires = NULL, heartbeat_at = NULL
+                WHERE id = ? AND claimed_by = ?""", (json_path, status, file_id, worker))  # update record (autocommit, no long write lock)
+    return c.rowcount > 0
+
 def extract_all_html():
-    """ run extraction for all pending html files, update html_text table with result"""
-    conn = None # ensure conn exists 
+    """
+    Run extraction for all pending html files, claiming batches so several workers can share the queue.
+    Each downloaded file is extracted once, rows sharing it (same blob) get the same result. Returns counts.
+    """
+    worker = work_queue.worker_id()
+    remaining = []  # claimed ids not finished yet (released if interrupted)
+    counts = {"items": 0, "failures": 0, "deduplicated": 0}
     
     try: 
-        # connect to db
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        pending = get_pending_htmls()  # get pending htmls from db
+        c = get_connection().cursor()
         
-        for file_id, org_id, file_path in pending:
-            full_path = os.path.join(config.URL_DOWNLOADS_DIR, file_path)  # full downloaded file path
+        while True:
+            pending = work_queue.claim("html", config.CLAIM_BATCH_SIZE, worker)  # claim next batch of pending htmls
+            if not pending:
+                break
+            remaining = [row[0] for row in pending]
             
-            try:
-                # try to extract html content, update db if successful or not
-                extracted = extract_html_content(full_path)  # extract html content
-                if extracted:
-                    json_path = save_extracted_json(file_id, org_id, extracted)  # save extracted json
-                    status = "success"  # mark success
+            for file_id, org_id, file_path in pending:
+                if file_id not in remaining:
+                    continue  # already filled in from an earlier row of the same file
+                work_queue.heartbeat("html", remaining, worker)  # keep the leases of the rest of the batch alive
+                
+                # same content extracted before (other url or organization), reuse its json
+                reused = work_queue.finished_result("html", file_path)
+                if reused:
+                    json_path, status = reused
+                    if status == "success":
+                        index_shared_document("html", json_path, [(file_id, org_id)])
+                    counts["deduplicated"] += 1
                 else:
-                    json_path = None
-                    status = "failure"  # mark failure
-                c.execute("""UPDATE html_text
-                            SET extracted_text_path = ?, extract_status = ?, timestamp = CURRENT_TIMESTAMP
-                            WHERE id = ?""", (json_path, status, file_id))  # update record
-            
-            except Exception as e:
-                log_html_error(file_id, org_id, file_path, str(e))  # log error
-        
-        conn.commit()  # commit changes
+                    full_path = os.path.join(config.URL_DOWNLOADS_DIR, file_path)  # full downloaded file path
+                    
+                    try:
+                        # try to extract html content, update db if successful or not
+                        extracted = extract_html_content(full_path)  # extract html content
+                        if extracted:
+                            json_path = save_extracted_json(file_id, org_id, extracted)  # save extracted json
+                            status = "success"  # mark success
+                        else:
+                            json_path = None
+                            status = "failure"  # mark failure
+                    
+                    except Exception as e:
+                        log_html_error(file_id, org_id, file_path, str(e))  # log error
+                        json_path, status = None, "failure"                 # mark failure so it is not reclaimed this run
+                
+                if not update_html_database(c, file_id, json_path, status, worker):
+                    print(f"lease on html {file_id} lost, left to the worker holding it")
+                    remaining.remove(file_id)
+                    continue
+                
+                # every other pending row of this file gets the same result
+                shared = work_queue.fan_out("html", file_path, json_path, status, worker)
+                if status == "success":
+                    index_shared_document("html", json_path, shared)
+                
+                for row_id in [file_id, *(row[0] for row in shared)]:
+                    if row_id in remaining:
+                        remaining.remove(row_id)
+                counts["items"] += 1 + len(shared)
+                counts["failures"] += (status == "failure") * (1 + len(shared))
+                counts["deduplicated"] += len(shared)
 
     except sqlite3.Error as e:
             print(f"Error extracting html: {e}")
-        
+    
     finally:
-        if conn:
-            conn.close() # close db connection
+        if remaining:
+            work_queue.release("html", remaining, worker)  # hand back unfinished rows
+
+    return counts
 
 def run_html_extraction():
     """ run the full html extraction pipeline, add pending data then extract """
-    add_html_url_data()  # insert pending html records from urls
-    extract_all_html()  # process all pending html extractions
+    add_html_url_data()        # insert pending html records from urls
+    return extract_all_html()  # process all pending html extractions
 
 
 # SOURCES 
@@ -3,6 +3,9 @@ import json
 import sqlite3
 import gc
 from stakeholder_data_extraction_pipeline import config
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, transaction
+from stakeholder_data_extraction_pipeline.database import work_queue
+from .text_index import index_document, index_shared_document, FTS_TABLE
 import deepdoctection as dd
 from PyPDF2 import PdfReader
 from deepdoctection.extern.d2detect import D2FrcnnDetector
@@ -66,99 +69,51 @@ pipe_comp_list = [layout_comp, lang_detect_comp,
 
 pipe = dd.DoctectionPipe(pipeline_component_list=pipe_comp_list)
 
-def ensure_pdf_extensions():
-    """
-    Extract PDF paths from the database and ensure that the file names in the downloads directory
-    have the correct '.pdf' extension. If not, rename the files.
-    """
-    conn = None
-    try:
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT pdf_file FROM pdf_text")
-        pdf_paths = c.fetchall()
-    except Exception as e:
-        print(f"Error fetching PDF paths: {e}")
-        pdf_paths = []
-    
-    finally:
-        if conn:
-            conn.close()
-    
-    # Build full paths based on the downloads directory
-    raw_pdf_paths = [os.path.join(config.URL_DOWNLOADS_DIR, path[0].strip()) for path in pdf_paths]
-
-    # Debugging: print the raw pdf paths
-    #print("Raw PDF paths:", raw_pdf_paths)
-
-    # Ensure correct path formatting and add .pdf extension if missing
-    for path in raw_pdf_paths:
-        full_path = os.path.normpath(path)
-        if not full_path.endswith(".pdf") and os.path.exists(full_path):
-            new_file_path = full_path + ".pdf"
-            try:
-                print(f"Attempting to rename: {full_path} -> {new_file_path}")  # Debug print
-                os.rename(full_path, new_file_path)
-                print(f"Renamed file: {full_path} -> {new_file_path}")
-            except FileNotFoundError:
-                print(f"Skipping (not found): {full_path}")
-            except Exception as e:
-                print(f"Error renaming {full_path}: {e}")
-        elif os.path.exists(full_path):
-            print(f"PDF already exists: {full_path}")
-
 # -------------------------
 #   Database functions
 # -------------------------
 
 def add_pdf_url_data():
-    """ add pending pdf records from urls table into pdf_text table, for pdf files with success download""" 
-    
-    conn = None # ensure conn exists
+    """
+    add pending pdf records from urls table into pdf_text table, for pdf files with success download,
+    rows whose url was refreshed to a different file are extracted again, rows whose url is no longer a pdf are dropped
+    """
     
     try: 
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        c.execute("""INSERT INTO pdf_text (id, organization_id, pdf_file, extract_status)
-                    SELECT u.id, u.organization_id, u.file_path, 'pending'
-                    FROM urls u
-                    WHERE u.download_status = 'success'
-                    AND u.file_type = 'pdf'
-                """)  # insert pending pdf records
-        conn.commit()
+        with transaction() as conn:
+            # drop rows (and their indexed text) whose url changed to another file type
+            stale = """SELECT p.id FROM pdf_text p JOIN urls u ON u.id = p.id
+                       WHERE u.download_status IN ('success', 'not_modified') AND u.file_type IS NOT 'pdf'"""
+            conn.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({stale}) AND source = 'pdf'")  # not the url's new html text
+            conn.execute(f"DELETE FROM pdf_text WHERE id IN ({stale})")
+
+            # content changed on refresh (new blob): extract again
+            conn.execute("""UPDATE pdf_text
+                        SET pdf_file = u.file_path, extract_status = 'pending', extracted_text_path = NULL
+                        FROM urls u
+                        WHERE u.id = pdf_text.id
+                        AND u.download_status = 'success'
+                        AND u.file_type = 'pdf'
+                        AND u.file_path IS NOT pdf_text.pdf_file
+                    """)
+
+            conn.execute("""INSERT OR IGNORE INTO pdf_text (id, organization_id, pdf_file, extract_status)
+                        SELECT u.id, u.organization_id, u.file_path, 'pending'
+                        FROM urls u
+                        WHERE u.download_status IN ('success', 'not_modified')
+                        AND u.file_type = 'pdf'
+                    """)  # insert pending pdf records
     
     except sqlite3.Error as e:
         print(f"Error adding pdf info: {e}")
-    
-    finally: 
-        if conn: 
-            conn.close() # close db connection
 
-def update_pdf_database(c, file_id, json_path, status):
-    """ update pdf_text record in db  # with extracted json path and status """
+def update_pdf_database(c, file_id, json_path, status, worker):
+    """ update pdf_text record in db  # with extracted json path and status, drops this worker's lease, False if it was lost """
     c.execute("""UPDATE pdf_text
-                 SET extracted_text_path = ?, extract_status = ?, timestamp = CURRENT_TIMESTAMP
-                 WHERE id = ?""", (json_path, status, file_id))  # update record
-
-def get_pending_pdf_ids():
-    """ get ids of pdfs pending extraction, returns list of pending ids """
-    conn = None # ensure db connection 
-    rows = []
-
-    try: 
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
-        c.execute("""SELECT id FROM pdf_text 
-                    WHERE extract_status = 'pending' OR extract_status = 'failure'
-                    """)  # query pending pdfs
-        rows = c.fetchall()
-    
-    except sqlite3.Error as e:
-        print(f"Error getting pending PDF ids: {e}")
-    finally:
-        if conn:
-            conn.close()
-    return [row[0] for row in rows]
+                 SET extracted_text_path = ?, extract_status = ?, timestamp = CURRENT_TIMESTAMP,
+                     claimed_by = NULL, lease_expires = NULL, heartbeat_at = NULL
+                 WHERE id = ? AND claimed_by = ?""", (json_path, status, file_id, worker))  # update record
+    return c.rowcount > 0
 
 def is_pdf_encrypted(pdf_path):
     """ check if pdf is encrypted using pypdf https://pypdf.readthedocs.io/en/stable/modules/PdfReader.html """
@@ -170,6 +125,91 @@ def is_pdf_encrypted(pdf_path):
         print(f"error checking encryption for {pdf_path}: {e}")  # print error
         return True  # assume encrypted if error
 
+def pdf_title(pdf_path, file_id):
+    """ title for the full-text index: the pdf's metadata title, else the url it was downloaded from, else empty """
+    try:
+        metadata = PdfReader(pdf_path).metadata
+        title = (metadata.title or "").strip() if metadata else ""
+    except Exception as e:
+        print(f"error reading metadata of {pdf_path}: {e}")  # print error
+        title = ""
+    if title:
+        return title
+
+    try:
+        row = get_connection().execute("SELECT url FROM urls WHERE id = ?", (file_id,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"Error getting url of pdf {file_id}: {e}")
+        row = None
+    return row[0] if row and row[0] else ""  # blob names (<sha256>.pdf) say nothing about the document
+
+def extract_pdf(pdf_path, file_id, org_id, worker, held=None):
+    """
+    run the deepdoctection pipeline on one pdf, write its pages to json and index the text, returns (json path, page count),
+    path None if nothing extracted  # held: ids of the claimed batch whose leases are renewed per page (default this pdf)
+    """
+    file_name = os.path.basename(pdf_path)  # get file name
+    
+    df = pipe.analyze(path=pdf_path)    # analyze pdf with deepdoctection
+    if not df:
+        print("no data found")          # nothing extracted
+        return None, 0
+    df.reset_state()  # free memory
+    
+    # save pdf pages in json
+    total_pages = 0
+    first_page_lang = "unknown"
+    title = pdf_title(pdf_path, file_id)
+    pages = {}
+    temp_json_path = os.path.join(config.EXTRACTED_PDF_DIR, f"{file_name}.tmp.json")  # temporary json file
+    
+    with open(temp_json_path, "w", encoding="utf-8") as f:
+        f.write("{\n")  # start json
+        f.write(f'  "file_name": "{file_name}",\n')  # file name
+        f.write(f'  "title": {json.dumps(title, ensure_ascii=False)},\n')  # metadata title or source url
+        
+        for i, page in enumerate(df, start=1):
+            try:
+                print(f"Processing page {i}...")
+                # Attempt to access language attribute on first page
+                if i == 1:
+                    detected_lang = getattr(page, "language", "unknown")
+                    first_page_lang = detected_lang
+                    print(f"Detected language on page {i}: {first_page_lang}")
+                total_pages += 1
+                work_queue.heartbeat("pdf", held or [file_id], worker)  # ocr is slow, keep the batch's leases alive per page
+                page_text = page.text.strip()
+                print(f"Page {i} text length: {len(page_text)}")
+                pages[f"page_{i}"] = page_text
+            except Exception as e:
+                print(f"Error processing page {i}: {e}")
+                raise  # Optionally re-raise so you see the full traceback
+                            
+        json_pages = json.dumps(pages, ensure_ascii=False, indent=2)  # convert pages to json string
+        f.write(f'  "pages": {json_pages},\n')            # write pages
+        f.write(f'  "language": "{first_page_lang}",\n')  # write language
+        f.write(f'  "total_pages": {total_pages}\n')      # write page count
+        f.write("}\n")                                    # end json
+    
+    # write json file and clean memory (avoid ram crashes)
+    final_json_path = os.path.join(config.EXTRACTED_PDF_DIR, os.path.splitext(file_name)[0] + ".json")  # final json file path
+    os.rename(temp_json_path, final_json_path)  # rename temp file
+    print(f"saved json to: {final_json_path}")  # debug print
+    index_document("pdf", file_id, org_id, title, "\n".join(pages.values()))  # add to full-text index
+    
+    df.reset_state()  # free memory after processing pdf
+    gc.collect()      # garbage collect
+    return final_json_path, total_pages
+
+def requeue_failed_pdfs():
+    """ put pdfs that failed in an earlier run back in the queue (failures are retried once per run) """
+    try:
+        with transaction() as conn:
+            conn.execute("UPDATE pdf_text SET extract_status = 'pending' WHERE extract_status = 'failure'")
+    
+    except sqlite3.Error as e:
+        print(f"Error requeueing failed PDFs: {e}")
+
 # ------------------------------
 # Main PDF Extraction Pipeline
 # ------------------------------
@@ -177,102 +217,88 @@ def is_pdf_encrypted(pdf_path):
 def run_pdf_extraction():
     """
     Run the pdf extraction pipeline:
-      - Ensure PDF filenames are correctly formatted (with .pdf extension).
-      - Process pending PDFs and update the database with extraction results.
+      - Claim pending PDFs in batches (several OCR workers can share the queue) 
+        and update the database with extraction results.
+      - OCR each unique pdf once, rows sharing the same blob get the same result.
+    Returns counts of processed pdfs, failures, pages and rows served from an earlier extraction.
     """
-    # first check that all pdfs have .pdf extension
-    ensure_pdf_extensions()
-    add_pdf_url_data()                        # add pending pdf records from urls
-    pending_ids = set(get_pending_pdf_ids())  # get pending pdf ids
+    add_pdf_url_data()     # add pending pdf records from urls
+    requeue_failed_pdfs()  # retry earlier failures
     
-    # gather pdf file paths from downloads dir  # based on file naming convention
-    pdf_files = [f for f in os.listdir(config.URL_DOWNLOADS_DIR) if f.lower().endswith(".pdf")]
-    pending_pdf_paths = []  # list to hold tuples (pdf_path, file_id)
-    
-    for file in pdf_files:
-        try:
-            # file naming convention: "orgid_urlid.pdf", extract urlid as file_id
-            file_id = int(file.split("_")[-1].replace(".pdf", ""))  # parse file id
-        except Exception as e:
-            print(f"could not parse file id from {file}: {e}")  # error parsing
-            continue
-        if file_id in pending_ids:
-            full_path = os.path.join(config.URL_DOWNLOADS_DIR, file)  # full pdf path
-            if is_pdf_encrypted(full_path):
-                print(f"skipping encrypted pdf: {file}")  # skip if encrypted
-                # update status as decryption_failure here if desired
-                continue
-            pending_pdf_paths.append((full_path, file_id))  # add to list
-    #print("pending pdf paths (not encrypted):", pending_pdf_paths)  # debug print
+    worker = work_queue.worker_id()
+    remaining = []  # claimed ids not finished yet (released if interrupted)
+    counts = {"items": 0, "failures": 0, "pages": 0, "deduplicated": 0}
 
     try: 
-        conn = sqlite3.connect(config.DB_PATH)
-        c = conn.cursor()
+        c = get_connection().cursor()
         
-        # run the data pipeline on each pending pdf
-        for pdf_path, file_id in pending_pdf_paths:
-            file_name = os.path.basename(pdf_path)  # get file name
-            print(f"processing pdf: {file_name}")   # debug print
+        while True:
+            pending = work_queue.claim("pdf", config.PDF_BATCH_SIZE, worker)  # claim next batch of pending pdfs
+            if not pending:
+                break
+            remaining = [row[0] for row in pending]
             
-            try:
-                df = pipe.analyze(path=pdf_path)    # analyze pdf with deepdoctection
-                if not df:
-                    print("no data found")          # nothing extracted
-                    continue
-                df.reset_state()  # free memory
+            # run the data pipeline on each claimed pdf
+            for file_id, org_id, pdf_file in pending:
+                if file_id not in remaining:
+                    continue  # already filled in from an earlier row of the same blob
+                work_queue.heartbeat("pdf", remaining, worker)  # rows waiting behind earlier pdfs of the batch
                 
-                # save pdf pages in json
-                total_pages = 0
-                first_page_lang = "unknown"
-                pages = {}
-                temp_json_path = os.path.join(config.EXTRACTED_PDF_DIR, f"{file_name}.tmp.json")  # temporary json file
+                # blobs are stored as <hash>.pdf by the downloader, legacy downloads "orgid_urlid" may have been renamed
+                pdf_path = os.path.join(config.URL_DOWNLOADS_DIR, pdf_file.strip())
+                if not os.path.exists(pdf_path) and os.path.exists(pdf_path + ".pdf"):
+                    pdf_path += ".pdf"
+                file_name = os.path.basename(pdf_path)  # get file name
                 
-                with open(temp_json_path, "w", encoding="utf-8") as f:
-                    f.write("{\n")  # start json
-                    f.write(f'  "file_name": "{file_name}",\n')  # file name
+                reused = work_queue.finished_result("pdf", pdf_file)
+                if reused:
+                    # same pdf already ocr'd for another url or organization
+                    json_path, status = reused
+                    print(f"reusing extraction of {file_name}")
+                    if status == "success":
+                        index_shared_document("pdf", json_path, [(file_id, org_id)])
+                    counts["deduplicated"] += 1
+                elif not os.path.exists(pdf_path):
+                    print(f"pdf not found: {file_name}")
+                    json_path, status = None, "missing"
+                elif is_pdf_encrypted(pdf_path):
+                    print(f"skipping encrypted pdf: {file_name}")  # skip if encrypted
+                    json_path, status = None, "decryption_failure"
+                else:
+                    print(f"processing pdf: {file_name}")   # debug print
+                    try:
+                        json_path, total_pages = extract_pdf(pdf_path, file_id, org_id, worker, remaining)
+                        counts["pages"] += total_pages
+                        status = "success" if json_path else "no_text"  # nothing extracted
                     
-                    for i, page in enumerate(df, start=1):
-                        try:
-                            print(f"Processing page {i}...")
-                            # Attempt to access language attribute on first page
-                            if i == 1:
-                                detected_lang = getattr(page, "language", "unknown")
-                                first_page_lang = detected_lang
-                                print(f"Detected language on page {i}: {first_page_lang}")
-                            total_pages += 1
-                            page_text = page.text.strip()
-                            print(f"Page {i} text length: {len(page_text)}")
-                            pages[f"page_{i}"] = page_text
-                        except Exception as e:
-                            print(f"Error processing page {i}: {e}")
-                            raise  # Optionally re-raise so you see the full traceback
-                                        
-                    json_pages = json.dumps(pages, ensure_ascii=False, indent=2)  # convert pages to json string
-                    f.write(f'  "pages": {json_pages},\n')            # write pages
-                    f.write(f'  "language": "{first_page_lang}",\n')  # write language
-                    f.write(f'  "total_pages": {total_pages}\n')      # write page count
-                    f.write("}\n")                                    # end json
+                    except Exception as e:
+                        error_message = str(e)  # get error message
+                        print(f"error processing {file_name}: {error_message}")  # print error
+                        json_path, status = None, "failure"
                 
-                # write json file, update db and clean memory (avoid ram crashes)
-                final_json_path = os.path.join(config.EXTRACTED_PDF_DIR, os.path.splitext(file_name)[0] + ".json")  # final json file path
-                os.rename(temp_json_path, final_json_path)  # rename temp file
-                print(f"saved json to: {final_json_path}")  # debug print
+                if not update_pdf_database(c, file_id, json_path, status, worker):  # update db (autocommit per pdf)
+                    print(f"lease on {file_name} lost, left to the worker holding it")
+                    remaining.remove(file_id)
+                    continue
                 
-                update_pdf_database(c, file_id, final_json_path, "success")  # update db as success
-                conn.commit()     # commit after each pdf
-                df.reset_state()  # free memory after processing pdf
-                gc.collect()      # garbage collect
-            
-            except Exception as e:
-                error_message = str(e)  # get error message
-                print(f"error processing {file_name}: {error_message}")  # print error
-                update_pdf_database(c, file_id, None, "failure")         # update db as failure
-                conn.commit()  # commit update
+                # every other pending row of this blob gets the same result without another ocr run
+                shared = work_queue.fan_out("pdf", pdf_file, json_path, status, worker)
+                if status == "success":
+                    index_shared_document("pdf", json_path, shared)
+                
+                for row_id in [file_id, *(row[0] for row in shared)]:
+                    if row_id in remaining:
+                        remaining.remove(row_id)
+                counts["items"] += 1 + len(shared)
+                counts["failures"] += (status not in ("success", "no_text")) * (1 + len(shared))
+                counts["deduplicated"] += len(shared)
     
     except sqlite3.Error as e:
         print(f"Error extracting PDFs: {e}")
+    
+    finally:
+        if remaining:
+            work_queue.release("pdf", remaining, worker)  # hand back unfinished pdfs
 
-    finally: 
-        if conn: 
-            conn.close()               # close connection
-    print("pdf processing complete!")  # print completion message
\ No newline at end of file
+    print("pdf processing complete!")  # print completion message
+    return counts
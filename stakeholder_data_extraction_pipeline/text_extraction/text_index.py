@@ -0,0 +1,127 @@
+import argparse
+import json
+import sqlite3
+from stakeholder_data_extraction_pipeline.database.connection import get_connection, transaction
+
+# full-text index over extracted html and pdf text (fts5 table created in migrations.py)
+# one row per document, rowid = url id (html_text.id / pdf_text.id), so re-extraction replaces the old text
+FTS_TABLE = "document_text_fts"
+TITLE_WEIGHT, TEXT_WEIGHT = 2.0, 1.0  # bm25 column weights, title matches rank higher
+
+def index_document(source, document_id, organization_id, title, text):
+    """ add or replace one extracted document in the full-text index (failures are printed, never raised) """
+    try:
+        with transaction() as conn:
+            conn.execute(f'''INSERT OR REPLACE INTO {FTS_TABLE} (rowid, title, text, source, organization_id)
+                             VALUES (?, ?, ?, ?, ?)''',
+                         (document_id, title or "", text or "", source, organization_id))
+    except sqlite3.Error as e:
+        print(f"Error indexing {source} document {document_id}: {e}")
+
+def read_extracted_json(source, json_path):
+    """ (title, text) from an extracted json file, html json has title/text, pdf json has title/pages """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if source == "pdf":
+        return data.get("title", ""), "\n".join(data.get("pages", {}).values())  # older pdf json has no title
+    return data.get("title", ""), data.get("text", "")
+
+def index_shared_document(source, json_path, rows):
+    """ index one extracted json for every (id, organization_id) row sharing its downloaded file """
+    if not rows:
+        return
+    try:
+        title, text = read_extracted_json(source, json_path)
+    except (OSError, ValueError) as e:
+        print(f"could not read {json_path}: {e}")
+        return
+    for document_id, organization_id in rows:
+        index_document(source, document_id, organization_id, title, text)
+
+def rebuild_index():
+    """ (re)index every successfully extracted document from its json file, returns the number indexed """
+    c = get_connection().cursor()
+    c.execute('''SELECT 'html', id, organization_id, extracted_text_path FROM html_text WHERE extract_status = 'success'
+                 UNION ALL
+                 SELECT 'pdf', id, organization_id, extracted_text_path FROM pdf_text WHERE extract_status = 'success' ''')
+    indexed = 0
+
+    for source, document_id, organization_id, json_path in c.fetchall():
+        try:
+            title, text = read_extracted_json(source, json_path)
+        except (OSError, ValueError) as e:
+            print(f"could not read {json_path}: {e}")
+            continue
+        index_document(source, document_id, organization_id, title, text)
+        indexed += 1
+
+    return indexed
+
+def _quote_terms(query):
+    """ turn free text into an fts query of quoted terms (for input that is not valid fts syntax, e.g. CBAM-related) """
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+def search(query, organization_ids=None, limit=10):
+    """
+    BM25-ranked full-text search, optionally limited to some organizations.
+    query uses fts5 syntax ("default values", cbam NEAR(certificate*), ...), plain text also works.
+    Returns a list of dicts (best match first) with ids, organization, score and a highlighted snippet.
+    """
+    org_filter = ""
+    params = []
+    if organization_ids:
+        org_filter = f"AND f.organization_id IN ({','.join('?' * len(organization_ids))})"
+        params = list(organization_ids)
+
+    sql = f'''SELECT f.rowid, f.source, f.organization_id, o.search_title, f.title,
+                     bm25({FTS_TABLE}, {TITLE_WEIGHT}, {TEXT_WEIGHT}, 0, 0) AS score,
+                     snippet({FTS_TABLE}, 1, '[', ']', ' … ', 24)
+              FROM {FTS_TABLE} AS f
+              LEFT JOIN organizations o ON o.id = f.organization_id
+              WHERE {FTS_TABLE} MATCH ? {org_filter}
+              ORDER BY score
+              LIMIT ?'''
+    conn = get_connection()
+
+    try:
+        rows = conn.execute(sql, [query, *params, limit]).fetchall()
+    except sqlite3.OperationalError:
+        rows = conn.execute(sql, [_quote_terms(query), *params, limit]).fetchall()  # retry as plain terms
+
+    columns = ("document_id", "source", "organization_id", "organization", "title", "score", "snippet")
+    return [dict(zip(columns, row)) for row in rows]
+
+def organization_ids_for(names):
+    """ organization ids matching search titles or registered titles """
+    c = get_connection().cursor()
+    ids = []
+    for name in names:
+        c.execute("SELECT id FROM organizations WHERE search_title = ? OR registered_organisation_title = ?", (name, name))
+        ids.extend(row[0] for row in c.fetchall())
+    return ids
+
+def main():
+    parser = argparse.ArgumentParser(description="search extracted stakeholder text")
+    parser.add_argument("query", nargs="?", help='fts5 query, e.g. "default values" or cbam AND certificate*')
+    parser.add_argument("--org", action="append", default=[], help="limit to an organization (search title, repeatable)")
+    parser.add_argument("--limit", type=int, default=10, help="number of results")
+    parser.add_argument("--rebuild", action="store_true", help="re-index all extracted json files first")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        print(f"indexed {rebuild_index()} documents")
+    if not args.query:
+        return
+
+    organization_ids = organization_ids_for(args.org) if args.org else None
+    if args.org and not organization_ids:
+        print(f"no organization found for {args.org}")
+        return
+
+    for hit in search(args.query, organization_ids, args.limit):
+        print(f"{hit['score']:8.2f}  {hit['organization'] or hit['organization_id']}  [{hit['source']} {hit['document_id']}] {hit['title']}")
+        print(f"          {hit['snippet']}\n")
+
+# OBS run from the same folder as main: python -m stakeholder_data_extraction_pipeline.text_extraction.text_index "default values" --org CEFIC
+if __name__ == "__main__":
+    main()